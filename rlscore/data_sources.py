@@ -19,9 +19,15 @@ PREDICTED_CLUSTERS_FOR_TRAINING_DATA = 'predicted_clusters_for_training_data'
 SELECTED_FEATURES = 'selected_features'
 GREEDYRLS_LOO_PERFORMANCES = 'GreedyRLS_LOO_performances'
 GREEDYRLS_TEST_PERFORMANCES = 'GreedyRLS_test_performances'
+GREEDYRLS_SELECTION_ROUNDS = 'GreedyRLS_selection_rounds'
+GREEDYRLS_EVALUATIONS = 'GreedyRLS_evaluations'
+CG_RESIDUALS = 'cg_residuals'
+CG_ITERATION_TIMES = 'cg_iteration_times'
 PARAMETERS = 'parameters'
 KMATRIX = 'kmatrix'
 REGGRID_RESULTS = 'mselection_performances'
+REGGRID_ITERATIONS = 'mselection_iterations'
+REGGRID_TIMES = 'mselection_times'
 TEST_PERFORMANCE = 'test_performance'
 FIXED_INDICES = 'fixed_indices'
 TRAIN_SET = 'train_set'
@@ -57,13 +63,19 @@ VARIABLE_TYPES = {
                   SELECTED_FEATURES: INT_LIST_TYPE,
                   GREEDYRLS_LOO_PERFORMANCES: FLOAT_LIST_TYPE,
                   GREEDYRLS_TEST_PERFORMANCES: FLOAT_LIST_TYPE,
+                  GREEDYRLS_SELECTION_ROUNDS: INT_LIST_TYPE,
+                  GREEDYRLS_EVALUATIONS: INT_LIST_TYPE,
+                  CG_RESIDUALS: FLOAT_LIST_TYPE,
+                  CG_ITERATION_TIMES: FLOAT_LIST_TYPE,
                   PARAMETERS: dict,
                   PERFORMANCE_MEASURE: "measure",
                   KMATRIX: "matrix",
                   TRAIN_SET: "data_set",
                   VALIDATION_SET: "data_set",
                   TEST_SET: "data_set",
-                  REGGRID_RESULTS: "matrix"
+                  REGGRID_RESULTS: "matrix",
+                  REGGRID_ITERATIONS: INT_LIST_TYPE,
+                  REGGRID_TIMES: FLOAT_LIST_TYPE
                   }
 
 COMPOSITES = {TRAIN_SET: (TRAIN_FEATURES, TRAIN_LABELS, TRAIN_QIDS),
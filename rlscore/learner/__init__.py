@@ -6,9 +6,10 @@ from cg_rls import CGRLS
 #from dual_bundle_learner import DualBundleLearner
 #from dual_cg_rankrls import DualCGRankRLS
 #from dual_rankrls import DualRankRLS
-#from floating_rls import FloatingRLS
+from floating_rls import FloatingRLS
 from kron_rls import KronRLS
-#from greedy_label_rankrls import GreedyLabelRankRLS
+from greedy_label_rankrls import GreedyLabelRankRLS
+from greedy_basis_rls import GreedyBasisRLS
 from greedy_rls import GreedyRLS
 #from kernel_dependency import KernelDependency
 from label_rankrls import LabelRankRLS
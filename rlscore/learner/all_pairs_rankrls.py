@@ -1,5 +1,7 @@
 
-from numpy import array, eye, float64, multiply, mat, ones, sqrt, sum, zeros
+from multiprocessing.pool import ThreadPool
+
+from numpy import array, diagonal, dot, empty, eye, float64, int64, multiply, mat, newaxis, ones, sqrt, sum, zeros
 import numpy.linalg as la
 from scipy import sparse
 import scipy.sparse.linalg as sla
@@ -136,137 +138,127 @@ class AllPairsRankRLS(AbstractSvdSupervisedLearner):
         results : list of float pairs
             leave-pair-out predictions
         """
+        F0, F1 = self.computePairwiseCVArrays(pairs, oind)
+        return zip(F0.tolist(), F1.tolist())
+    
+    
+    def computePairwiseCVArrays(self, pairs, oind=None, blocksize=100000, threads=1):
+        """Computes leave-pair-out predictions for a trained RankRLS, for arrays of pairs.
         
-        evals, svecs = self.evals, self.svecs
-        m = self.size
-        
-        Y = self.Y
+        The 3x3 closed form solve of each pair is carried out over a block of pairs at a
+        time, so that the memory use is bounded by blocksize, and the blocks can be
+        processed in parallel threads.
         
-        #This is, in the worst case, a cubic operation.
-        #If there are multiple outputs,
-        #this operation should be common for them all. THIS IS TO BE FIXED!
-        def computeG():
-            regparam = self.regparam
-            G = svecs * multiply(multiply(evals, 1. / ((m - 2.) * evals + regparam)).T, svecs.T)
-            return G
-        G = computeG()
+        Parameters
+        ----------
+        pairs: {array-like}, shape = [n_preferences, 2]
+            index pairs for which the leave-pair-out predictions are calculated
+        oind: int, optional
+            index of the label for which the predictions are computed (default all labels)
+        blocksize: int, optional
+            number of pairs processed at a time (default 100000)
+        threads: int, optional
+            number of threads processing the blocks (default 1)
         
-        GDY = (self.size - 2.) * G * Y
+        Returns
+        -------
+        F0 : array, shape = [n_preferences] or [n_preferences, n_labels] (if oind is None)
+            leave-pair-out predictions for the first examples of the pairs
+        F1 : array, shape = [n_preferences] or [n_preferences, n_labels] (if oind is None)
+            leave-pair-out predictions for the second examples of the pairs
+        """
+        pairs = array(pairs, dtype=int64).reshape(-1, 2)
+        m = self.size
+        Y = array(self.Y, dtype=float64)
+        if oind is not None:
+            Y = Y[:, [oind]]
+        
+        #G is common for all the pairs and outputs, and cached for the regularization parameter
+        if getattr(self, "lpo_regparam", None) != self.regparam:
+            evals, svecs = self.evals, self.svecs
+            self.lpo_G = array(svecs * multiply(multiply(evals, 1. / ((m - 2.) * evals + self.regparam)).T, svecs.T))
+            self.lpo_regparam = self.regparam
+        G = self.lpo_G
+        
+        sm2 = m - 2.
+        sqrtsm2 = sqrt(sm2)
+        GDY = sm2 * dot(G, Y)
         GC = sum(G, axis=1)
-        
         CTGC = sum(GC)
+        CTY = sum(Y, axis=0)
+        CTGDY = sum(GDY, axis=0)
+        Gdiag = diagonal(G).copy()
         
-        allresults = []
-        
-        CTY = sum(Y, axis=0)[0, oind]
-        CTGDY = sum(GDY, axis=0)[0, oind]
-        
-        sm2 = self.size - 2.
-        sqrtsm2 = sqrt(sm2)
-        
-        #Array is faster to access than matrix
-        G = array(G)
-        
-        #Lists are faster to access than matrices or arrays
-        def hack():
-            GDY_ = []
-            sqrtsm2GDY_ = []
-            GC_ = []
-            Y_ = []
-            BTY_ = []
-            Gdiag_ = []
-            sm2Gdiag_ = []
-            BTGBBTY_ = []
-            for i in range(m):
-                GDYi = GDY[i, oind]
-                GDY_.append(GDYi)
-                sqrtsm2GDY_.append(sqrtsm2 * GDYi)
-                GC_.append(GC[i, 0])
-                Yi = Y[i, oind]
-                Y_.append(Yi)
-                BTY_.append(sqrtsm2 * Yi)
-                Gii = G[i, i]
-                Gdiag_.append(Gii)
-                sm2Gdiag_.append(sm2 * Gii - 1.)
-                BTGBBTY_.append(sm2 * Gii * sqrtsm2 * Yi)
-            return GDY_, sqrtsm2GDY_, GC_, Y_, BTY_, Gdiag_, sm2Gdiag_, BTGBBTY_
-        GDY_, sqrtsm2GDY_, GC_, Y_, BTY_, Gdiag_, sm2Gdiag_, BTGBBTY_ = hack()
-        
-        results = []
+        F0 = empty((pairs.shape[0], Y.shape[1]))
+        F1 = empty((pairs.shape[0], Y.shape[1]))
         
-        #This loops through the list of hold-out pairs.
-        #Each pair is handled in a constant time.
-        def looppairs(results):
-            for i, j in pairs:
-                
-                Gii = Gdiag_[i]
-                Gij = G[i, j]
-                Gjj = Gdiag_[j]
-                
-                GCi = GC_[i]
-                GCj = GC_[j]
-                
-                Yi = Y_[i]
-                Yj = Y_[j]
-                
-                GDYi = GDY_[i]
-                GDYj = GDY_[j]
-                
-                BTY0 = CTY - Yi - Yj
-                BTY1 = BTY_[i]
-                BTY2 = BTY_[j]
-                
-                GiipGij = Gii + Gij
-                GijpGjj = Gij + Gjj
-                GCipGCj = GCi + GCj
-                
-                BTGB00 = GiipGij + GijpGjj + CTGC - GCipGCj - GCipGCj
-                BTGB01 = sqrtsm2 * (GCi - GiipGij)
-                BTGB02 = sqrtsm2 * (GCj - GijpGjj)
-                BTGB12 = sm2 * Gij
-                
-                BTGLY0 = CTGDY - (GDYi + GDYj + BTGB00 * BTY0 + BTGB01 * BTY1 + BTGB02 * BTY2)
-                BTGLY1 = sqrtsm2GDY_[i] - (BTGB01 * BTY0 + BTGBBTY_[i] + BTGB12 * BTY2)
-                BTGLY2 = sqrtsm2GDY_[j] - (BTGB02 * BTY0 + BTGB12 * BTY1 + BTGBBTY_[j])
-                
-                BTGB00m1 = BTGB00 - 1.
-                BTGB11m1 = sm2Gdiag_[i]
-                BTGB22m1 = sm2Gdiag_[j]
-                
-                CF00 = BTGB11m1 * BTGB22m1 - BTGB12 * BTGB12
-                CF01 = -BTGB01 * BTGB22m1 + BTGB12 * BTGB02
-                CF02 = BTGB01 * BTGB12 - BTGB11m1 * BTGB02
-                CF11 = BTGB00m1 * BTGB22m1 - BTGB02 * BTGB02
-                CF12 = -BTGB00m1 * BTGB12 + BTGB01 * BTGB02
-                CF22 = BTGB00m1 * BTGB11m1 - BTGB01 * BTGB01
-                
-                invdeter = 1. / (BTGB00m1 * CF00 + BTGB01 * CF01 + BTGB02 * CF02)
-                
-                b0 = invdeter * (CF00 * BTGLY0 + CF01 * BTGLY1 + CF02 * BTGLY2) + BTY0
-                b1 = invdeter * (CF01 * BTGLY0 + CF11 * BTGLY1 + CF12 * BTGLY2) + BTY1
-                b2 = invdeter * (CF02 * BTGLY0 + CF12 * BTGLY1 + CF22 * BTGLY2) + BTY2
-                
-                t1 = -b0 + sqrtsm2 * b1
-                t2 = -b0 + sqrtsm2 * b2
-                F0 = GDYi - (Gii * t1 + Gij * t2 + GCi * b0)
-                F1 = GDYj - (Gij * t1 + Gjj * t2 + GCj * b0)
-                
-                results.append((F0, F1))
-        looppairs(results)
-        #allresults.append(results)
-        # if Y.shape[1] > 1:
-            # allresultsvec = []
-            # for pairind in range(len(pairs)):
-                # F0 = mat(zeros((1, Y.shape[1]), dtype = float64))
-                # F1 = mat(zeros((1, Y.shape[1]), dtype = float64))
-                # for oind in range(Y.shape[1]):
-                    # F0[0, oind] = allresults[oind][pairind][0]
-                    # F1[0, oind] = allresults[oind][pairind][1]
-                # allresultsvec.append((F0,F1))
-            # return allresultsvec
-        # else:
-            # return allresults[0]
-        return results
+        def solveblock(start):
+            end = min(start + blocksize, pairs.shape[0])
+            I, J = pairs[start:end, 0], pairs[start:end, 1]
+            
+            #Quantities common for all the outputs are columns, broadcast against the outputs
+            Gii = Gdiag[I][:, newaxis]
+            Gij = G[I, J][:, newaxis]
+            Gjj = Gdiag[J][:, newaxis]
+            GCi = GC[I][:, newaxis]
+            GCj = GC[J][:, newaxis]
+            
+            Yi, Yj = Y[I], Y[J]
+            GDYi, GDYj = GDY[I], GDY[J]
+            
+            BTY0 = CTY - Yi - Yj
+            BTY1 = sqrtsm2 * Yi
+            BTY2 = sqrtsm2 * Yj
+            
+            GiipGij = Gii + Gij
+            GijpGjj = Gij + Gjj
+            GCipGCj = GCi + GCj
+            
+            BTGB00 = GiipGij + GijpGjj + CTGC - GCipGCj - GCipGCj
+            BTGB01 = sqrtsm2 * (GCi - GiipGij)
+            BTGB02 = sqrtsm2 * (GCj - GijpGjj)
+            BTGB12 = sm2 * Gij
+            
+            BTGLY0 = CTGDY - (GDYi + GDYj + BTGB00 * BTY0 + BTGB01 * BTY1 + BTGB02 * BTY2)
+            BTGLY1 = sqrtsm2 * GDYi - (BTGB01 * BTY0 + sm2 * Gii * BTY1 + BTGB12 * BTY2)
+            BTGLY2 = sqrtsm2 * GDYj - (BTGB02 * BTY0 + BTGB12 * BTY1 + sm2 * Gjj * BTY2)
+            
+            BTGB00m1 = BTGB00 - 1.
+            BTGB11m1 = sm2 * Gii - 1.
+            BTGB22m1 = sm2 * Gjj - 1.
+            
+            #Cofactors of the symmetric 3x3 matrix BTGB - I
+            CF00 = BTGB11m1 * BTGB22m1 - BTGB12 * BTGB12
+            CF01 = -BTGB01 * BTGB22m1 + BTGB12 * BTGB02
+            CF02 = BTGB01 * BTGB12 - BTGB11m1 * BTGB02
+            CF11 = BTGB00m1 * BTGB22m1 - BTGB02 * BTGB02
+            CF12 = -BTGB00m1 * BTGB12 + BTGB01 * BTGB02
+            CF22 = BTGB00m1 * BTGB11m1 - BTGB01 * BTGB01
+            
+            invdeter = 1. / (BTGB00m1 * CF00 + BTGB01 * CF01 + BTGB02 * CF02)
+            
+            b0 = invdeter * (CF00 * BTGLY0 + CF01 * BTGLY1 + CF02 * BTGLY2) + BTY0
+            b1 = invdeter * (CF01 * BTGLY0 + CF11 * BTGLY1 + CF12 * BTGLY2) + BTY1
+            b2 = invdeter * (CF02 * BTGLY0 + CF12 * BTGLY1 + CF22 * BTGLY2) + BTY2
+            
+            t1 = -b0 + sqrtsm2 * b1
+            t2 = -b0 + sqrtsm2 * b2
+            F0[start:end] = GDYi - (Gii * t1 + Gij * t2 + GCi * b0)
+            F1[start:end] = GDYj - (Gij * t1 + Gjj * t2 + GCj * b0)
+        
+        starts = range(0, pairs.shape[0], blocksize)
+        if threads > 1 and len(starts) > 1:
+            pool = ThreadPool(min(threads, len(starts)))
+            try:
+                pool.map(solveblock, starts)
+            finally:
+                pool.close()
+        else:
+            for start in starts:
+                solveblock(start)
+        if oind is not None:
+            return F0[:, 0], F1[:, 0]
+        return F0, F1
     
     
     def computeHO(self, indices):
@@ -350,11 +342,51 @@ class AllPairsRankRLS(AbstractSvdSupervisedLearner):
         return F
         
     def computeLOO(self):
+        """Computes leave-one-out predictions for a trained RankRLS.
         
-        LOO = mat(zeros((self.size, self.ysize), dtype=float64))
-        for i in range(self.size):
-            LOO[i,:] = self.computeHO([i])
-        return LOO
+        Leaving out example i changes the pairwise Laplacian L = m * I - 1 * 1.T into
+        (m - 1) * I - c * c.T - (m - 1) * e_i * e_i.T, where c = 1 - e_i. With
+        G = K * ((m - 1) * K + regparam * I)^-1, common for all the examples, the
+        prediction for i follows from a 2x2 solve, so all the predictions are computed
+        with a few products over the eigendecomposition and vectorized 2x2 solves.
+        
+        Returns
+        -------
+        F : matrix, shape = [n_samples, n_labels]
+            leave-one-out predictions
+        """
+        m = self.size
+        Y = array(self.Y, dtype=float64)
+        evals, V = array(self.evals, dtype=float64).ravel(), array(self.svecs, dtype=float64)
+        sm1 = m - 1.
+        newevals = evals / (sm1 * evals + self.regparam)
+        
+        #G * Y, G * 1, 1.T * G * 1 and diag(G)
+        GY = dot(V, newevals[:, newaxis] * dot(V.T, Y))
+        GC = dot(V, newevals * sum(V, axis=0))
+        CTGC = sum(GC)
+        Gdiag = dot(V * V, newevals)
+        CTY = sum(Y, axis=0)
+        CTGY = sum(GY, axis=0)
+        
+        #Quantities common for all the outputs are columns, broadcast against the outputs
+        Gii = Gdiag[:, newaxis]
+        GCi = (GC - Gdiag)[:, newaxis]
+        CiTY = CTY - Y
+        #e_i.T * G * L_i * Y and c.T * G * L_i * Y
+        GLY = sm1 * (GY - Gii * Y) - GCi * CiTY
+        CGLY = sm1 * (CTGY - GY - GCi * Y) - (CTGC - 2. * GC[:, newaxis] + Gii) * CiTY
+        
+        #The 2x2 matrices I - W.T * G * W for W = [c, sqrt(m - 1) * e_i]
+        M00 = 1. - (CTGC - 2. * GC + Gdiag)
+        M01 = - sqrt(sm1) * (GC - Gdiag)
+        M11 = 1. - sm1 * Gdiag
+        det = (M00 * M11 - M01 * M01)[:, newaxis]
+        M00, M01, M11 = M00[:, newaxis], M01[:, newaxis], M11[:, newaxis]
+        Z0 = (M11 * CGLY - M01 * sqrt(sm1) * GLY) / det
+        Z1 = (M00 * sqrt(sm1) * GLY - M01 * CGLY) / det
+        F = GLY + GCi * Z0 + sqrt(sm1) * Gii * Z1
+        return mat(F)
     
     def reference(self, pairs):
         
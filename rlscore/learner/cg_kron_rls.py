@@ -2,14 +2,15 @@
 
 import pyximport; pyximport.install()
 
+import time
+
 from numpy import *
 import numpy.linalg as la
 
 from scipy import sparse
-from scipy.sparse.linalg import LinearOperator
-from scipy.sparse.linalg import bicgstab
 
 from rlscore.learner.abstract_learner import AbstractIterativeLearner
+from rlscore.learner.kron_rls import PAIRWISE_KERNELS
 from rlscore import data_sources
 from rlscore import model
 from rlscore.utilities import array_tools
@@ -19,50 +20,312 @@ from rlscore.utilities import sparse_kronecker_multiplication_tools
 
 
 def c_gets_axb(x, A, B, label_row_inds, label_col_inds):
-    rc_a, cc_a = A.shape
-    rc_b, cc_b = B.shape
-    nzc_x = len(label_row_inds)
-    len_c = rc_a * cc_b
-    
-    if rc_a * cc_a * cc_b + cc_b * nzc_x < rc_b * cc_a * cc_b + cc_a * nzc_x:
-    #if False:
-        #print 'foo'
-        temp = mat(zeros((cc_a, cc_b)))
-        sparse_kronecker_multiplication_tools.sparse_mat_from_left(temp, x, B, label_row_inds, label_col_inds, nzc_x, cc_b)
-        temp = A * temp
-        return temp.reshape((len_c,), order='F')
-    else:
-        #print 'bar'
-        temp = mat(zeros((rc_a, rc_b)))
-        sparse_kronecker_multiplication_tools.sparse_mat_from_right(temp, x, A, label_row_inds, label_col_inds, nzc_x, rc_a)
-        temp = temp * B
-        return temp.reshape((len_c,), order='F')
+    return KronProductOperator(A, B, label_row_inds, label_col_inds).matvec(x)
 
 
 def u_gets_axb(xx, A, B, label_row_inds, label_col_inds):
-    rc_a, cc_a = A.shape
-    rc_b, cc_b = B.shape
-    nzc_u = len(label_row_inds)
-    len_c = rc_a * cc_b
-    
-    x_after = zeros(nzc_u)
-    temp = xx.reshape((cc_a, rc_b), order='F')
-    
-    if rc_a * cc_a * cc_b + cc_b * nzc_u < rc_b * cc_a * cc_b + cc_a * nzc_u:
-    #if False:
-    #if True:
-        temp = A * temp
-        #temp = mat(zeros((cc_a, cc_b)))
-        #sparse_kronecker_multiplication_tools.sparse_mat_from_left(temp, x, B, label_row_inds, label_col_inds, nzc_x, cc_b)
-        sparse_kronecker_multiplication_tools.compute_subset_of_matprod_entries(x_after, temp, B, label_row_inds, label_col_inds, nzc_u, rc_b)
-        return x_after
+    return KronProductOperator(A, B, out_row_inds = label_row_inds, out_col_inds = label_col_inds).matvec(xx)
+
+
+class KronProductOperator(object):
+    """Computes products A * X * B, where either X, the result, or both are
+    restricted to a set of (row, column) index pairs.
+    
+    The multiplication order is chosen once, when the operator is created, and
+    the work buffers are allocated only once, so that repeated products, such
+    as the ones made on each conjugate gradient iteration, do not allocate
+    memory. Sparse matrices are converted to dense arrays, as the products over the
+    index pairs are computed with dense kernels.
+    
+    Parameters
+    ----------
+    A: {array-like, sparse matrix}, shape = [rc_a, cc_a]
+        left matrix
+    B: {array-like, sparse matrix}, shape = [rc_b, cc_b]
+        right matrix
+    row_inds, col_inds: array of ints, shape = [n_in], optional
+        pairs of X = [cc_a, rc_b] given as input. If None, X is given in full
+        as a vector of length cc_a * rc_b in column-major order.
+    out_row_inds, out_col_inds: array of ints, shape = [n_out], optional
+        pairs of the result [rc_a, cc_b] to be computed. If None, the full
+        result is returned as a vector of length rc_a * cc_b in column-major order.
+    """
+    
+    def __init__(self, A, B, row_inds = None, col_inds = None, out_row_inds = None, out_col_inds = None):
+        self.A = asarray(array_tools.as_array(A), dtype=float64)
+        self.B = asarray(array_tools.as_array(B), dtype=float64)
+        rc_a, cc_a = self.A.shape
+        rc_b, cc_b = self.B.shape
+        if row_inds is None and out_row_inds is None:
+            raise Exception("Either the input or the output of KronProductOperator must be given as pairs")
+        if row_inds is None:
+            self.sparse_in = False
+            insize = cc_a * rc_b
+        else:
+            self.sparse_in = True
+            self.row_inds = array(row_inds, dtype=int32)
+            self.col_inds = array(col_inds, dtype=int32)
+            insize = len(self.row_inds)
+        if out_row_inds is None:
+            self.sparse_out = False
+            outsize = rc_a * cc_b
+        else:
+            self.sparse_out = True
+            self.out_row_inds = array(out_row_inds, dtype=int32)
+            self.out_col_inds = array(out_col_inds, dtype=int32)
+            outsize = len(self.out_row_inds)
+        self.shape = (outsize, insize)
+        
+        if self.sparse_in and self.sparse_out:
+            self.left_first = insize * cc_b + outsize * cc_a <= insize * rc_a + outsize * rc_b
+        else:
+            if self.sparse_in: nzc = insize
+            else: nzc = outsize
+            self.left_first = rc_a * cc_a * cc_b + cc_b * nzc < rc_b * cc_a * cc_b + cc_a * nzc
+        
+        #With the input given as pairs, the left first order scatters X * B
+        #into the work buffer, otherwise it computes A * X into it
+        self.temp_is_xb = self.left_first == self.sparse_in
+        if self.temp_is_xb:
+            self.temp = zeros((cc_a, cc_b))
+        else:
+            self.temp = zeros((rc_a, rc_b))
+    
+    
+    def matvec(self, v, out = None):
+        """Computes the product with a vector.
+        
+        Parameters
+        ----------
+        v: array, shape = [n_in]
+            input vector
+        out: array, shape = [n_out], optional
+            array the result is written into
+        
+        Returns
+        -------
+        out: array, shape = [n_out]
+            result
+        """
+        A, B, temp = self.A, self.B, self.temp
+        rc_a, cc_a = A.shape
+        rc_b, cc_b = B.shape
+        v = asarray(v, dtype=float64).ravel()
+        if out is None:
+            out = zeros(self.shape[0])
+        
+        if self.sparse_in:
+            temp.fill(0.)
+            if self.left_first:
+                sparse_kronecker_multiplication_tools.sparse_mat_from_left(temp, v, B, self.row_inds, self.col_inds, self.shape[1], cc_b)
+            else:
+                sparse_kronecker_multiplication_tools.sparse_mat_from_right(temp, v, A, self.row_inds, self.col_inds, self.shape[1], rc_a)
+        else:
+            X = v.reshape((cc_a, rc_b), order='F')
+            if self.left_first:
+                dot(A, X, out = temp)
+            else:
+                dot(X, B, out = temp)
+        
+        if self.sparse_out:
+            if self.temp_is_xb:
+                sparse_kronecker_multiplication_tools.compute_subset_of_matprod_entries(out, A, temp, self.out_row_inds, self.out_col_inds, self.shape[0], cc_a)
+            else:
+                sparse_kronecker_multiplication_tools.compute_subset_of_matprod_entries(out, temp, B, self.out_row_inds, self.out_col_inds, self.shape[0], rc_b)
+        else:
+            #The transpose of the column-major result grid is a row-major view of out
+            outT = out.reshape((cc_b, rc_a))
+            if self.temp_is_xb:
+                dot(temp.T, A.T, out = outT)
+            else:
+                dot(B.T, temp.T, out = outT)
+        return out
+
+
+def pairwise_kernel_operator(K1, K2, label_row_inds, label_col_inds, pairwise_kernel = 'kronecker'):
+    """Returns a function mv(v, out) computing the product of the pairwise kernel matrix
+    of the labeled pairs with a vector, writing the result into out.
+    
+    The Cartesian kernel is the sum of two Kronecker products with identity matrices, and
+    the symmetric kernels combine products with the pairs given in both orders.
+    """
+    rows, cols = label_row_inds, label_col_inds
+    if pairwise_kernel == 'cartesian':
+        terms = [(1., KronProductOperator(K1, eye(K2.shape[0]), rows, cols, rows, cols)),
+                 (1., KronProductOperator(eye(K1.shape[0]), K2, rows, cols, rows, cols))]
+    elif pairwise_kernel in ['symmetric', 'anti_symmetric']:
+        if pairwise_kernel == 'symmetric': sign = 1.
+        else: sign = -1.
+        terms = [(0.5, KronProductOperator(K1, K2, rows, cols, rows, cols)),
+                 (sign * 0.5, KronProductOperator(K1, K2, cols, rows, rows, cols))]
+    else:
+        terms = [(1., KronProductOperator(K1, K2, rows, cols, rows, cols))]
+    temp = zeros(len(rows))
+    def mv(v, out):
+        coef, op = terms[0]
+        op.matvec(v, out)
+        if coef != 1.:
+            multiply(out, coef, out)
+        for coef, op in terms[1:]:
+            op.matvec(v, temp)
+            multiply(temp, coef, temp)
+            add(out, temp, out)
+        return out
+    return mv
+
+
+def pcg(mv, b, precond=None, x0=None, tol=1e-5, maxiter=None, callback=None):
+    """Preconditioned conjugate gradient for symmetric positive definite systems.
+    
+    Parameters
+    ----------
+    mv: function
+        computes the product of the system matrix with a vector
+    b: array, shape = [n]
+        right hand side
+    precond: function, optional
+        applies the inverse of the preconditioner to a vector
+    x0: array, shape = [n], optional
+        starting point (default zero vector)
+    tol: float, optional
+        relative tolerance, iteration stops when ||b - Ax|| <= tol * ||b||
+    maxiter: int, optional
+        maximum number of iterations (default 10 * n)
+    callback: function, optional
+        called with the current solution after each iteration
+    
+    Returns
+    -------
+    x: array, shape = [n]
+        solution
+    info: int
+        0 on convergence, otherwise the number of iterations performed
+    residuals: list of floats
+        residual norms, starting from the initial residual
+    times: list of floats
+        wall clock time spent on each iteration
+    """
+    b = asarray(b, dtype=float64).ravel()
+    n = b.shape[0]
+    if maxiter == None:
+        maxiter = 10 * n
+    if x0 is None:
+        x = zeros(n)
+        r = b.copy()
+    else:
+        x = array(x0, dtype=float64).ravel()
+        r = b - asarray(mv(x)).ravel()
+    bnorm = la.norm(b)
+    if bnorm == 0.:
+        bnorm = 1.
+    rnorm = la.norm(r)
+    residuals = [rnorm]
+    times = []
+    if rnorm <= tol * bnorm:
+        return x, 0, residuals, times
+    if precond == None:
+        z = r.copy()
+    else:
+        z = asarray(precond(r)).ravel()
+    p = z.copy()
+    rz = dot(r, z)
+    info = maxiter
+    for iteration in range(maxiter):
+        starttime = time.time()
+        Ap = asarray(mv(p)).ravel()
+        alpha = rz / dot(p, Ap)
+        x += alpha * p
+        r -= alpha * Ap
+        rnorm = la.norm(r)
+        converged = rnorm <= tol * bnorm
+        if not converged:
+            if precond == None:
+                z = r.copy()
+            else:
+                z = asarray(precond(r)).ravel()
+            rz_new = dot(r, z)
+            p *= rz_new / rz
+            p += z
+            rz = rz_new
+        times.append(time.time() - starttime)
+        residuals.append(rnorm)
+        if callback != None:
+            callback(x)
+        if converged:
+            info = 0
+            break
+    return x, info, residuals, times
+
+
+def kronecker_eigen_preconditioner(K1, K2, regparam, label_row_inds, label_col_inds, pairwise_kernel = 'kronecker'):
+    """Preconditioner based on the inverse of the complete Kronecker product system.
+    
+    The vector is scattered to the full grid, multiplied with the inverse of
+    (K2 x K1 + regparam * I) computed from the eigen decompositions of K1 and K2,
+    and gathered back to the labeled pairs. The other pairwise kernels share the
+    eigenvectors of the Kronecker product kernel.
+    """
+    evals1, V = la.eigh(K1)
+    evals2, U = la.eigh(K2)
+    V, U = asarray(V), asarray(U)
+    if pairwise_kernel == 'cartesian':
+        newevals = 1. / (add.outer(evals1, evals2) + regparam)
     else:
-        temp = temp * B
-        sparse_kronecker_multiplication_tools.compute_subset_of_matprod_entries(x_after, A, temp, label_row_inds, label_col_inds, nzc_u, cc_a)
-        return x_after
+        newevals = 1. / (multiply.outer(evals1, evals2) + regparam)
+    gridshape = (K1.shape[0], K2.shape[0])
+    def precond(v):
+        Z = zeros(gridshape)
+        add.at(Z, (label_row_inds, label_col_inds), v)
+        if pairwise_kernel in ['symmetric', 'anti_symmetric']:
+            #The part outside the span of the kernel is only regularized
+            if pairwise_kernel == 'symmetric':
+                Zspan = 0.5 * (Z + Z.T)
+            else:
+                Zspan = 0.5 * (Z - Z.T)
+            Znull = (Z - Zspan) / regparam
+            Z = Zspan
+        Z = dot(dot(V.T, Z), U)
+        Z *= newevals
+        Z = dot(dot(V, Z), U.T)
+        if pairwise_kernel in ['symmetric', 'anti_symmetric']:
+            Z += Znull
+        return Z[label_row_inds, label_col_inds]
+    return precond
 
 
 class CGKronRLS(AbstractIterativeLearner):
+    """Conjugate gradient Kronecker RLS for learning from an incomplete set of labeled pairs.
+    
+    Parameters
+    ----------
+    train_labels: {array-like}, shape = [n_labeled_pairs]
+        labels of the labeled pairs
+    label_row_inds: list of ints, shape = [n_labeled_pairs]
+        row indices of the labeled pairs
+    label_col_inds: list of ints, shape = [n_labeled_pairs]
+        column indices of the labeled pairs
+    regparam: float (regparam > 0)
+        regularization parameter
+    kmatrix1, kmatrix2: {array-like}, optional
+        kernel matrices of the two domains (kernel mode)
+    xmatrix1, xmatrix2: {array-like}, optional
+        data matrices of the two domains (linear mode)
+    maxiter: int, optional
+        maximum number of conjugate gradient iterations
+    tol: float, optional
+        relative residual tolerance of conjugate gradient (default 1e-5)
+    preconditioner: {None, 'jacobi', 'kronecker'}, optional
+        'jacobi' uses the diagonal of the system matrix, 'kronecker' the inverse
+        of the system matrix of the complete Kronecker product grid
+    pairwise_kernel: {'kronecker', 'cartesian', 'symmetric', 'anti_symmetric'}, optional
+        kernel on the pairs (default 'kronecker'). The Cartesian kernel is supported
+        only in the kernel mode, and the symmetric kernels require the same matrix for
+        both domains (in the linear mode without preconditioning).
+    warm_start: bool, optional
+        if True, each training starts the conjugate gradient iterations from the
+        solution of the previous one instead of zero (default False). Useful when
+        sweeping a regularization path, see AbstractSelection.
+    """
     
     '''def __init__(self, train_labels, label_row_inds, label_col_inds, regparam=1.0):
         self.Y = array_tools.as_labelmatrix(train_labels)
@@ -83,6 +346,36 @@ class CGKronRLS(AbstractIterativeLearner):
             self.callbackfun = self.resource_pool[data_sources.CALLBACK_FUNCTION]
         else:
             self.callbackfun = None
+        if 'maxiter' in self.resource_pool: self.maxiter = int(self.resource_pool['maxiter'])
+        else: self.maxiter = None
+        if 'tol' in self.resource_pool: self.tol = float(self.resource_pool['tol'])
+        else: self.tol = 1e-5
+        #Supported preconditioners are None, 'jacobi' and 'kronecker'
+        if 'preconditioner' in self.resource_pool: self.preconditioner = self.resource_pool['preconditioner']
+        else: self.preconditioner = None
+        if not self.preconditioner in [None, 'jacobi', 'kronecker']:
+            raise Exception("Unknown preconditioner '" + str(self.preconditioner) + "', the supported ones are 'jacobi' and 'kronecker'")
+        if 'pairwise_kernel' in self.resource_pool: self.pairwise_kernel = self.resource_pool['pairwise_kernel']
+        else: self.pairwise_kernel = 'kronecker'
+        if not self.pairwise_kernel in PAIRWISE_KERNELS:
+            raise Exception("Unknown pairwise kernel '" + str(self.pairwise_kernel) + "', the supported ones are " + ", ".join(PAIRWISE_KERNELS))
+        self.warm_start = self.resource_pool.get('warm_start', False)
+        self.cg_solution = None
+        self.results = {}
+    
+    
+    def solve(self, regparam):
+        """Trains the learning algorithm, using the given regularization parameter.
+        
+        This implementation simply changes the regparam, and then calls the train method.
+        
+        Parameters
+        ----------
+        regparam: float (regparam > 0)
+            regularization parameter
+        """
+        self.resource_pool['regparam'] = regparam
+        self.train()
     
     
     def train(self):
@@ -99,33 +392,52 @@ class CGKronRLS(AbstractIterativeLearner):
         K2 = mat(self.resource_pool['kmatrix2'])
         lsize = len(self.label_row_inds) #n
         
-        if 'maxiter' in self.resource_pool: maxiter = int(self.resource_pool['maxiter'])
-        else: maxiter = None
-        
         label_row_inds = self.label_row_inds
         label_col_inds = self.label_col_inds
+        if self.pairwise_kernel in ['symmetric', 'anti_symmetric'] and not (K1.shape == K2.shape and (K1 == K2).all()):
+            raise Exception("The " + self.pairwise_kernel + " pairwise kernel requires identical matrices for both domains.")
         
-        temp = zeros((K1.shape[1], K2.shape[0]))
-        v_after = zeros((len(self.label_row_inds),))
-        #Y = self.Y
-        #self.itercount = 0
+        kernelmv = pairwise_kernel_operator(K1, K2, label_row_inds, label_col_inds, self.pairwise_kernel)
+        v_after = zeros(lsize)
+        v_reg = zeros(lsize)
         def mv(v):
-            assert v.shape[0] == len(self.label_row_inds)
-            temp = zeros((K1.shape[1], K2.shape[0]))
-            sparse_kronecker_multiplication_tools.sparse_mat_from_left(temp, v, K2, label_row_inds, label_col_inds, lsize, K2.shape[0])
-            v_after = zeros(v.shape[0])
-            #print K1.shape, temp.shape
-            sparse_kronecker_multiplication_tools.compute_subset_of_matprod_entries(v_after, K1, temp, label_row_inds, label_col_inds, lsize, K1.shape[0])
-            return v_after + regparam * v
+            assert v.shape[0] == lsize
+            kernelmv(v, v_after)
+            multiply(v, regparam, v_reg)
+            add(v_after, v_reg, v_after)
+            return v_after
         
-        def mvr(v):
-            foofoo
-            raise Exception('You should not be here!')
-            return None
+        if self.preconditioner == 'jacobi':
+            K1diag = K1.diagonal().A.ravel()[label_row_inds]
+            K2diag = K2.diagonal().A.ravel()[label_col_inds]
+            if self.pairwise_kernel == 'cartesian':
+                kerneldiag = K1diag + K2diag
+            elif self.pairwise_kernel == 'kronecker':
+                kerneldiag = multiply(K1diag, K2diag)
+            else:
+                crossterms = multiply(K1.A[label_row_inds, label_col_inds], K2.A[label_col_inds, label_row_inds])
+                if self.pairwise_kernel == 'symmetric':
+                    kerneldiag = 0.5 * (multiply(K1diag, K2diag) + crossterms)
+                else:
+                    kerneldiag = 0.5 * (multiply(K1diag, K2diag) - crossterms)
+            invdiag = 1. / (kerneldiag + regparam)
+            precond = lambda v: invdiag * v
+        elif self.preconditioner == 'kronecker':
+            precond = kronecker_eigen_preconditioner(K1, K2, regparam, label_row_inds, label_col_inds, self.pairwise_kernel)
+        else:
+            precond = None
         
-        G = LinearOperator((len(self.label_row_inds), len(self.label_row_inds)), matvec=mv, rmatvec=mvr, dtype=float64)
-        self.A = bicgstab(G, self.Y, maxiter = maxiter)[0]
-        self.model = KernelPairwiseModel(self.A, self.label_row_inds, self.label_col_inds)
+        self.A = self.pcg(mv, self.Y, precond)
+        if self.pairwise_kernel == 'cartesian':
+            self.model = CartesianPairwiseModel(self.A, label_row_inds, label_col_inds)
+        elif self.pairwise_kernel in ['symmetric', 'anti_symmetric']:
+            #Both orders of each labeled pair contribute to the predictions
+            if self.pairwise_kernel == 'symmetric': sign = 1.
+            else: sign = -1.
+            A = concatenate([0.5 * asarray(self.A).ravel(), sign * 0.5 * asarray(self.A).ravel()])
+            self.model = KernelPairwiseModel(A, concatenate([label_row_inds, label_col_inds]), concatenate([label_col_inds, label_row_inds]))
+        else:
+            self.model = KernelPairwiseModel(self.A, self.label_row_inds, self.label_col_inds)
     
     
     def solve_linear(self, regparam):
@@ -133,9 +445,14 @@ class CGKronRLS(AbstractIterativeLearner):
         X1 = mat(self.resource_pool['xmatrix1'])
         X2 = mat(self.resource_pool['xmatrix2'])
         self.X1, self.X2 = X1, X2
-        
-        if 'maxiter' in self.resource_pool: maxiter = int(self.resource_pool['maxiter'])
-        else: maxiter = None
+        if self.pairwise_kernel == 'cartesian':
+            raise Exception("The Cartesian pairwise kernel is supported only with kernel matrices.")
+        symmetric = self.pairwise_kernel in ['symmetric', 'anti_symmetric']
+        if symmetric:
+            if not (X1.shape == X2.shape and (X1 == X2).all()):
+                raise Exception("The " + self.pairwise_kernel + " pairwise kernel requires identical matrices for both domains.")
+            if self.preconditioner != None:
+                raise Exception("Preconditioning is not supported for the " + self.pairwise_kernel + " pairwise kernel in the linear mode.")
         
         x1tsize, x1fsize = X1.shape #m, d
         x2tsize, x2fsize = X2.shape #q, r
@@ -146,30 +463,72 @@ class CGKronRLS(AbstractIterativeLearner):
         label_row_inds = array(self.label_row_inds, dtype=int32)
         label_col_inds = array(self.label_col_inds, dtype=int32)
         
+        predop = KronProductOperator(X1, X2.T, out_row_inds = label_row_inds, out_col_inds = label_col_inds)
+        gradop = KronProductOperator(X1.T, X2, label_row_inds, label_col_inds)
+        p_after = zeros(lsize)
+        v_after = zeros(kronfcount)
+        v_reg = zeros(kronfcount)
+        
+        def project(v):
+            #Projection of the coefficients to the (anti-)symmetric matrices spanned by the kernel
+            if not symmetric:
+                return v
+            W = v.reshape((x1fsize, x2fsize), order='F')
+            if self.pairwise_kernel == 'symmetric':
+                return (0.5 * (W + W.T)).ravel(order='F')
+            else:
+                return (0.5 * (W - W.T)).ravel(order='F')
+        
         def mv(v):
-            v_after = u_gets_axb(v, X1, X2.T, label_row_inds, label_col_inds)
-            v_after = c_gets_axb(v_after, X1.T, X2, label_row_inds, label_col_inds) + regparam * v
+            predop.matvec(project(v), p_after)
+            gradop.matvec(p_after, v_after)
+            v_after[:] = project(v_after)
+            multiply(v, regparam, v_reg)
+            add(v_after, v_reg, v_after)
             return v_after
         
-        def mvr(v):
-            raise Exception('You should not be here!')
-            return None
-        
         def cgcb(v):
             self.W = mat(v).T.reshape((x1fsize, x2fsize),order='F')
             self.callback()
-            
-        G = LinearOperator((kronfcount, kronfcount), matvec=mv, rmatvec=mvr, dtype=float64)
         
-        v_init = array(self.Y).reshape(self.Y.shape[0])
-        v_init = c_gets_axb(v_init, X1.T, X2, label_row_inds, label_col_inds)
-        v_init = array(v_init).reshape(kronfcount)
-        self.W = mat(bicgstab(G, v_init, maxiter = maxiter, callback = cgcb)[0]).T.reshape((x1fsize, x2fsize),order='F')
+        if self.preconditioner == 'jacobi':
+            #The diagonal of (X2 x X1)^T B^T B (X2 x X1) consists of sums of the squared feature products over the labeled pairs
+            X1sqr, X2sqr = multiply(X1, X1), multiply(X2, X2)
+            invdiag = 1. / (c_gets_axb(ones(lsize), X1sqr.T, X2sqr, label_row_inds, label_col_inds) + regparam)
+            precond = lambda v: invdiag * v
+        elif self.preconditioner == 'kronecker':
+            evals1, V = la.eigh(X1.T * X1)
+            evals2, U = la.eigh(X2.T * X2)
+            V, U = asarray(V), asarray(U)
+            newevals = 1. / (multiply.outer(evals1, evals2) + regparam)
+            def precond(v):
+                Z = v.reshape((x1fsize, x2fsize), order='F')
+                Z = dot(dot(V.T, Z), U)
+                Z *= newevals
+                Z = dot(dot(V, Z), U.T)
+                return Z.ravel(order='F')
+        else:
+            precond = None
+        
+        v_init = project(gradop.matvec(self.Y))
+        self.W = mat(self.pcg(mv, v_init, precond, cgcb)).T.reshape((x1fsize, x2fsize),order='F')
         self.model = LinearPairwiseModel(self.W, X1.shape[1], X2.shape[1])
         self.finished()
     
     
     
+    def pcg(self, mv, b, precond, callback = None):
+        x0 = None
+        if self.warm_start and self.cg_solution is not None and self.cg_solution.shape[0] == asarray(b).size:
+            x0 = self.cg_solution
+        x, info, residuals, times = pcg(mv, b, precond, x0 = x0, tol = self.tol, maxiter = self.maxiter, callback = callback)
+        self.cg_solution = x.copy()
+        self.results['cg_iterations'] = len(times)
+        self.results[data_sources.CG_RESIDUALS] = residuals
+        self.results[data_sources.CG_ITERATION_TIMES] = times
+        return x
+    
+    
     def getModel(self):
         if not hasattr(self, "model"):
             self.model = LinearPairwiseModel(self.W, self.X1.shape[1], self.X2.shape[1])
@@ -202,8 +561,119 @@ class KernelPairwiseModel(object):
         P: array, shape = [n_samples1, n_samples2]
             predictions
         """
-        P = c_gets_axb(self.A, K1pred, K2pred.T, self.label_row_inds, self.label_col_inds)
-        P = mat(P).reshape((K1pred.shape[0], K2pred.shape[0]), order='F')
+        kronop = KronProductOperator(K1pred, K2pred.T, self.label_row_inds, self.label_col_inds)
+        P = mat(kronop.matvec(self.A)).reshape((K1pred.shape[0], K2pred.shape[0]), order='F')
+        return P
+    
+    
+    def predict_pairs(self, K1pred, K2pred, row_inds, col_inds):
+        """Computes predictions for a set of test pairs without computing the full prediction grid.
+        
+        Parameters
+        ----------
+        K1pred: {array-like, sparse matrix}, shape = [n_samples1, n_basis_functions1]
+            the first part of the test data matrix
+        K2pred: {array-like, sparse matrix}, shape = [n_samples2, n_basis_functions2]
+            the second part of the test data matrix
+        row_inds: list of ints, shape = [n_pairs]
+            rows of K1pred of the test pairs
+        col_inds: list of ints, shape = [n_pairs]
+            rows of K2pred of the test pairs
+        
+        Returns
+        ----------
+        P: array, shape = [n_pairs]
+            predictions for the test pairs
+        """
+        kronop = KronProductOperator(K1pred, K2pred.T, self.label_row_inds, self.label_col_inds, row_inds, col_inds)
+        return kronop.matvec(self.A)
+    
+    
+    def createTopKIndex(self, K2pred):
+        """Builds an index for retrieving the top scoring pairs without computing all predictions.
+        
+        Parameters
+        ----------
+        K2pred: {array-like, sparse matrix}, shape = [n_samples2, n_basis_functions2]
+            the second part of the test data matrix
+        
+        Returns
+        ----------
+        index: TopKPairIndex
+            index to be queried with the first part of the test data matrix
+        """
+        #Only the rows of the training data that have labeled pairs contribute to the predictions
+        basis_inds = unique(self.label_row_inds)
+        row_positions = array(searchsorted(basis_inds, self.label_row_inds), dtype=int32)
+        K2predT = asarray(array_tools.as_array(K2pred).T, dtype=float64)
+        R = zeros((len(basis_inds), K2predT.shape[1]))
+        sparse_kronecker_multiplication_tools.sparse_mat_from_left(R, asarray(self.A, dtype=float64).ravel(), K2predT, row_positions, self.label_col_inds, len(self.label_row_inds), K2predT.shape[1])
+        return model.TopKPairIndex(R, basis_inds)
+
+
+class CartesianPairwiseModel(object):
+    
+    def __init__(self, A, label_row_inds, label_col_inds):
+        """Initializes the dual model of the Cartesian pairwise kernel
+        @param A: dual coefficients of the labeled pairs
+        @type A: numpy array"""
+        self.A = A
+        self.label_row_inds, self.label_col_inds = label_row_inds, label_col_inds
+    
+    
+    def predictWithKernelMatrices(self, K1pred, K2pred, I1pred = None, I2pred = None):
+        """Computes predictions for test examples.
+        
+        The Cartesian kernel compares pairs sharing an object, so the test
+        examples known from training are given with the indicator matrices.
+        
+        Parameters
+        ----------
+        K1pred: {array-like, sparse matrix}, shape = [n_samples1, n_train_samples1]
+            the first part of the test data matrix
+        K2pred: {array-like, sparse matrix}, shape = [n_samples2, n_train_samples2]
+            the second part of the test data matrix
+        I1pred: {array-like, sparse matrix}, shape = [n_samples1, n_train_samples1], optional
+            entry (i, j) is 1 if the i:th test example of the first domain is the j:th
+            training example and 0 otherwise, by default all test examples are new
+        I2pred: {array-like, sparse matrix}, shape = [n_samples2, n_train_samples2], optional
+            the same for the second domain
+        
+        Returns
+        ----------
+        P: array, shape = [n_samples1, n_samples2]
+            predictions
+        """
+        P = zeros(K1pred.shape[0] * K2pred.shape[0])
+        if I2pred is not None:
+            P += KronProductOperator(array_tools.as_array(K1pred), array_tools.as_array(I2pred).T, self.label_row_inds, self.label_col_inds).matvec(self.A)
+        if I1pred is not None:
+            P += KronProductOperator(array_tools.as_array(I1pred), array_tools.as_array(K2pred).T, self.label_row_inds, self.label_col_inds).matvec(self.A)
+        return mat(P).reshape((K1pred.shape[0], K2pred.shape[0]), order='F')
+    
+    
+    def predict_pairs(self, K1pred, K2pred, row_inds, col_inds, I1pred = None, I2pred = None):
+        """Computes predictions for a set of test pairs without computing the full prediction grid.
+        
+        Parameters
+        ----------
+        K1pred, K2pred, I1pred, I2pred:
+            as in predictWithKernelMatrices
+        row_inds: list of ints, shape = [n_pairs]
+            rows of K1pred of the test pairs
+        col_inds: list of ints, shape = [n_pairs]
+            rows of K2pred of the test pairs
+        
+        Returns
+        ----------
+        P: array, shape = [n_pairs]
+            predictions for the test pairs
+        """
+        P = zeros(len(row_inds))
+        if I2pred is not None:
+            P += KronProductOperator(array_tools.as_array(K1pred), array_tools.as_array(I2pred).T, self.label_row_inds, self.label_col_inds, row_inds, col_inds).matvec(self.A)
+        if I1pred is not None:
+            P += KronProductOperator(array_tools.as_array(I1pred), array_tools.as_array(K2pred).T, self.label_row_inds, self.label_col_inds, row_inds, col_inds).matvec(self.A)
         return P
 
 
@@ -241,8 +711,25 @@ class LinearPairwiseModel(object):
             P = X1pred * self.W * X2pred.T
             P = P.reshape(X1pred.shape[0] * X2pred.shape[0], 1, order = 'F')
         else:
-            P = u_gets_axb(self.W.reshape((self.W.shape[0] * self.W.shape[1], 1), order = 'F'), X1pred, X2pred.T, array(row_inds, dtype=int32), array(col_inds, dtype=int32))
+            kronop = KronProductOperator(X1pred, X2pred.T, out_row_inds = row_inds, out_col_inds = col_inds)
+            P = kronop.matvec(self.W.reshape((self.W.shape[0] * self.W.shape[1], 1), order = 'F'))
             #P = X1pred * self.W * X2pred.T
         return P
+    
+    
+    def createTopKIndex(self, X2pred):
+        """Builds an index for retrieving the top scoring pairs without computing all predictions.
+        
+        Parameters
+        ----------
+        X2pred: {array-like, sparse matrix}, shape = [n_samples2, n_features2]
+            the second part of the test data matrix
+        
+        Returns
+        ----------
+        index: TopKPairIndex
+            index to be queried with the first part of the test data matrix
+        """
+        return model.TopKPairIndex(self.W * X2pred.T)
 
 
@@ -13,6 +13,7 @@ from rlscore.learner.abstract_learner import AbstractIterativeLearner
 from rlscore import data_sources
 from rlscore import model
 from rlscore.utilities import array_tools
+from rlscore.utilities.query_structure import QueryStructure
 from rlscore.measure import measure_utilities
 from rlscore.measure import sqmprank
 
@@ -61,6 +62,10 @@ class CGRankRLS(AbstractIterativeLearner):
         Validation set labels, needed if early stopping used
     validation_qids: list of n_queries index lists, optional, optional
         Validation set qids, may be used with early stopping
+    warm_start: bool, optional
+        if True, each call of solve starts the conjugate gradient iterations from the
+        solution of the previous call instead of zero (default False). Useful when
+        sweeping a regularization path, see AbstractSelection.
  
        
     References
@@ -107,6 +112,8 @@ class CGRankRLS(AbstractIterativeLearner):
         if data_sources.TRAIN_QIDS in self.resource_pool:
             qids = self.resource_pool[data_sources.TRAIN_QIDS]
             self.setQids(qids)
+        self.warm_start = self.resource_pool.get('warm_start', False)
+        self.cg_solution = None
         self.results = {}
             
     def setQids(self, qids):
@@ -115,30 +122,8 @@ class CGRankRLS(AbstractIterativeLearner):
         @param qids: A list of qid parameters.
         @type qids: List of integers."""
         
-        self.qidlist = [-1 for i in range(self.size)]
-        for i in range(len(qids)):
-            for j in qids[i]:
-                if j >= self.size:
-                    raise Exception("Index %d in query out of training set index bounds" %j)
-                elif j < 0:
-                    raise Exception("Negative index %d in query, query indices must be non-negative" %j)
-                else:
-                    self.qidlist[j] = i
-        if -1 in self.qidlist:
-            raise Exception("Not all training examples were assigned a query")
-        
-        
-        self.qidmap = {}
-        for i in range(len(self.qidlist)):
-            qid = self.qidlist[i]
-            if self.qidmap.has_key(qid):
-                sameqids = self.qidmap[qid]
-                sameqids.append(i)
-            else:
-                self.qidmap[qid] = [i]
-        self.indslist = []
-        for qid in self.qidmap.keys():
-            self.indslist.append(self.qidmap[qid])
+        self.queries = QueryStructure.fromIndexLists(qids, self.size)
+        self.qidlist = self.queries.qidlist
     
     
     def solve(self, regparam):
@@ -170,37 +155,29 @@ class CGRankRLS(AbstractIterativeLearner):
     def trainWithLabels(self):
         regparam = float(self.resource_pool[data_sources.TIKHONOV_REGULARIZATION_PARAMETER])
         #regparam = 0.
+        X = self.X.tocsc()
+        X_csr = X.tocsr()
         if data_sources.TRAIN_QIDS in self.resource_pool:
-            P = sp.lil_matrix((self.size, len(self.qidmap.keys())))
-            for qidind in range(len(self.indslist)):
-                inds = self.indslist[qidind]
-                qsize = len(inds)
-                for i in inds:
-                    P[i, qidind] = 1. / sqrt(qsize)
-            P = P.tocsr()
-            PT = P.tocsc().T
+            #The query structure is built once in setQids and shared by all the trainings
+            def L(v):
+                return self.queries.laplacian_matvec(v, normalized=True)
         else:
             P = 1./sqrt(self.size)*(np.mat(np.ones((self.size,1), dtype=np.float64)))
             PT = P.T
-        X = self.X.tocsc()
-        X_csr = X.tocsr()
+            def L(v):
+                return v - P*(PT*v)
         def mv(v):
             v = np.mat(v).T
-            return X_csr*(X.T*v)-X_csr*(P*(PT*(X.T*v)))+regparam*v
+            return X_csr*L(X.T*v)+regparam*v
         G = LinearOperator((X.shape[0],X.shape[0]), matvec=mv, dtype=np.float64)
         Y = self.Y
-        if not self.callbackfun == None:
-            def cb(v):
-                self.A = np.mat(v).T
-                self.b = np.mat(np.zeros((1,1)))
-                self.callback()
-        else:
-            cb = None
-        XLY = X_csr*Y-X_csr*(P*(PT*Y))
+        cb = self.cg_callback()
+        XLY = X_csr*L(Y)
         try:
-            self.A = np.mat(cg(G, XLY, callback=cb)[0]).T
+            self.A = np.mat(cg(G, XLY, x0=self.cg_x0(), callback=cb)[0]).T
         except Finished, e:
             pass
+        self.cg_finished()
         self.b = np.mat(np.zeros((1,1)))
         self.results[data_sources.MODEL] = self.getModel()
     
@@ -222,19 +199,38 @@ class CGRankRLS(AbstractIterativeLearner):
         G = LinearOperator((X.shape[0], X.shape[0]), matvec=mv, dtype=np.float64)
         self.As = []
         M = np.mat(np.ones((self.pairs.shape[0], 1)))
-        if not self.callbackfun == None:
-            def cb(v):
-                self.A = np.mat(v).T
-                self.b = np.mat(np.zeros((1,1)))
-                self.callback()
-        else:
-            cb = None
+        cb = self.cg_callback()
         XLY = X_csr * (pairs_csc.T * M)
-        self.A = np.mat(cg(G, XLY, callback=cb)[0]).T
+        self.A = np.mat(cg(G, XLY, x0=self.cg_x0(), callback=cb)[0]).T
+        self.cg_finished()
         self.b = np.mat(np.zeros((1,self.A.shape[1])))
         self.results[data_sources.MODEL] = self.getModel()
     
     
+    def cg_callback(self):
+        #Counts the iterations, and passes the intermediate solutions to the callback object
+        self.cg_iterations = 0
+        def cb(v):
+            self.cg_iterations += 1
+            if not self.callbackfun == None:
+                self.A = np.mat(v).T
+                self.b = np.mat(np.zeros((1,1)))
+                self.callback()
+        return cb
+    
+    
+    def cg_x0(self):
+        #The starting point of the iterations, the previous solution with warm starts
+        if self.warm_start and self.cg_solution is not None:
+            return self.cg_solution
+        return None
+    
+    
+    def cg_finished(self):
+        self.cg_solution = np.array(self.A).ravel()
+        self.results['cg_iterations'] = self.cg_iterations
+    
+    
     def getModel(self):
         """Returns the trained model, call this only after training.
         
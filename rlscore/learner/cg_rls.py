@@ -40,6 +40,10 @@ class CGRLS(AbstractSupervisedLearner, AbstractIterativeLearner):
         Validation set labels, needed if early stopping used
     bias: float, optional
         value of constant feature added to each data point (default 0)
+    warm_start: bool, optional
+        if True, each call of solve starts the conjugate gradient iterations from the
+        solution of the previous call instead of zero (default False). Useful when
+        sweeping a regularization path, see AbstractSelection.
         
     References
     ----------
@@ -52,7 +56,7 @@ class CGRLS(AbstractSupervisedLearner, AbstractIterativeLearner):
     PhD Thesis, Massachusetts Institute of Technology, 2002
     """
 
-    def __init__(self, train_features, train_labels, validation_features=None, validation_labels=None, regparam=1.0, bias=1.0):
+    def __init__(self, train_features, train_labels, validation_features=None, validation_labels=None, regparam=1.0, bias=1.0, warm_start=False):
         X = train_features
         self.Y = array_tools.as_labelmatrix(train_labels)
         self.X = csc_matrix(X.T)
@@ -68,6 +72,8 @@ class CGRLS(AbstractSupervisedLearner, AbstractIterativeLearner):
             self.callbackfun = EarlyStopCB(validation_features, validation_labels)
         else:
             self.callbackfun = None
+        self.warm_start = warm_start
+        self.cg_solution = None
         self.results = {}
 
     def createLearner(cls, **kwargs):
@@ -78,6 +84,8 @@ class CGRLS(AbstractSupervisedLearner, AbstractIterativeLearner):
             new_kwargs['regparam'] = float(kwargs["regparam"])
         if kwargs.has_key("bias"):
             new_kwargs['bias'] = float(kwargs["bias"])
+        if kwargs.has_key("warm_start"):
+            new_kwargs['warm_start'] = kwargs["warm_start"]
         if kwargs.has_key(data_sources.VALIDATION_FEATURES) and kwargs.has_key(data_sources.VALIDATION_LABELS):
             new_kwargs[data_sources.VALIDATION_FEATURES] = kwargs[data_sources.VALIDATION_FEATURES]
             new_kwargs[data_sources.VALIDATION_LABELS] = kwargs[data_sources.VALIDATION_LABELS]
@@ -104,6 +112,8 @@ class CGRLS(AbstractSupervisedLearner, AbstractIterativeLearner):
             validation_X = self.resource_pool[data_sources.VALIDATION_FEATURES]
             validation_Y = self.resource_pool[data_sources.VALIDATION_LABELS]
             self.callbackfun = EarlyStopCB(validation_X, validation_Y)
+        self.warm_start = self.resource_pool.get('warm_start', False)
+        self.cg_solution = None
     
     
     def solve(self, regparam):
@@ -135,16 +145,12 @@ class CGRLS(AbstractSupervisedLearner, AbstractIterativeLearner):
             return X.T*(X_csr*v)+regparam*v
         G = LinearOperator((X.shape[1],X.shape[1]), matvec=mv, dtype=np.float64)
         self.AA = []
-        if not self.callbackfun == None:
-            def cb(v):
-                self.A = np.mat(v).T
-                self.callback()
-        else:
-            cb = None
+        cb = self.cg_callback()
         try:
-            self.A = np.mat(cg(G, Y, callback=cb)[0]).T
+            self.A = np.mat(cg(G, Y, x0=self.cg_x0(), callback=cb)[0]).T
         except Finished, e:
             pass
+        self.cg_finished()
         self.finished()
         self.A = X_csr*self.A
         if self.bias == 0.:
@@ -153,6 +159,29 @@ class CGRLS(AbstractSupervisedLearner, AbstractIterativeLearner):
             self.b = sqrt(self.bias)*self.A[-1]
             self.A = self.A[:-1]
         self.results[data_sources.MODEL] = self.getModel()
+    
+    
+    def cg_callback(self):
+        #Counts the iterations, and passes the intermediate solutions to the callback object
+        self.cg_iterations = 0
+        def cb(v):
+            self.cg_iterations += 1
+            if not self.callbackfun == None:
+                self.A = np.mat(v).T
+                self.callback()
+        return cb
+    
+    
+    def cg_x0(self):
+        #The starting point of the iterations, the previous solution with warm starts
+        if self.warm_start and self.cg_solution is not None:
+            return self.cg_solution
+        return None
+    
+    
+    def cg_finished(self):
+        self.cg_solution = np.array(self.A).ravel()
+        self.results['cg_iterations'] = self.cg_iterations
 
     def getModel(self):
         """Returns the trained model, call this only after training.
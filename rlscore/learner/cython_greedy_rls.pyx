@@ -1,12 +1,15 @@
 
 
 import cython
+from cython.parallel import prange, parallel
+from libc.stdlib cimport malloc, free
+cimport openmp
+
+
 
 @cython.boundscheck(False)
 @cython.wraparound(False)
-
-    
-    
+@cython.cdivision(True)
 cpdef int find_optimal_feature(double [:, :] Y,
                          double [:, :] X,
                          double [:, :] GXT,
@@ -17,58 +20,87 @@ cpdef int find_optimal_feature(double [:, :] Y,
                          int tsize,
                          int lsize,
                          short [:] selected,
-                         double [:] tempvec1,
-                         double [:] tempvec2,
-                         double [:, :] tempvec3):
-    
-    cdef double inf, temp_d1, bestlooperf
+                         int num_threads = 0):
+
+    cdef double inf, temp_d1, ca_i, invdiag_i, diff, loodiff_ij, bestlooperf
     cdef int ci, bestcind, i, j
-    
+    cdef double *tempvec
+    cdef double *tempvecs
+
     inf = float('Inf')
+    if num_threads <= 0:
+        num_threads = openmp.omp_get_max_threads()
+
+    #The candidates are scored in parallel, each thread having its own scratch vector. The
+    #vectors are allocated before entering the parallel block, where a failure could not be
+    #reported as an exception.
+    tempvecs = <double *> malloc(sizeof(double) * lsize * num_threads)
+    if tempvecs == NULL:
+        raise MemoryError("Could not allocate the scratch vectors of the threads")
+    with nogil, parallel(num_threads = num_threads):
+        tempvec = tempvecs + openmp.omp_get_thread_num() * lsize
+        for ci in prange(fsize, schedule = 'guided'):
+            if selected[ci] > 0:
+                looperf[ci] = inf
+                continue
+            temp_d1 = 0.
+            for i in range(tsize):
+                temp_d1 = temp_d1 + X[ci, i] * GXT[i, ci]
+            temp_d1 = 1. / (1. + temp_d1)
+
+            for j in range(lsize):
+                tempvec[j] = 0.
+                for i in range(tsize):
+                    tempvec[j] = tempvec[j] + X[ci, i] * dualvec[i, j]
+
+            #loodiff = invupddiagG * (dualvec - ca * (cv * dualvec)), where ca = GXT_ci / (1 + cv * GXT_ci)
+            #and invupddiagG = 1. / (diagG - ca * GXT_ci), accumulated without storing it
+            diff = 0.
+            for i in range(tsize):
+                ca_i = GXT[i, ci] * temp_d1
+                invdiag_i = 1. / (diagG[i] - ca_i * GXT[i, ci])
+                for j in range(lsize):
+                    loodiff_ij = invdiag_i * (dualvec[i, j] - ca_i * tempvec[j])
+                    diff = diff + loodiff_ij * loodiff_ij
+            looperf[ci] = diff / (tsize * lsize)
+    free(tempvecs)
+
+    #Serial argmin, ties are resolved in favour of the smallest index
+    bestcind = -1
     bestlooperf = inf
-    
     for ci in range(fsize):
         if selected[ci] > 0: continue
-        GXT_ci = GXT[:, ci]
-        temp_d1 = 0.
-        for i in range(tsize):
-            temp_d1 += X[ci, i] * GXT[i, ci]
-        #print np.dot(cv, GXT_ci), temp_d1
-        temp_d1 = 1. / (1. + temp_d1)
-        for i in range(tsize):
-            tempvec1[i] = GXT[i, ci] * temp_d1
-        
-        for j in range(lsize):
-            tempvec2[j] = 0.
-            for i in range(tsize):
-                tempvec2[j] += X[ci, i] * dualvec[i, j]
-        for j in range(lsize):
-            for i in range(tsize):
-                tempvec3[i, j] = dualvec[i, j] - tempvec1[i] * tempvec2[j]
-        #updA = dualvec - np.dot(tempvec1[:, None], np.dot(cv, dualvec)[None, :])
-        
-        for i in range(tsize):
-            tempvec1[i] = 1. / (diagG[i] - tempvec1[i] * GXT[i, ci])
-        #invupddiagG = 1. / (diagG - np.multiply(tempvec1, GXT_ci))
-        
-        for j in range(lsize):
-            for i in range(tsize):
-                tempvec3[i, j] = tempvec1[i] * tempvec3[i, j]
-        #loodiff = np.multiply(invupddiagG[:, None], updA)
-        
-        temp_d1 = 0.
-        for j in range(lsize):
-            for i in range(tsize):
-                temp_d1 += tempvec3[i, j] * tempvec3[i, j]
-        temp_d1 = temp_d1 / (tsize * lsize)
-        #looperf_i = np.mean(np.multiply(loodiff, loodiff))
-        
-        if temp_d1 < bestlooperf:
+        if bestcind < 0 or looperf[ci] < bestlooperf:
             bestcind = ci
-            bestlooperf = temp_d1
-        looperf[ci] = temp_d1
+            bestlooperf = looperf[ci]
     selected[bestcind] = 1
     return bestcind
 
 
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cpdef update_GXT(double [:, :] GXT,
+                 double [:, :] X,
+                 double [:] ca,
+                 int bestcind,
+                 int fsize,
+                 int tsize,
+                 int num_threads = 0):
+    """Computes the rank-one update GXT = GXT - ca * (cv * GXT) in place, where cv is
+    the row bestcind of X. The column bestcind of GXT must not be needed afterwards in
+    its old form, as ca is computed from it by the caller."""
+
+    cdef int ci, i
+    cdef double cvGXT_ci
+
+    if num_threads <= 0:
+        num_threads = openmp.omp_get_max_threads()
+
+    #The columns are independent, so each is updated by a single thread
+    for ci in prange(fsize, nogil = True, num_threads = num_threads, schedule = 'static'):
+        cvGXT_ci = 0.
+        for i in range(tsize):
+            cvGXT_ci = cvGXT_ci + X[bestcind, i] * GXT[i, ci]
+        for i in range(tsize):
+            GXT[i, ci] = GXT[i, ci] - ca[i] * cvGXT_ci
 
@@ -0,0 +1,235 @@
+
+from numpy import *
+from scipy import sparse as sp
+
+from abstract_learner import AbstractSupervisedLearner
+from abstract_learner import AbstractIterativeLearner
+from greedy_rls import score_feature_block
+from rlscore import data_sources
+from rlscore import model
+
+
+class FloatingRLS(AbstractSupervisedLearner, AbstractIterativeLearner):
+    """Sequential floating forward selection for RLS.
+
+    Each forward step adds the feature whose addition leads to the lowest
+    leave-one-out mean squared error, as in GreedyRLS. After each forward step,
+    backward steps remove the selected feature whose removal leads to the lowest
+    leave-one-out error, for as long as this gives a better subset than the best
+    one found so far of that size. An early bad choice can thus be undone, and
+    smaller subsets of equal accuracy are reached without retraining from scratch.
+
+    The removals are rank-one downdates of G = (K + regparam * I)^-1, so that both
+    the forward and the backward steps cost linear time in n_samples * n_features.
+    With dense data G * X.T is kept up to date. Sparse data is kept sparse, and G is
+    instead stored in the factored form rpinv * I - C * S * C.T, where S contains the
+    signs of the updates, so that no dense matrix of the size of X is formed.
+
+    Parameters
+    ----------
+    train_features: {array-like, sparse matrix}, shape = [n_samples, n_features]
+        Data matrix
+    train_labels: {array-like}, shape = [n_samples] or [n_samples, n_labels] (if n_labels >1)
+        Training set labels
+    regparam: float (regparam > 0)
+        regularization parameter
+    subsetsize: int (0 < subsetsize <= n_features)
+        number of features to be selected
+    bias: float, optional
+        value of constant feature added to each data point (default 0)
+    measure: function(Y, P), optional
+        performance measure optimized instead of the mean squared error
+    blocksize: int, optional
+        number of candidate features scored at a time
+
+    References
+    ----------
+
+    The floating search is described in [1]_.
+
+    ..[1] Pavel Pudil, Jana Novovicova, and Josef Kittler.
+    Floating search methods in feature selection.
+    Pattern Recognition Letters, 15(11):1119-1125, 1994.
+    """
+
+    def loadResources(self):
+        AbstractIterativeLearner.loadResources(self)
+        AbstractSupervisedLearner.loadResources(self)
+        X = self.resource_pool[data_sources.TRAIN_FEATURES]
+        if sp.issparse(X):
+            self.X = sp.csc_matrix(X, dtype = float64)
+        else:
+            self.X = asarray(X, dtype = float64)
+        if self.resource_pool.has_key('bias'):
+            self.bias = float(self.resource_pool['bias'])
+        else:
+            self.bias = 0.
+        if self.resource_pool.has_key(data_sources.PERFORMANCE_MEASURE):
+            self.measure = self.resource_pool[data_sources.PERFORMANCE_MEASURE]
+        else:
+            self.measure = None
+        if self.resource_pool.has_key('blocksize'):
+            self.blocksize = int(self.resource_pool['blocksize'])
+        else:
+            self.blocksize = None
+
+
+    def train(self):
+        """Trains the learning algorithm.
+
+        After the learner is trained, one can call the method getModel
+        to get the trained model
+        """
+        regparam = float(self.resource_pool[data_sources.TIKHONOV_REGULARIZATION_PARAMETER])
+        self.solve(regparam)
+
+
+    def solve(self, regparam):
+        """Performs the floating selection using the given regularization parameter.
+
+        The trace of the leave-one-out performances after each addition and removal
+        is stored in self.performances, and the corresponding steps in self.steps as
+        (feature, True) for additions and (feature, False) for removals.
+
+        Parameters
+        ----------
+        regparam: float (regparam > 0)
+            regularization parameter
+        """
+        self.regparam = regparam
+        X = self.X
+        Y = asarray(self.Y, dtype = float64)
+        tsize, fsize = X.shape
+        lsize = Y.shape[1]
+        rpinv = 1. / regparam
+
+        if not self.resource_pool.has_key('subsetsize'):
+            raise Exception("Parameter 'subsetsize' must be given.")
+        desiredfcount = int(self.resource_pool['subsetsize'])
+        if not fsize >= desiredfcount:
+            raise Exception('The overall number of features ' + str(fsize) + ' is smaller than the desired number ' + str(desiredfcount) + ' of features to be selected.')
+        if self.blocksize == None:
+            blocksize = max(1, 2 ** 20 / (tsize * lsize))
+        else:
+            blocksize = self.blocksize
+
+        #The measures to be maximized are minimized with their signs flipped
+        if self.measure == None or self.measure.iserror:
+            sign = 1.
+        else:
+            sign = -1.
+
+        #G = rpinv * I, and with dense data GXT = G * X.T is kept up to date with rank-one
+        #updates. With sparse data G = rpinv * I - C * diag(signs) * C.T instead.
+        sparse = sp.issparse(X)
+        state = {}
+        state['dualvec'] = rpinv * Y
+        state['diagG'] = rpinv * ones(tsize)
+        if sparse:
+            state['C'] = zeros((tsize, 0))
+            state['signs'] = zeros(0)
+        else:
+            GXT = rpinv * X
+
+        def column(ci):
+            if sparse:
+                return X[:, ci].toarray().ravel()
+            return X[:, ci]
+
+        def multiplyG(block):
+            #G * X[:, block]
+            if not sparse:
+                return GXT[:, block]
+            C = state['C']
+            XB = X[:, block]
+            CTXB = XB.T.dot(C).T
+            return rpinv * XB.toarray() - dot(C, state['signs'][:, newaxis] * CTXB)
+
+        def update(x, g, s):
+            #Adds x to the set if s = 1, removes it if s = -1
+            c = g / sqrt(1. + s * dot(x, g))
+            state['dualvec'] = state['dualvec'] - s * outer(c, dot(c, Y))
+            state['diagG'] = state['diagG'] - s * c * c
+            if sparse:
+                state['C'] = hstack([state['C'], c[:, newaxis]])
+                state['signs'] = append(state['signs'], s)
+                return
+            z = dot(X.T, c)
+            for start in range(0, fsize, blocksize):
+                end = min(start + blocksize, fsize)
+                GXT[:, start:end] -= s * outer(c, z[start:end])
+
+        def score(inds, remove):
+            looperf = empty(len(inds))
+            for start in range(0, len(inds), blocksize):
+                block = inds[start:start + blocksize]
+                looperf[start:start + blocksize] = sign * score_feature_block(X[:, block], None, rpinv, state['dualvec'], state['diagG'], Y, self.measure, multiplyG(block), remove)
+            looperf[isnan(looperf)] = float('Inf')
+            return looperf
+
+        #Biaz
+        if self.bias > 0.:
+            x = sqrt(self.bias) * ones(tsize)
+            update(x, rpinv * x, 1.)
+
+        self.selected = []
+        self.performances = []
+        self.steps = []
+        #The best performance found so far for each subset size
+        bestperfs = {}
+
+        def step(ci, perf, add):
+            if add:
+                self.selected.append(ci)
+            else:
+                self.selected.remove(ci)
+            update(column(ci), multiplyG([ci])[:, 0].copy(), 1. if add else -1.)
+            self.bestlooperf = sign * perf
+            self.performances.append(self.bestlooperf)
+            self.steps.append((ci, add))
+            size = len(self.selected)
+            if not bestperfs.has_key(size) or perf < bestperfs[size]:
+                bestperfs[size] = perf
+            self.dualvec = mat(state['dualvec'])
+
+            #Linear model with bias
+            self.A = mat(zeros((fsize, lsize)))
+            if sparse:
+                self.A[self.selected] = X[:, self.selected].T.dot(state['dualvec'])
+            else:
+                self.A[self.selected] = dot(X[:, self.selected].T, state['dualvec'])
+            self.b = mat(sqrt(self.bias) * sum(state['dualvec'], axis = 0))
+
+            self.callback()
+
+        while len(self.selected) < desiredfcount:
+            remaining = [ci for ci in range(fsize) if not ci in self.selected]
+            looperf = score(remaining, False)
+            self.looperf = looperf
+            i = argmin(looperf)
+            added = remaining[i]
+            step(added, looperf[i], True)
+
+            #Conditional removals, the feature just added is never removed right away
+            while len(self.selected) > 2:
+                candidates = [ci for ci in self.selected if ci != added]
+                looperf = score(candidates, True)
+                i = argmin(looperf)
+                if not looperf[i] < bestperfs[len(self.selected) - 1]:
+                    break
+                step(candidates[i], looperf[i], False)
+                added = None
+        self.finished()
+        self.resource_pool[data_sources.SELECTED_FEATURES] = self.selected
+        self.resource_pool[data_sources.GREEDYRLS_LOO_PERFORMANCES] = self.performances
+
+
+    def getModel(self):
+        """Returns the trained model, call this only after training.
+
+        Returns
+        -------
+        model : LinearModel
+            prediction function (model.W contains at most "subsetsize" number of non-zero coefficients)
+        """
+        return model.LinearModel(self.A, self.b)
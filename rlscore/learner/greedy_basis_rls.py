@@ -0,0 +1,208 @@
+
+from numpy import *
+from scipy import linalg as sla
+
+from abstract_learner import AbstractSupervisedLearner
+from abstract_learner import AbstractIterativeLearner
+from greedy_rls import score_feature_block
+from rlscore import data_sources
+from rlscore import model
+from rlscore.utilities import array_tools
+from rlscore.utilities import creators
+
+
+class GreedyBasisRLS(AbstractSupervisedLearner, AbstractIterativeLearner):
+    """Greedy basis vector selection for reduced set kernel RLS.
+
+    Performs greedy forward selection of the basis vectors, where at each step the
+    training example selected as a new basis vector is the one whose addition leads to
+    the lowest leave-one-out mean squared error of the reduced set RLS.
+
+    Reduced set RLS with the basis vectors B is equivalent to linear RLS on the
+    features F = K[:, B] * L^-T, where K[B, B] = L * L.T, and adding a basis vector
+    adds a single column to F. The candidates are therefore scored with the same
+    low-rank leave-one-out updates as in GreedyRLS. The kernel columns of the
+    candidates are computed on demand, so the full kernel matrix is never built.
+
+    Parameters
+    ----------
+    train_features: {array-like, sparse matrix}, shape = [n_samples, n_features]
+        Data matrix
+    train_labels: {array-like}, shape = [n_samples] or [n_samples, n_labels]
+        Training set labels
+    regparam: float (regparam > 0)
+        regularization parameter
+    subsetsize: int (0 < subsetsize <= n_samples)
+        number of basis vectors to be selected
+    kernel: {'LinearKernel', 'GaussianKernel', 'PolynomialKernel'}, optional
+        name of the kernel (default 'LinearKernel'), given together with the kernel
+        parameters such as gamma
+    kernel_obj: kernel object, optional
+        kernel object, initialized with the training set
+    sample_size: int, optional
+        number of randomly drawn candidates scored on each round (default 59, which
+        gives a candidate among the best 5% with probability 0.95). If at least
+        n_samples, all the remaining examples are scored.
+    measure: function(Y, P), optional
+        performance measure optimized instead of the mean squared error
+    blocksize: int, optional
+        number of candidate kernel columns computed at a time
+
+    References
+    ----------
+
+    The candidate sampling follows the sparse greedy matrix approximation of [1]_.
+
+    ..[1] Alex J. Smola and Bernhard Schoelkopf.
+    Sparse Greedy Matrix Approximation for Machine Learning.
+    Proceedings of the Seventeenth International Conference on Machine Learning,
+    911-918, Morgan Kaufmann, 2000.
+    """
+
+    def loadResources(self):
+        AbstractIterativeLearner.loadResources(self)
+        AbstractSupervisedLearner.loadResources(self)
+        self.X = self.resource_pool[data_sources.TRAIN_FEATURES]
+        if not self.resource_pool.has_key(data_sources.KERNEL_OBJ):
+            if not self.resource_pool.has_key("kernel"):
+                self.resource_pool["kernel"] = "LinearKernel"
+            self.resource_pool[data_sources.KERNEL_OBJ] = creators.createKernelByModuleName(**self.resource_pool)
+        self.kernel = self.resource_pool[data_sources.KERNEL_OBJ]
+        if self.X.shape[0] != self.size:
+            raise Exception('The number ' + str(self.X.shape[0]) + ' of training feature vectors is different from the number ' + str(self.size) + ' of training labels.')
+        if self.resource_pool.has_key(data_sources.PERFORMANCE_MEASURE):
+            self.measure = self.resource_pool[data_sources.PERFORMANCE_MEASURE]
+        else:
+            self.measure = None
+        if self.resource_pool.has_key('sample_size'):
+            self.sample_size = int(self.resource_pool['sample_size'])
+        else:
+            self.sample_size = 59
+        if self.resource_pool.has_key('blocksize'):
+            self.blocksize = int(self.resource_pool['blocksize'])
+        else:
+            self.blocksize = None
+
+
+    def train(self):
+        """Trains the learning algorithm.
+
+        After the learner is trained, one can call the method getModel
+        to get the trained model
+        """
+        regparam = float(self.resource_pool[data_sources.TIKHONOV_REGULARIZATION_PARAMETER])
+        self.solve(regparam)
+
+
+    def kernel_columns(self, inds):
+        """Computes the columns of the training set kernel matrix for the given examples.
+
+        @param inds: indices of the training examples
+        @type inds: list of ints
+        @return: the kernel columns
+        @rtype: numpy array, shape = [n_samples, len(inds)]"""
+        return asarray(self.kernel.getKM(self.X[inds]), dtype = float64).T
+
+
+    def solve(self, regparam):
+        """Selects the basis vectors and trains the reduced set RLS, using the given
+        regularization parameter.
+
+        Parameters
+        ----------
+        regparam: float (regparam > 0)
+            regularization parameter
+        """
+        self.regparam = regparam
+        Y = asarray(self.Y, dtype = float64)
+        tsize, lsize = Y.shape
+        rpinv = 1. / regparam
+
+        if not self.resource_pool.has_key('subsetsize'):
+            raise Exception("Parameter 'subsetsize' must be given.")
+        desiredbcount = int(self.resource_pool['subsetsize'])
+        if not tsize >= desiredbcount:
+            raise Exception('The number ' + str(tsize) + ' of training examples is smaller than the desired number ' + str(desiredbcount) + ' of basis vectors to be selected.')
+        if self.blocksize == None:
+            blocksize = max(1, 2 ** 20 / tsize)
+        else:
+            blocksize = self.blocksize
+
+        #The measures to be maximized are minimized with their signs flipped
+        if self.measure == None or self.measure.iserror:
+            sign = 1.
+        else:
+            sign = -1.
+
+        #F contains the reduced set features and G = rpinv * I - C * C.T
+        F = zeros((tsize, desiredbcount))
+        C = zeros((tsize, desiredbcount))
+        dualvec = rpinv * Y
+        diagG = rpinv * ones(tsize)
+
+        self.selected = []
+        self.performances = []
+        selectedvec = zeros(tsize, dtype = bool)
+        bcount = 0
+        while bcount < desiredbcount:
+            remaining = flatnonzero(logical_not(selectedvec))
+            if self.sample_size < len(remaining):
+                candidates = random.permutation(remaining)[:self.sample_size]
+            else:
+                candidates = remaining
+            Fs, Cs = F[:, :bcount], C[:, :bcount]
+            bestcind, bestperf, bestcol = None, None, None
+            for start in range(0, len(candidates), blocksize):
+                inds = candidates[start:start + blocksize]
+                #The parts of the kernel columns orthogonal to the current basis in the feature space
+                cols = self.kernel_columns(inds)
+                cols -= dot(Fs, Fs[inds].T)
+                residuals = cols[inds, arange(len(inds))]
+                #Candidates already spanned by the basis would give a zero column
+                valid = residuals > 1e-10 * abs(residuals + sum(Fs[inds] ** 2, axis = 1))
+                if not any(valid):
+                    continue
+                cols = cols[:, valid] / sqrt(residuals[valid])
+                looperf = sign * score_feature_block(cols, Cs, rpinv, dualvec, diagG, Y, self.measure)
+                looperf[isnan(looperf)] = float('Inf')
+                i = argmin(looperf)
+                if bestperf == None or looperf[i] < bestperf:
+                    bestcind, bestperf, bestcol = inds[valid][i], looperf[i], cols[:, i]
+            if bestcind == None:
+                raise Exception('The kernel matrix has rank ' + str(bcount) + ', so no more than ' + str(bcount) + ' basis vectors can be selected.')
+            self.bestlooperf = sign * bestperf
+            self.performances.append(self.bestlooperf)
+
+            f = bestcol
+            g = rpinv * f - dot(Cs, dot(Cs.T, f))
+            c = g / sqrt(1. + dot(f, g))
+            F[:, bcount] = f
+            C[:, bcount] = c
+            bcount += 1
+            dualvec = dualvec - outer(c, dot(c, Y))
+            diagG = diagG - c * c
+            self.selected.append(bestcind)
+            selectedvec[bestcind] = True
+            self.dualvec = mat(dualvec)
+
+            #Dual coefficients of the basis vectors, K[B, B] = L * L.T where L = F[B]
+            W = dot(F[:, :bcount].T, dualvec)
+            self.A = sla.solve_triangular(F[self.selected, :bcount], W, trans = 'T', lower = True)
+
+            self.callback()
+        self.finished()
+        self.resource_pool[data_sources.GREEDYRLS_LOO_PERFORMANCES] = self.performances
+
+
+    def getModel(self):
+        """Returns the trained model, call this only after training.
+
+        Returns
+        -------
+        model : DualModel
+            prediction function, whose kernel has only the selected basis vectors
+        """
+        newpool = self.resource_pool.copy()
+        newpool[data_sources.BASIS_VECTORS] = self.selected
+        kernel = self.kernel.__class__.createKernel(**newpool)
+        return model.DualModel(self.A, kernel)
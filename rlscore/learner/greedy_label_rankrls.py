@@ -0,0 +1,97 @@
+
+from numpy import *
+from scipy import sparse as sp
+
+from greedy_rls import GreedyRLS
+from greedy_rls import score_fold_residuals
+from rlscore import data_sources
+from rlscore.utilities import array_tools
+from rlscore.utilities.query_structure import QueryStructure
+
+
+class GreedyLabelRankRLS(GreedyRLS):
+    """Greedy forward selection for RankRLS with query-structured data.
+
+    Performs greedy forward selection under the LabelRankRLS objective, where at each
+    step the feature selected is the one whose addition leads to the lowest
+    leave-query-out error.
+
+    The query Laplacian L = D - P * P.T, where D contains the query sizes and P is the
+    query indicator matrix, is kept in this factored form. For a query q of size n_q,
+    L restricted to q is n_q times the centering matrix of q, so RankRLS is RLS on the
+    data L^(1/2) * X and labels L^(1/2) * Y, and leaving a query out removes exactly its
+    rows from them. The candidates are thus scored with the cross-validation updates of
+    GreedyRLS with the queries as folds, in linear time in n_samples * n_features per
+    round.
+
+    The leave-query-out error of a query is the mean of the squared differences of the
+    query-centered labels and hold-out predictions. If a measure is given instead, it is
+    computed for each query, as the hold-out predictions are determined only up to a
+    constant within a query, and averaged over the queries.
+
+    Parameters
+    ----------
+    train_features: {array-like, sparse matrix}, shape = [n_samples, n_features]
+        Data matrix, sparse matrices are converted to dense arrays, as the query-centered
+        data L^(1/2) * X is dense whenever a query has a nonzero value of a feature
+    train_labels: {array-like}, shape = [n_samples] or [n_samples, n_labels]
+        Training set labels
+    train_qids: list of n_queries index lists
+        Training set qids
+    regparam: float (regparam > 0)
+        regularization parameter
+    subsetsize: int (0 < subsetsize <= n_features)
+        number of features to be selected
+    measure: function(Y, P), optional
+        ranking performance measure, such as cindex, optimized instead of the error
+    blocksize: int, optional
+        number of candidate features scored at a time
+    """
+
+    def loadResources(self):
+        GreedyRLS.loadResources(self)
+        if not self.resource_pool.has_key(data_sources.TRAIN_QIDS):
+            raise Exception("Parameter 'train_qids' must be given.")
+        self.setQids(self.resource_pool[data_sources.TRAIN_QIDS])
+        #The Laplacian has constant vectors within the queries in its null space,
+        #so a bias feature would have no effect
+        self.bias = 0.
+        X = self.resource_pool[data_sources.TRAIN_FEATURES]
+        #Centering fills the queries, so nothing would be gained from keeping X sparse
+        if sp.issparse(X):
+            X = X.toarray()
+        X = asarray(X, dtype = float64)
+        Y = asarray(array_tools.as_labelmatrix(self.Y), dtype = float64)
+        self.Yorig = Y
+        self.X = self.laplacian_sqrt(X).T
+        self.Xfactored = None
+        self.Y = self.laplacian_sqrt(Y)
+        #Empty queries have no hold-out predictions
+        self.folds = [q for q in self.qids if len(q) > 0]
+
+
+    def setQids(self, qids):
+        """Sets the queries and builds the factored query Laplacian.
+
+        @param qids: the indices of the training examples belonging to each query
+        @type qids: list of lists of ints"""
+        self.queries = QueryStructure.fromIndexLists(qids, self.size)
+        self.qids = [list(q) for q in qids]
+        self.qidlist = self.queries.qidlist
+        self.P = self.queries.P
+        self.D = self.queries.D
+
+
+    def laplacian_sqrt(self, M):
+        """Multiplies M from the left by the square root of the query Laplacian,
+        L^(1/2) = D^(1/2) - D^(-1/2) * P * P.T, where the rows of M correspond to
+        the training examples."""
+        sqrtD = sqrt(self.D)[:, newaxis]
+        return sqrtD * M - self.P.dot(self.P.T.dot(M)) / sqrtD
+
+
+    def fold_performances(self, Y, R, folds):
+        #R contains the hold-out residuals of L^(1/2) * Y, that is, sqrt(n_q) times the
+        #query-centered residuals of the original labels
+        R = R / sqrt(self.D)[:, newaxis, newaxis]
+        return score_fold_residuals(self.Yorig, R, folds, self.measure)
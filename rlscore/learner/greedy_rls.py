@@ -1,20 +1,120 @@
 
+import heapq
+import math
+import os
+
 from numpy import *
+from numpy.lib import format as npformat
 from scipy import sparse as sp
 
 from abstract_learner import AbstractSupervisedLearner
 from abstract_learner import AbstractIterativeLearner
 from rlscore import data_sources
 from rlscore import model
+from rlscore.measure.measure_utilities import column_performances
+from rlscore.utilities import array_tools
 
 import pyximport; pyximport.install()
 import cython_greedy_rls
 
+#The files of a GreedyRLS checkpoint directory
+CHECKPOINT_GXT = 'GXT.npy'
+CHECKPOINT_STATE = 'state.npz'
+CHECKPOINT_PERFORMANCES = 'performances.txt'
+
+
+def label_mean(perfs):
+    """Averages the performances over the labels, skipping the labels for which the
+    measure is undefined.
+    
+    @param perfs: the performances, one column for each label
+    @type perfs: numpy array, shape = [n_candidates, n_labels]
+    @return: the mean performances, nan if undefined for all the labels
+    @rtype: numpy array, shape = [n_candidates]"""
+    counts = sum(logical_not(isnan(perfs)), axis = 1)
+    return where(counts > 0, nansum(perfs, axis = 1) / maximum(counts, 1), nan)
+
+
+def score_feature_block(XB, C, rpinv, dualvec, diagG, Y = None, measure = None, GXB = None, remove = False):
+    """Computes the leave-one-out mean squared errors of adding each of the features in
+    XB to the current set, when G = rpinv * I - C * C.T. If remove is True, the errors
+    of removing each of the features from the current set are computed instead.
+    
+    If a measure is given, the leave-one-out predictions of all the candidates are
+    instead collected into a single matrix with a column for each candidate and label,
+    and scored with one call of the measure.
+    
+    @param XB: the values of the candidate features, one column per feature
+    @type XB: numpy array or scipy sparse matrix, shape = [n_samples, n_candidates]
+    @param GXB: G * XB, if already available, in which case C is not used
+    @type GXB: numpy array, shape = [n_samples, n_candidates]
+    @return: the leave-one-out performances of the candidates, averaged over the labels
+    @rtype: numpy array, shape = [n_candidates]"""
+    tsize, lsize = dualvec.shape
+    if sp.issparse(XB):
+        XBd = XB.toarray()
+        T = XB.T.dot(dualvec)
+    else:
+        XBd = asarray(XB)
+        T = dot(XBd.T, dualvec)
+    #The columns of G * XB and the corresponding rank-one updates of G
+    if GXB is None:
+        if sp.issparse(XB):
+            CTXB = XB.T.dot(C).T
+        else:
+            CTXB = dot(C.T, XBd)
+        GXB = rpinv * XBd - dot(C, CTXB)
+    #Removing x from the set downdates the kernel matrix by x * x.T
+    s = -1. if remove else 1.
+    CA = s * GXB / (1. + s * sum(XBd * GXB, axis = 0))
+    denom = diagG[:, newaxis] - CA * GXB
+    if measure is not None:
+        bsize = XBd.shape[1]
+        P = empty((tsize, bsize * lsize))
+        for j in range(lsize):
+            P[:, j::lsize] = Y[:, j, newaxis] - (dualvec[:, j, newaxis] - CA * T[:, j]) / denom
+        perfs = column_performances(measure, tile(Y, (1, bsize)), P)
+        return label_mean(perfs.reshape(bsize, lsize))
+    looerrors = zeros(XBd.shape[1])
+    for j in range(lsize):
+        loodiff = (dualvec[:, j, newaxis] - CA * T[:, j]) / denom
+        looerrors += sum(loodiff * loodiff, axis = 0)
+    return looerrors / (tsize * lsize)
+
+
+def score_fold_residuals(Y, R, folds, measure = None):
+    """Computes the cross-validation performances of a block of candidate features
+    from their hold-out residuals, averaging the performances over the folds as
+    NfoldSelection does. The folds and labels for which the measure is undefined are
+    skipped.
+    
+    @param R: the hold-out residuals Y - P of the candidates
+    @type R: numpy array, shape = [n_samples, n_candidates, n_labels]
+    @return: the cross-validation performances of the candidates
+    @rtype: numpy array, shape = [n_candidates]"""
+    bsize, lsize = R.shape[1], R.shape[2]
+    perfs = []
+    for fold in folds:
+        RF = R[fold]
+        if measure is None:
+            perfs.append(mean(mean(RF * RF, axis = 2), axis = 0))
+            continue
+        YF = Y[fold]
+        P = (YF[:, newaxis, :] - RF).reshape(len(fold), bsize * lsize)
+        foldperfs = column_performances(measure, tile(YF, (1, bsize)), P)
+        perfs.append(label_mean(foldperfs.reshape(bsize, lsize)))
+    if len(perfs) == 0:
+        return nan * ones(bsize)
+    perfs = array(perfs)
+    counts = sum(logical_not(isnan(perfs)), axis = 0)
+    return where(counts > 0, nansum(perfs, axis = 0) / maximum(counts, 1), nan)
+
 class GreedyRLS(AbstractSupervisedLearner, AbstractIterativeLearner):
     """Linear time greedy forward selection for RLS.
     
     Performs greedy forward selection, where at each step the feature selected
-    is the one whose addition leads to lowest leave-one-out mean squared error.
+    is the one whose addition leads to lowest leave-one-out mean squared error,
+    or to the best leave-one-out performance according to the given measure.
 
     Parameters
     ----------
@@ -28,6 +128,54 @@ class GreedyRLS(AbstractSupervisedLearner, AbstractIterativeLearner):
         number of features to be selected
     bias: float, optional
         value of constant feature added to each data point (default 0)
+    measure: function(Y, P), optional
+        performance measure, such as auc or cindex, optimized instead of the mean
+        squared error. The leave-one-out predictions of a block of candidates are
+        scored with a single call, so measures with a vectorized multitask version
+        are nearly as fast as the squared error.
+    threads: int, optional
+        number of threads used for scoring the candidate features (default all cores)
+    blocksize: int, optional
+        number of candidate features scored at a time with sparse data and in the
+        low-memory mode (by default chosen so that the temporary matrices have
+        about 2^20 entries)
+    memory_budget: int, optional
+        maximum size in bytes of the dense n_samples * n_features cache used with
+        dense data (default 2^30). If the cache would be larger, the low-memory
+        mode that stores only the selected directions is used instead.
+    selection: {'exact', 'lazy', 'stochastic'}, optional
+        'exact' (default) scores all the remaining features on each round. 'lazy'
+        keeps the decreases of the leave-one-out error computed on earlier rounds in a
+        priority queue and re-scores only the best candidates until one of them stays
+        on top, and 'stochastic' scores a
+        random sample of the remaining features. Both are approximations of the exact
+        greedy selection, as the leave-one-out errors may change arbitrarily between
+        rounds, and they use the low-memory mode.
+    batchsize: int, optional
+        number of features selected on each round (default 1)
+    sample_size: int, optional
+        number of candidates scored on each round in the stochastic mode (default
+        n_features / subsetsize * log(100))
+    cross-validation_folds: list of index lists, optional
+        partition of the training examples into hold-out sets. If given, the features
+        are selected according to the N-fold cross-validation performance with these
+        folds instead of the leave-one-out performance. The hold-out predictions are
+        updated with low-rank formulas, so that a round still costs linear time in
+        n_samples * n_features, but two dense n_samples * n_features caches are needed.
+    train_qids: list of n_queries index lists, optional
+        used as the cross-validation folds if cross-validation_folds is not given,
+        so that the examples of a query are always held out together
+    checkpoint: string, optional
+        directory in which the selection state is saved. G * X.T is kept memory-mapped
+        in the directory, so that saving it costs only a flush, and the memory budget
+        does not apply to it. The performances are appended to performances.txt as
+        they are computed. Supported with dense data in the default exact mode.
+    checkpoint_interval: int, optional
+        number of rounds between saving the state (default 1)
+    resume_from: string, optional
+        checkpoint directory of an interrupted run with the same data and parameters,
+        from whose last saved round the selection is continued. Unless another
+        directory is given with checkpoint, the checkpoints are saved there.
  
     References
     ----------
@@ -44,10 +192,12 @@ class GreedyRLS(AbstractSupervisedLearner, AbstractIterativeLearner):
         AbstractIterativeLearner.loadResources(self)
         X = self.resource_pool[data_sources.TRAIN_FEATURES]
         if isinstance(X, sp.base.spmatrix):
-            self.X = X.todense()
+            #Sparse data is not densified, but processed with solve_factored
+            self.X = None
+            self.Xfactored = sp.csc_matrix(X, dtype = float64)
         else:
             self.X = X
-        self.X = self.X.T
+            self.X = self.X.T
         self.Y = self.resource_pool[data_sources.TRAIN_LABELS]
         #Number of training examples
         self.size = self.Y.shape[0]
@@ -61,6 +211,50 @@ class GreedyRLS(AbstractSupervisedLearner, AbstractIterativeLearner):
             self.measure = self.resource_pool[data_sources.PERFORMANCE_MEASURE]
         else:
             self.measure = None
+        if self.resource_pool.has_key('threads'):
+            self.threads = int(self.resource_pool['threads'])
+        else:
+            self.threads = 0
+        if self.resource_pool.has_key('blocksize'):
+            self.blocksize = int(self.resource_pool['blocksize'])
+        else:
+            self.blocksize = None
+        if self.resource_pool.has_key('memory_budget'):
+            self.memory_budget = int(self.resource_pool['memory_budget'])
+        else:
+            self.memory_budget = 2 ** 30
+        if self.resource_pool.has_key('selection'):
+            self.selection = self.resource_pool['selection']
+        else:
+            self.selection = 'exact'
+        if not self.selection in ['exact', 'lazy', 'stochastic']:
+            raise Exception("Unknown selection mode '" + str(self.selection) + "', the supported ones are 'exact', 'lazy' and 'stochastic'")
+        if self.resource_pool.has_key('batchsize'):
+            self.batchsize = int(self.resource_pool['batchsize'])
+        else:
+            self.batchsize = 1
+        if self.resource_pool.has_key('sample_size'):
+            self.sample_size = int(self.resource_pool['sample_size'])
+        else:
+            self.sample_size = None
+        if self.resource_pool.has_key('resume_from'):
+            self.resume_from = self.resource_pool['resume_from']
+        else:
+            self.resume_from = None
+        if self.resource_pool.has_key('checkpoint'):
+            self.checkpoint = self.resource_pool['checkpoint']
+        else:
+            self.checkpoint = self.resume_from
+        if self.resource_pool.has_key('checkpoint_interval'):
+            self.checkpoint_interval = int(self.resource_pool['checkpoint_interval'])
+        else:
+            self.checkpoint_interval = 1
+        if self.resource_pool.has_key(data_sources.CVFOLDS):
+            self.folds = self.resource_pool[data_sources.CVFOLDS]
+        elif self.resource_pool.has_key(data_sources.TRAIN_QIDS):
+            self.folds = self.resource_pool[data_sources.TRAIN_QIDS]
+        else:
+            self.folds = None
         self.results = {}
     
     
@@ -73,10 +267,21 @@ class GreedyRLS(AbstractSupervisedLearner, AbstractIterativeLearner):
         regparam = float(self.resource_pool[data_sources.TIKHONOV_REGULARIZATION_PARAMETER])
         self.regparam = regparam
         
-        #The current version works only with the squared error measure
-        self.measure = None
-        
-        if True:#self.Y.shape[1] > 1:
+        if self.checkpoint != None and (self.folds is not None or self.X is None or self.selection != 'exact' or self.batchsize > 1):
+            raise Exception("Checkpointing is supported only with dense data in the exact selection mode")
+        if self.folds is not None:
+            self.solve_folds(regparam)
+        elif self.X is None:
+            self.solve_factored(regparam)
+        elif self.checkpoint != None:
+            #G * X.T is memory-mapped
+            self.solve_cython(regparam)
+        elif self.selection != 'exact' or self.batchsize > 1 or 8 * self.X.shape[0] * self.X.shape[1] > self.memory_budget:
+            #G * X.T would not fit in the memory budget, or would be mostly unused
+            #as only a part of the candidates is scored on each round
+            self.Xfactored = asarray(self.X.T, dtype = float64)
+            self.solve_factored(regparam)
+        elif True:#self.Y.shape[1] > 1:
         #if False:#self.Y.shape[1] > 1:
             #self.solve_bu(regparam)
             self.solve_cython(regparam)
@@ -136,6 +341,8 @@ class GreedyRLS(AbstractSupervisedLearner, AbstractIterativeLearner):
         
         XT = X.T
         GXT = rpinv * XT - cv.T * rpinv * (1. / (1. + cv * rpinv * cv.T)) * ((cv * rpinv) * XT)
+        #Column-major, so that the columns of the candidate features are contiguous
+        GXT = asfortranarray(GXT, dtype = float64)
         diagG = []
         for i in range(tsize):
             diagGi = rpinv - cv.T[i, 0] * ca[0, i]
@@ -146,36 +353,73 @@ class GreedyRLS(AbstractSupervisedLearner, AbstractIterativeLearner):
         for ci in range(fsize):
             listX.append(X[ci])
         
-        self.selected = []
+        #G = rpinv * I - C * C.T, needed only for recovering G * X.T from a checkpoint
+        C = zeros((tsize, desiredfcount + 1))
+        ccount = 0
+        if self.bias > 0.:
+            C[:, 0] = rpinv * sqrt(self.bias) / sqrt(1. + rpinv * self.bias * tsize)
+            ccount = 1
         
-        currentfcount = 0
+        self.selected = []
         self.performances = []
         selectedvec = zeros(fsize, dtype = int16)
-        tempvec1, tempvec2, tempvec3 = zeros(tsize), zeros(Y.shape[1]), zeros((tsize, Y.shape[1]))
+        if self.resume_from != None:
+            state = self.load_checkpoint(self.resume_from, X, rpinv)
+            self.selected = state['selected']
+            self.performances = state['performances']
+            self.dualvec = mat(state['dualvec'])
+            diagG = state['diagG']
+            ccount = state['C'].shape[1]
+            C[:, :ccount] = state['C']
+            selectedvec[self.selected] = 1
+            GXT = state['GXT']
+            if self.checkpoint != self.resume_from:
+                GXT = self.open_checkpoint(self.checkpoint, GXT)
+        elif self.checkpoint != None:
+            GXT = self.open_checkpoint(self.checkpoint, GXT)
+        if self.checkpoint != None:
+            perffile = open(os.path.join(self.checkpoint, CHECKPOINT_PERFORMANCES), 'w')
+            for ci, perf in zip(self.selected, self.performances):
+                perffile.write(str(ci) + '\t' + repr(float(perf)) + '\n')
+            perffile.flush()
+        
+        #The measures to be maximized are minimized with their signs flipped
+        if self.measure == None or self.measure.iserror:
+            sign = 1.
+        else:
+            sign = -1.
+        if self.blocksize == None:
+            blocksize = max(1, 2 ** 20 / tsize)
+        else:
+            blocksize = self.blocksize
+        
+        currentfcount = len(self.selected)
         while currentfcount < desiredfcount:
             
-            if not self.measure == None:
-                bestlooperf = None
-            else:
-                bestlooperf = 9999999999.
-            
             #for ci in range(fsize):
             #print Y.dtype, X.dtype, GXT.dtype, diagG.dtype, self.dualvec.dtype
             self.looperf = ones(fsize) * float('Inf')
             #'''
-            bestcind = cython_greedy_rls.find_optimal_feature(Y,
-                                                              X,
-                                                              GXT,
-                                                              diagG,
-                                                              self.dualvec,
-                                                              self.looperf,
-                                                              fsize,
-                                                              tsize,
-                                                              Y.shape[1],
-                                                              selectedvec,
-                                                              tempvec1,
-                                                              tempvec2,
-                                                              tempvec3)
+            if self.measure == None:
+                bestcind = cython_greedy_rls.find_optimal_feature(Y,
+                                                                  X,
+                                                                  GXT,
+                                                                  diagG,
+                                                                  self.dualvec,
+                                                                  self.looperf,
+                                                                  fsize,
+                                                                  tsize,
+                                                                  Y.shape[1],
+                                                                  selectedvec,
+                                                                  self.threads)
+            else:
+                #The leave-one-out predictions are formed from the cached columns of G * X.T
+                for start in range(0, fsize, blocksize):
+                    end = min(start + blocksize, fsize)
+                    self.looperf[start:end] = sign * score_feature_block(X[start:end].T, None, rpinv, asarray(self.dualvec), diagG, asarray(Y, dtype = float64), self.measure, GXT[:, start:end])
+                self.looperf[logical_or(selectedvec > 0, isnan(self.looperf))] = float('Inf')
+                bestcind = argmin(self.looperf)
+                selectedvec[bestcind] = 1
             #foo
             '''
             diagG = mat(diagG).T
@@ -209,20 +453,27 @@ class GreedyRLS(AbstractSupervisedLearner, AbstractIterativeLearner):
                 self.looperf[ci] = looperf_i
             '''
             #'''
-            self.bestlooperf = self.looperf[bestcind]#bestlooperf
+            self.bestlooperf = sign * self.looperf[bestcind]
             self.looperf = mat(self.looperf)
-            self.performances.append(bestlooperf)
+            self.performances.append(self.bestlooperf)
             ci_mapped = bestcind#indsmap[bestcind]
             cv = listX[ci_mapped]
-            GXT_bci = GXT[:, ci_mapped]
+            GXT_bci = mat(GXT[:, ci_mapped]).T
             ca = GXT_bci * (1. / (1. + cv * GXT_bci))
             self.dualvec = self.dualvec - ca * (cv * self.dualvec)
             diagG = diagG - array(multiply(ca, GXT_bci)).reshape((self.size))
-            GXT = GXT - ca * (cv * GXT)
+            C[:, ccount] = array(GXT_bci).ravel() / sqrt(1. + float(cv * GXT_bci))
+            ccount += 1
+            cython_greedy_rls.update_GXT(GXT, X, array(ca).ravel(), ci_mapped, fsize, tsize, self.threads)
             self.selected.append(bestcind)
             #print self.selected
             #print bestlooperf
             currentfcount += 1
+            if self.checkpoint != None:
+                perffile.write(str(bestcind) + '\t' + repr(float(self.bestlooperf)) + '\n')
+                perffile.flush()
+                if currentfcount % self.checkpoint_interval == 0 or currentfcount == desiredfcount:
+                    self.save_checkpoint(self.checkpoint, GXT, C[:, :ccount], diagG)
             
             #Linear model with bias
             self.A[self.selected] = X[self.selected] * self.dualvec
@@ -232,6 +483,353 @@ class GreedyRLS(AbstractSupervisedLearner, AbstractIterativeLearner):
         self.finished()
         self.A[self.selected] = X[self.selected] * self.dualvec
         self.b = bias_slice * self.dualvec# * sqrt(self.bias)
+        if self.checkpoint != None:
+            perffile.close()
+        self.resource_pool[data_sources.SELECTED_FEATURES] = self.selected
+        self.resource_pool[data_sources.GREEDYRLS_LOO_PERFORMANCES] = self.performances
+    
+    
+    def open_checkpoint(self, directory, GXT):
+        """Copies G * X.T into a new memory-mapped file in the checkpoint directory.
+        
+        @return: the memory-mapped G * X.T
+        @rtype: numpy memmap, shape = [n_samples, n_features]"""
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        GXTmm = npformat.open_memmap(os.path.join(directory, CHECKPOINT_GXT), mode = 'w+', dtype = float64, shape = GXT.shape, fortran_order = True)
+        GXTmm[:] = GXT
+        return GXTmm
+    
+    
+    def save_checkpoint(self, directory, GXT, C, diagG):
+        """Saves the selection state into the checkpoint directory. The memory-mapped
+        G * X.T is flushed first, and the rest of the state is then replaced atomically."""
+        GXT.flush()
+        tmpname = os.path.join(directory, CHECKPOINT_STATE + '.tmp')
+        f = open(tmpname, 'wb')
+        savez(f, selected = array(self.selected, dtype = int64), performances = array(self.performances, dtype = float64),
+              dualvec = asarray(self.dualvec), diagG = diagG, C = C,
+              regparam = self.regparam, bias = self.bias, shape = array(GXT.shape))
+        f.close()
+        os.rename(tmpname, os.path.join(directory, CHECKPOINT_STATE))
+    
+    
+    def load_checkpoint(self, directory, X, rpinv):
+        """Loads the selection state saved with save_checkpoint.
+        
+        The memory-mapped G * X.T may have been updated beyond the saved round, or only
+        partially, if the run was interrupted between checkpoints. It is checked against
+        the saved factors of G with a random projection, and recomputed from them if needed.
+        
+        @param X: the data matrix, shape = [n_features, n_samples]
+        @return: the saved state, with the memory-mapped G * X.T as 'GXT'
+        @rtype: dict"""
+        f = open(os.path.join(directory, CHECKPOINT_STATE), 'rb')
+        npz = load(f)
+        state = dict((key, npz[key]) for key in npz.files)
+        f.close()
+        fsize, tsize = X.shape
+        if tuple(state['shape']) != (tsize, fsize) or float(state['regparam']) != self.regparam or float(state['bias']) != self.bias:
+            raise Exception('The checkpoint in ' + directory + ' was saved with different data or parameters')
+        state['selected'] = [int(ci) for ci in state['selected']]
+        state['performances'] = [float(perf) for perf in state['performances']]
+        GXT = npformat.open_memmap(os.path.join(directory, CHECKPOINT_GXT), mode = 'r+')
+        C = state['C']
+        v = random.randn(tsize)
+        Gv = rpinv * v - dot(C, dot(C.T, v))
+        lhs = dot(v, GXT)
+        rhs = asarray(dot(X, Gv)).ravel()
+        if not allclose(lhs, rhs, rtol = 1e-6, atol = 1e-8 * (abs(rhs).max() + 1.)):
+            for start in range(0, fsize, max(1, 2 ** 20 / tsize)):
+                end = min(start + max(1, 2 ** 20 / tsize), fsize)
+                XTB = asarray(X[start:end]).T
+                GXT[:, start:end] = rpinv * XTB - dot(C, dot(C.T, XTB))
+            GXT.flush()
+        state['GXT'] = GXT
+        return state
+    
+    
+    def solve_factored(self, regparam):
+        """Greedy selection without storing G * X.T, used with sparse data, when
+        G * X.T would exceed the memory budget, and for the approximate selection modes.
+        
+        G = (K + regparam * I)^-1 is kept as (1 / regparam) * I - C * C.T, where C has
+        a column for the bias and for each selected feature, and the candidate features
+        are scored a block at a time. The memory use is thus O(nnz(X) + n_samples * subsetsize).
+        """
+        self.regparam = regparam
+        X = self.Xfactored
+        Y = asarray(array_tools.as_labelmatrix(self.Y), dtype = float64)
+        tsize, fsize = X.shape
+        lsize = Y.shape[1]
+        rpinv = 1. / regparam
+        
+        if not self.resource_pool.has_key('subsetsize'):
+            raise Exception("Parameter 'subsetsize' must be given.")
+        desiredfcount = int(self.resource_pool['subsetsize'])
+        if not fsize >= desiredfcount:
+            raise Exception('The overall number of features ' + str(fsize) + ' is smaller than the desired number ' + str(desiredfcount) + ' of features to be selected.')
+        if self.blocksize == None:
+            blocksize = max(1, 2 ** 20 / tsize)
+        else:
+            blocksize = self.blocksize
+        
+        C = zeros((tsize, desiredfcount + 1))
+        ccount = 0
+        #Biaz
+        if self.bias > 0.:
+            cv = sqrt(self.bias) * ones(tsize)
+            C[:, 0] = rpinv * cv / sqrt(1. + rpinv * dot(cv, cv))
+            ccount = 1
+        Cs = C[:, :ccount]
+        dualvec = rpinv * Y - dot(Cs, dot(Cs.T, Y))
+        diagG = rpinv - sum(Cs * Cs, axis = 1)
+        
+        #The measures to be maximized are minimized with their signs flipped
+        if self.measure == None or self.measure.iserror:
+            sign = 1.
+        else:
+            sign = -1.
+        
+        def score_block(XB):
+            looperf = sign * score_feature_block(XB, C[:, :ccount], rpinv, dualvec, diagG, Y, self.measure)
+            looperf[isnan(looperf)] = float('Inf')
+            return looperf
+        
+        def score(inds):
+            looperf = empty(len(inds))
+            for start in range(0, len(inds), blocksize):
+                end = min(start + blocksize, len(inds))
+                looperf[start:end] = score_block(X[:, inds[start:end]])
+            return looperf
+        
+        def current_perf():
+            #The leave-one-out performance of the current set
+            if self.measure == None:
+                return mean((dualvec / diagG[:, newaxis]) ** 2)
+            return sign * label_mean(column_performances(self.measure, Y, Y - dualvec / diagG[:, newaxis])[newaxis, :])[0]
+        
+        if self.selection == 'stochastic':
+            if self.sample_size == None:
+                sample_size = int(math.ceil(float(fsize) / desiredfcount * math.log(100.)))
+            else:
+                sample_size = self.sample_size
+        
+        self.A = mat(zeros((fsize, lsize)))
+        self.selected = []
+        self.performances = []
+        self.selection_rounds = []
+        self.evaluations = []
+        selectedvec = zeros(fsize, dtype = bool)
+        queue = None
+        roundcount = 0
+        while len(self.selected) < desiredfcount:
+            batchsize = min(self.batchsize, desiredfcount - len(self.selected))
+            if self.selection == 'exact' or (self.selection == 'lazy' and queue == None):
+                looperf = empty(fsize)
+                for start in range(0, fsize, blocksize):
+                    end = min(start + blocksize, fsize)
+                    looperf[start:end] = score_block(X[:, start:end])
+                looperf[selectedvec] = float('Inf')
+                self.looperf = mat(looperf)
+                evaluations = fsize - len(self.selected)
+                if self.selection == 'lazy':
+                    #Priority queue of (-gain, feature, round on which the gain was computed), where
+                    #the gain is the decrease of the leave-one-out error caused by adding the feature
+                    curperf = current_perf()
+                    queue = [(looperf[ci] - curperf, ci, roundcount) for ci in range(fsize) if not selectedvec[ci]]
+                    heapq.heapify(queue)
+                else:
+                    bestcinds = argsort(looperf, kind = 'mergesort')[:batchsize]
+                    bestperfs = looperf[bestcinds]
+            if self.selection == 'stochastic':
+                remaining = flatnonzero(logical_not(selectedvec))
+                sample = random.permutation(remaining)[:sample_size]
+                sampleperf = score(sample)
+                order = argsort(sampleperf, kind = 'mergesort')[:batchsize]
+                bestcinds, bestperfs = sample[order], sampleperf[order]
+                evaluations = len(sample)
+            elif self.selection == 'lazy':
+                #The gains computed on earlier rounds are treated as upper bounds of the current ones
+                curperf = current_perf()
+                if roundcount > 0:
+                    evaluations = 0
+                bestcinds, bestperfs = [], []
+                while len(bestcinds) < batchsize:
+                    neggain, ci, scoreround = heapq.heappop(queue)
+                    if scoreround < roundcount:
+                        neggain = score([ci])[0] - curperf
+                        evaluations += 1
+                        if len(queue) > 0 and neggain > queue[0][0]:
+                            heapq.heappush(queue, (neggain, ci, roundcount))
+                            continue
+                    bestcinds.append(ci)
+                    bestperfs.append(neggain + curperf)
+            self.evaluations.append(evaluations)
+            
+            for bestcind, bestperf in zip(bestcinds, bestperfs):
+                self.bestlooperf = sign * bestperf
+                self.performances.append(self.bestlooperf)
+                self.selection_rounds.append(roundcount)
+                
+                x = X[:, bestcind]
+                if sp.issparse(x):
+                    x = x.toarray()
+                x = asarray(x).ravel()
+                Cs = C[:, :ccount]
+                g = rpinv * x - dot(Cs, dot(Cs.T, x))
+                c = g / sqrt(1. + dot(x, g))
+                C[:, ccount] = c
+                ccount += 1
+                dualvec = dualvec - outer(c, dot(c, Y))
+                diagG = diagG - c * c
+                self.selected.append(bestcind)
+                selectedvec[bestcind] = True
+            self.dualvec = mat(dualvec)
+            roundcount += 1
+            
+            #Linear model with bias
+            self.A[self.selected] = X[:, self.selected].T.dot(dualvec)
+            self.b = mat(sqrt(self.bias) * sum(dualvec, axis = 0))
+            
+            self.callback()
+        self.finished()
+        self.resource_pool[data_sources.SELECTED_FEATURES] = self.selected
+        self.resource_pool[data_sources.GREEDYRLS_LOO_PERFORMANCES] = self.performances
+        self.resource_pool[data_sources.GREEDYRLS_SELECTION_ROUNDS] = self.selection_rounds
+        self.resource_pool[data_sources.GREEDYRLS_EVALUATIONS] = self.evaluations
+    
+    
+    def solve_folds(self, regparam):
+        """Greedy selection with the N-fold cross-validation criterion.
+        
+        The hold-out residuals of fold F are R_F = (G_FF)^-1 * (G * Y)_F, where
+        G = (K + regparam * I)^-1. Besides GXT = G * X.T, the solver caches
+        U = M * G * X.T, where M is block diagonal with the blocks (G_FF)^-1. Adding
+        a feature x with c = G * x / sqrt(1 + x.T * G * x) downdates G by c * c.T and
+        updates each block of M by a rank-one term, so that the residuals of all the
+        candidates follow from GXT, U and per-fold sums in linear time.
+        """
+        self.regparam = regparam
+        if self.X is None:
+            X = self.Xfactored
+        else:
+            X = asarray(self.X.T, dtype = float64)
+        Y = asarray(array_tools.as_labelmatrix(self.Y), dtype = float64)
+        tsize, fsize = X.shape
+        lsize = Y.shape[1]
+        rpinv = 1. / regparam
+        
+        if not self.resource_pool.has_key('subsetsize'):
+            raise Exception("Parameter 'subsetsize' must be given.")
+        desiredfcount = int(self.resource_pool['subsetsize'])
+        if not fsize >= desiredfcount:
+            raise Exception('The overall number of features ' + str(fsize) + ' is smaller than the desired number ' + str(desiredfcount) + ' of features to be selected.')
+        if self.selection != 'exact' or self.batchsize > 1:
+            raise Exception("The cross-validation criterion supports only the exact selection of one feature at a time")
+        if self.blocksize == None:
+            blocksize = max(1, 2 ** 20 / (tsize * lsize))
+        else:
+            blocksize = self.blocksize
+        
+        folds = [array(fold, dtype = int64) for fold in self.folds]
+        foldof = -ones(tsize, dtype = int64)
+        for i, fold in enumerate(folds):
+            if any(foldof[fold] >= 0):
+                raise Exception("The cross-validation folds must not overlap")
+            foldof[fold] = i
+        if any(foldof < 0):
+            raise Exception("Each training example must belong to a cross-validation fold")
+        #Sums over the examples of each fold are computed as products with an indicator matrix
+        foldsum = sp.csr_matrix((ones(tsize), (foldof, arange(tsize))), shape = (len(folds), tsize))
+        
+        #The measures to be maximized are minimized with their signs flipped
+        if self.measure == None or self.measure.iserror:
+            sign = 1.
+        else:
+            sign = -1.
+        
+        #Without any features G = rpinv * I, M = regparam * I and the hold-out predictions are zero
+        dualvec = rpinv * Y
+        residuals = Y.copy()
+        GXT = rpinv * X
+        if sp.issparse(GXT):
+            GXT = GXT.toarray()
+        GXT = asarray(GXT)
+        U = asarray(X.toarray()) if sp.issparse(X) else X.copy()
+        
+        def column_dots(XB, B):
+            if sp.issparse(XB):
+                return asarray(XB.multiply(B).sum(axis = 0)).ravel()
+            return sum(XB * B, axis = 0)
+        
+        def block_residuals(x, g, u, d):
+            #Hold-out residuals after adding each of the columns of x, where g = G * x,
+            #u = M * g and d = 1 + x.T * g
+            S = foldsum.dot(g * u)
+            Q = foldsum.dot((u[:, :, newaxis] * dualvec[:, newaxis, :]).reshape(tsize, -1)).reshape(len(folds), u.shape[1], lsize)
+            if sp.issparse(x):
+                T = asarray(x.T.dot(dualvec))
+            else:
+                T = dot(x.T, dualvec)
+            return residuals[:, newaxis, :] + u[:, :, newaxis] * (Q[foldof] - T[newaxis]) / (d - S)[foldof][:, :, newaxis]
+        
+        def add_fold_update(x, g, u, d, R):
+            #Updates the caches after adding x, R being its residuals from block_residuals
+            c = g / sqrt(d)
+            ustar = u / sqrt(d)
+            sfold = foldsum.dot(g * u) / d
+            z = X.T.dot(c)
+            coef = ustar / (1. - sfold[foldof])
+            for start in range(0, fsize, blocksize):
+                end = min(start + blocksize, fsize)
+                W = foldsum.dot(ustar[:, newaxis] * GXT[:, start:end])
+                U[:, start:end] += coef[:, newaxis] * (W[foldof] - z[start:end])
+                GXT[:, start:end] -= outer(c, z[start:end])
+            residuals[:] = R
+            dualvec[:] = dualvec - outer(c, dot(c, Y))
+        
+        #Biaz
+        if self.bias > 0.:
+            x = sqrt(self.bias) * ones((tsize, 1))
+            g = rpinv * x
+            d = 1. + sum(x * g, axis = 0)
+            add_fold_update(x[:, 0], g[:, 0], x[:, 0], d[0], block_residuals(x, g, x, d)[:, 0, :])
+        
+        self.A = mat(zeros((fsize, lsize)))
+        self.selected = []
+        self.performances = []
+        selectedvec = zeros(fsize, dtype = bool)
+        while len(self.selected) < desiredfcount:
+            d = 1. + column_dots(X, GXT)
+            looperf = empty(fsize)
+            for start in range(0, fsize, blocksize):
+                end = min(start + blocksize, fsize)
+                R = block_residuals(X[:, start:end], GXT[:, start:end], U[:, start:end], d[start:end])
+                looperf[start:end] = sign * self.fold_performances(Y, R, folds)
+            looperf[logical_or(selectedvec, isnan(looperf))] = float('Inf')
+            self.looperf = mat(looperf)
+            bestcind = argmin(looperf)
+            self.bestlooperf = sign * looperf[bestcind]
+            self.performances.append(self.bestlooperf)
+            
+            x = X[:, bestcind]
+            if sp.issparse(x):
+                x = x.toarray()
+            x = asarray(x)
+            g, u = GXT[:, bestcind].copy(), U[:, bestcind].copy()
+            R = block_residuals(x, g[:, newaxis], u[:, newaxis], d[bestcind:bestcind + 1])[:, 0, :]
+            add_fold_update(x.ravel(), g, u, d[bestcind], R)
+            self.selected.append(bestcind)
+            selectedvec[bestcind] = True
+            self.dualvec = mat(dualvec)
+            
+            #Linear model with bias
+            self.A[self.selected] = X[:, self.selected].T.dot(dualvec)
+            self.b = mat(sqrt(self.bias) * sum(dualvec, axis = 0))
+            
+            self.callback()
+        self.finished()
         self.resource_pool[data_sources.SELECTED_FEATURES] = self.selected
         self.resource_pool[data_sources.GREEDYRLS_LOO_PERFORMANCES] = self.performances
     
@@ -355,6 +953,12 @@ class GreedyRLS(AbstractSupervisedLearner, AbstractIterativeLearner):
         self.results[data_sources.MODEL] = self.getModel()
     
     
+    def fold_performances(self, Y, R, folds):
+        """Computes the cross-validation performances of a block of candidates from
+        their hold-out residuals, see score_fold_residuals."""
+        return score_fold_residuals(Y, R, folds, self.measure)
+    
+    
     def getModel(self):
         """Returns the trained model, call this only after training.
         
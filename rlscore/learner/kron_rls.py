@@ -2,36 +2,219 @@
 import pyximport; pyximport.install()
 
 import math
+from multiprocessing.pool import ThreadPool
 
 from numpy import *
 import numpy.linalg as la
+import scipy.sparse as sp
 
 from rlscore.learner.abstract_learner import AbstractLearner
 from rlscore import data_sources
 from rlscore import model
 from rlscore.utilities import array_tools
 from rlscore.utilities import decomposition
+from rlscore.measure.measure_utilities import UndefinedPerformance
 
 from rlscore.utilities import sparse_kronecker_multiplication_tools
 
 
+def add_to_kernel_decomposition(K, evals, evecs, K_new_block):
+    """Borders the kernel matrix K with new rows, and updates its eigen decomposition accordingly."""
+    oldsize = K.shape[0]
+    newcount = K_new_block.shape[0]
+    if K_new_block.shape[1] != oldsize + newcount:
+        raise Exception('The new kernel block must have ' + str(oldsize + newcount) + ' columns, it has ' + str(K_new_block.shape[1]) + '.')
+    evals, evecs = decomposition.updateBorderedEigenDecompositionBlock(evals, evecs, K_new_block[:, :oldsize], K_new_block[:, oldsize:])
+    newK = mat(zeros((oldsize + newcount, oldsize + newcount)))
+    newK[:oldsize, :oldsize] = K
+    newK[oldsize:] = K_new_block
+    newK[:oldsize, oldsize:] = K_new_block[:, :oldsize].T
+    return newK, mat(evals).T, evecs
+
+
+def batch_multiply_labels(V, Ys, U):
+    """Computes the products V.T * Y * U for a list of label matrices Y with two matrix multiplications."""
+    targetcount = len(Ys)
+    rows, cols = Ys[0].shape
+    Ystack = empty((rows, targetcount * cols))
+    for t in range(targetcount):
+        Ystack[:, t * cols: (t + 1) * cols] = Ys[t]
+    VTY = dot(asarray(V).T, Ystack)
+    VTY = VTY.reshape((V.shape[1], targetcount, cols)).transpose((1, 0, 2)).reshape((targetcount * V.shape[1], cols))
+    VTYU = dot(VTY, asarray(U)).reshape((targetcount, V.shape[1], U.shape[1]))
+    return [mat(VTYU[t]) for t in range(targetcount)]
+
+
+#Supported kernels on pairs: the Kronecker product kernel K1 x K2, the Cartesian kernel
+#K1 x I + I x K2, and the symmetric and anti-symmetric Kronecker kernels for pairs of
+#objects from the same domain, (K x K)(I + P) / 2 and (K x K)(I - P) / 2, where P swaps
+#the order of the objects in the pairs.
+PAIRWISE_KERNELS = ['kronecker', 'cartesian', 'symmetric', 'anti_symmetric']
+
+
+def same_matrix(A, B):
+    """Returns True if the dense or sparse matrices A and B have the same shape and values."""
+    if A is B:
+        return True
+    if A.shape != B.shape:
+        return False
+    if sp.issparse(A) or sp.issparse(B):
+        return (sp.csr_matrix(A) != sp.csr_matrix(B)).nnz == 0
+    return bool((asarray(A) == asarray(B)).all())
+
+
 class KronRLS(AbstractLearner):
 
     def loadResources(self):
         Y = self.resource_pool[data_sources.TRAIN_LABELS]
-        Y = array_tools.as_labelmatrix(Y)
-        self.Y = Y
+        if isinstance(Y, list) or len(Y.shape) == 3:
+            #Several label matrices sharing the same kernel or data matrices
+            self.Ys = [array_tools.as_labelmatrix(Yt) for Yt in Y]
+            for Yt in self.Ys:
+                if Yt.shape != self.Ys[0].shape:
+                    raise Exception('All the label matrices must be of the same shape.')
+            self.targets = None
+        else:
+            Y = array_tools.as_labelmatrix(Y)
+            self.Y = Y
+        if self.resource_pool.has_key('threads'):
+            self.threads = int(self.resource_pool['threads'])
+        else:
+            self.threads = 1
+        if self.resource_pool.has_key('pairwise_kernel'):
+            self.pairwise_kernel = self.resource_pool['pairwise_kernel']
+        else:
+            self.pairwise_kernel = 'kronecker'
+        if not self.pairwise_kernel in PAIRWISE_KERNELS:
+            raise Exception("Unknown pairwise kernel '" + str(self.pairwise_kernel) + "', the supported ones are " + ", ".join(PAIRWISE_KERNELS))
         self.trained = False
     
     
     def train(self):
         regparam = self.resource_pool['regparam']
-        if self.resource_pool.has_key('kmatrix1'):
+        self.solve(regparam)
+    
+    
+    def solve(self, regparam):
+        """Re-trains the learner with a new regularization parameter.
+        
+        When several label matrices were supplied, a KronRLS learner is trained for
+        each of them. The eigen decompositions are computed only once and shared by
+        all the learners, and the model of the learner is a list of the models of
+        the label matrices.
+        
+        Parameters
+        ----------
+        regparam: float (regparam > 0)
+            regularization parameter
+        """
+        if hasattr(self, "Ys"):
+            self.solve_targets(regparam)
+        elif self.resource_pool.has_key('kmatrix1'):
             self.solve_kernel(regparam)
         else:
             self.solve_linear(regparam)
     
     
+    def solve_targets(self, regparam):
+        self.regparam = regparam
+        if self.targets is None:
+            self.targets = []
+            for Yt in self.Ys:
+                rpool = dict(self.resource_pool)
+                rpool[data_sources.TRAIN_LABELS] = Yt
+                rpool['threads'] = 1
+                self.targets.append(KronRLS.createLearner(**rpool))
+            first = self.targets[0]
+            if self.resource_pool.has_key('kmatrix1'):
+                first.decompose_kernels()
+                attrnames = ['K1', 'K2', 'evals1', 'V', 'evals2', 'U']
+            else:
+                first.decompose_data_matrices()
+                attrnames = ['truncated', 'svals1', 'evals1', 'V', 'rsvecs1', 'svals2', 'evals2', 'U', 'rsvecs2']
+            VTYUs = batch_multiply_labels(first.V, self.Ys, first.U)
+            for target, VTYU in zip(self.targets, VTYUs):
+                for attrname in attrnames:
+                    setattr(target, attrname, getattr(first, attrname))
+                target.VTYU = VTYU
+                target.trained = True
+        self.trained = True
+        def solve_target(t):
+            self.targets[t].solve(regparam)
+        self.map_targets(solve_target)
+        self.model = [target.getModel() for target in self.targets]
+    
+    
+    def map_targets(self, f):
+        """Calls f with the index of each label matrix, in a thread pool if threads > 1."""
+        if self.threads > 1:
+            pool = ThreadPool(min(self.threads, len(self.targets)))
+            try:
+                return pool.map(f, range(len(self.targets)))
+            finally:
+                pool.close()
+        else:
+            return [f(t) for t in range(len(self.targets))]
+    
+    
+    def decompose_kernels(self):
+        self.K1 = mat(self.resource_pool['kmatrix1'])
+        self.K2 = mat(self.resource_pool['kmatrix2'])
+        evals1, V  = la.eigh(self.K1)
+        self.evals1 = mat(evals1).T
+        self.V = mat(V)
+        
+        if self.K1.shape == self.K2.shape and (self.K1 == self.K2).all():
+            self.evals2, self.U = self.evals1, self.V
+        else:
+            evals2, U = la.eigh(self.K2)
+            self.evals2 = mat(evals2).T
+            self.U = mat(U)
+    
+    
+    def decompose_data_matrices(self):
+        X1, X2 = self.data_matrices()
+        if self.resource_pool.has_key('svd_rank'):
+            #Truncated singular value decompositions, the model is then stored in a factored form
+            self.truncated = True
+            rank = int(self.resource_pool['svd_rank'])
+            #A seed or a numpy.random.RandomState makes the decompositions reproducible
+            random_state = self.resource_pool.get('random_state')
+            if not isinstance(random_state, random.RandomState):
+                random_state = random.RandomState(random_state)
+            svals1, V, rsvecs1 = decomposition.decomposeDataMatrixRandomized(X1.T, rank, random_state = random_state)
+            self.svals1 = svals1.T
+            self.evals1 = multiply(self.svals1, self.svals1)
+            self.V = V
+            self.rsvecs1 = mat(rsvecs1)
+            if same_matrix(X1, X2):
+                svals2, U, rsvecs2 = svals1, V, rsvecs1
+            else:
+                svals2, U, rsvecs2 = decomposition.decomposeDataMatrixRandomized(X2.T, rank, random_state = random_state)
+            self.svals2 = svals2.T
+            self.evals2 = multiply(self.svals2, self.svals2)
+            self.U = U
+            self.rsvecs2 = mat(rsvecs2)
+            return
+        if sp.issparse(X1) or sp.issparse(X2):
+            raise Exception("The parameter svd_rank must be given when the data matrices are sparse.")
+        self.truncated = False
+        svals1, V, rsvecs1 = decomposition.decomposeDataMatrix(X1.T)
+        self.svals1 = svals1.T
+        self.evals1 = multiply(self.svals1, self.svals1)
+        self.V = V
+        self.rsvecs1 = mat(rsvecs1)
+        
+        if same_matrix(X1, X2):
+            svals2, U, rsvecs2 = svals1, V, rsvecs1
+        else:
+            svals2, U, rsvecs2 = decomposition.decomposeDataMatrix(X2.T)
+        self.svals2 = svals2.T
+        self.evals2 = multiply(self.svals2, self.svals2)
+        self.U = U
+        self.rsvecs2 = mat(rsvecs2)
+    
+    
     def solve_kernel(self, regparam):
         self.regparam = regparam
         K1 = mat(self.resource_pool['kmatrix1'])
@@ -42,56 +225,165 @@ class KronRLS(AbstractLearner):
         
         if not self.trained:
             self.trained = True
-            evals1, V  = la.eigh(K1)
-            evals1 = mat(evals1).T
-            V = mat(V)
-            self.evals1 = evals1
-            self.V = V
-            
-            evals2, U = la.eigh(K2)
-            evals2 = mat(evals2).T
-            U = mat(U)
-            self.evals2 = evals2
-            self.U = U
-            self.VTYU = V.T * self.Y * U
+            self.decompose_kernels()
+            self.VTYU = self.V.T * self.Y * self.U
         
-        newevals = 1. / (self.evals1 * self.evals2.T + regparam)
+        if self.pairwise_kernel == 'cartesian':
+            newevals = 1. / (self.evals1 + self.evals2.T + regparam)
+        else:
+            newevals = 1. / (self.evals1 * self.evals2.T + regparam)
         
-        self.A = multiply(self.VTYU, newevals)
+        self.A = multiply(self.symmetrized_VTYU(), newevals)
         self.A = self.V * self.A * self.U.T
-        self.model = KernelPairwiseModel(self.A)
+        if self.pairwise_kernel == 'cartesian':
+            self.model = CartesianPairwiseModel(self.A)
+        else:
+            self.model = KernelPairwiseModel(self.A)
+    
+    
+    def symmetrized_VTYU(self):
+        """Returns V.T * Y * U projected to the subspace spanned by the pairwise kernel.
+        
+        For the symmetric (anti-symmetric) kernels the labels are replaced with their
+        symmetric (anti-symmetric) part, the coefficients of the other part being
+        irrelevant to the predictions. As U = V, this is done in the eigenbasis.
+        """
+        if self.pairwise_kernel in ['symmetric', 'anti_symmetric']:
+            if not self.U is self.V:
+                raise Exception("The " + self.pairwise_kernel + " pairwise kernel requires identical matrices for both domains.")
+            if self.pairwise_kernel == 'symmetric':
+                return 0.5 * (self.VTYU + self.VTYU.T)
+            else:
+                return 0.5 * (self.VTYU - self.VTYU.T)
+        return self.VTYU
+    
+    
+    def hat_evals(self, start = 0, end = None):
+        """Returns the eigenvalues of the hat matrix for the eigenvalues start, ..., end-1 of the first domain."""
+        if self.pairwise_kernel in ['symmetric', 'anti_symmetric']:
+            raise Exception("Leave-one-out is not supported for the " + self.pairwise_kernel + " pairwise kernel.")
+        evals1 = asarray(self.evals1).ravel()[start:end]
+        evals2 = asarray(self.evals2).ravel()
+        if self.pairwise_kernel == 'cartesian':
+            pairevals = add.outer(evals1, evals2)
+        else:
+            pairevals = multiply.outer(evals1, evals2)
+        return pairevals / (pairevals + self.regparam)
+    
+    
+    def training_predictions(self, row_inds = slice(None)):
+        """Returns the predictions of the kernel model for the given rows of the training grid."""
+        if self.pairwise_kernel == 'cartesian':
+            return self.K1[row_inds] * self.A + self.A[row_inds] * self.K2.T
+        return (self.K1[row_inds] * self.A) * self.K2.T
+    
+    
+    def add_rows(self, K1_new_block, Y_rows):
+        """Adds new examples of the first domain to a KronRLS trained with kernel matrices.
+        
+        The eigen decomposition of K1 is updated with the whole block of new examples instead
+        of recomputing it, after which the learner is re-trained with the current regparam.
+        Not supported with several label matrices or the symmetric and anti-symmetric
+        pairwise kernels.
+        
+        Parameters
+        ----------
+        K1_new_block: {array-like}, shape = [n_new, n_samples1 + n_new]
+            kernel evaluations between the new examples and all examples of the first domain,
+            the old ones first, followed by the new ones in the same order as the rows
+        Y_rows: {array-like}, shape = [n_new, n_samples2]
+            labels of the new rows
+        """
+        if not hasattr(self, "K1"):
+            raise Exception("Rows can be added only to KronRLS trained with kernel matrices.")
+        if hasattr(self, "Ys"):
+            raise Exception("Rows can not be added to KronRLS trained with several label matrices.")
+        if self.pairwise_kernel in ['symmetric', 'anti_symmetric']:
+            raise Exception("Rows can not be added with the " + self.pairwise_kernel + " pairwise kernel, which requires identical matrices for both domains.")
+        K1_new_block = array_tools.as_dense_matrix(K1_new_block)
+        Y_rows = array_tools.as_dense_matrix(Y_rows)
+        self.K1, self.evals1, self.V = add_to_kernel_decomposition(self.K1, self.evals1, self.V, K1_new_block)
+        self.resource_pool['kmatrix1'] = self.K1
+        self.Y = vstack([self.Y, Y_rows])
+        self.retrain_after_update()
+    
+    
+    def add_cols(self, K2_new_block, Y_cols):
+        """Adds new examples of the second domain to a KronRLS trained with kernel matrices.
+        
+        The eigen decomposition of K2 is updated with the whole block of new examples instead
+        of recomputing it, after which the learner is re-trained with the current regparam.
+        Not supported with several label matrices or the symmetric and anti-symmetric
+        pairwise kernels.
+        
+        Parameters
+        ----------
+        K2_new_block: {array-like}, shape = [n_new, n_samples2 + n_new]
+            kernel evaluations between the new examples and all examples of the second domain,
+            the old ones first, followed by the new ones in the same order as the columns
+        Y_cols: {array-like}, shape = [n_samples1, n_new]
+            labels of the new columns
+        """
+        if not hasattr(self, "K2"):
+            raise Exception("Columns can be added only to KronRLS trained with kernel matrices.")
+        if hasattr(self, "Ys"):
+            raise Exception("Columns can not be added to KronRLS trained with several label matrices.")
+        if self.pairwise_kernel in ['symmetric', 'anti_symmetric']:
+            raise Exception("Columns can not be added with the " + self.pairwise_kernel + " pairwise kernel, which requires identical matrices for both domains.")
+        K2_new_block = array_tools.as_dense_matrix(K2_new_block)
+        Y_cols = array_tools.as_dense_matrix(Y_cols)
+        self.K2, self.evals2, self.U = add_to_kernel_decomposition(self.K2, self.evals2, self.U, K2_new_block)
+        self.resource_pool['kmatrix2'] = self.K2
+        self.Y = hstack([self.Y, Y_cols])
+        self.retrain_after_update()
+    
+    
+    def retrain_after_update(self):
+        self.resource_pool[data_sources.TRAIN_LABELS] = self.Y
+        self.VTYU = self.V.T * self.Y * self.U
+        #The leave-one-out caches depend on the eigenvectors
+        for cachename in ["Vsqr", "Usqr"]:
+            if hasattr(self, cachename):
+                delattr(self, cachename)
+        self.solve_kernel(self.regparam)
     
     
     def solve_linear(self, regparam):
         self.regparam = regparam
-        X1 = mat(self.resource_pool['xmatrix1'])
-        X2 = mat(self.resource_pool['xmatrix2'])
+        if self.pairwise_kernel == 'cartesian':
+            raise Exception("The Cartesian pairwise kernel is supported only with kernel matrices.")
+        X1, X2 = self.data_matrices()
         Y = self.Y.reshape((X1.shape[0], X2.shape[0]), order='F')
         if not self.trained:
             self.trained = True
-            svals1, V, rsvecs1 = decomposition.decomposeDataMatrix(X1.T)
-            self.svals1 = svals1.T
-            self.evals1 = multiply(self.svals1, self.svals1)
-            self.V = V
-            self.rsvecs1 = mat(rsvecs1)
-            
-            if X1.shape == X2.shape and (X1 == X2).all():
-                svals2, U, rsvecs2 = svals1, V, rsvecs1
-            else:
-                svals2, U, rsvecs2 = decomposition.decomposeDataMatrix(X2.T)
-            self.svals2 = svals2.T
-            self.evals2 = multiply(self.svals2, self.svals2)
-            self.U = U
-            self.rsvecs2 = mat(rsvecs2)
-            
-            self.VTYU = V.T * Y * U
+            self.decompose_data_matrices()
+            self.VTYU = self.V.T * Y * self.U
         
         kronsvals = self.svals1 * self.svals2.T
         
         newevals = divide(kronsvals, multiply(kronsvals, kronsvals) + regparam)
-        self.W = multiply(self.VTYU, newevals)
-        self.W = self.rsvecs1.T * self.W * self.rsvecs2
-        self.model = LinearPairwiseModel(self.W)
+        core = multiply(self.symmetrized_VTYU(), newevals)
+        if self.truncated:
+            #W = R1 * core * R2.T is never formed explicitly
+            self.W = None
+            self.model = LinearPairwiseModel(R1 = self.rsvecs1.T, core = core, R2 = self.rsvecs2.T)
+        else:
+            self.W = self.rsvecs1.T * core * self.rsvecs2
+            self.model = LinearPairwiseModel(self.W)
+    
+    
+    def data_matrices(self):
+        X1 = self.resource_pool['xmatrix1']
+        X2 = self.resource_pool['xmatrix2']
+        if sp.issparse(X1):
+            X1 = sp.csr_matrix(X1)
+        else:
+            X1 = mat(X1)
+        if sp.issparse(X2):
+            X2 = sp.csr_matrix(X2)
+        else:
+            X2 = mat(X2)
+        return X1, X2
     
     
     def solve_linear_conditional_ranking(self, regparam):
@@ -127,39 +419,146 @@ class KronRLS(AbstractLearner):
         self.model = LinearPairwiseModel(self.W)
     
     
-    def imputationLOO(self):
-        if not hasattr(self, "K1"):
-            X1 = mat(self.resource_pool['xmatrix1'])
-            X2 = mat(self.resource_pool['xmatrix2'])
-            P = X1 * self.W * X2.T
-        else:
-            P = self.K1 * self.A * self.K2.T
+    def imputationLOO(self, out = None, blocksize = 1000):
+        """Computes the leave-one-out predictions for all the pairs of the training grid.
         
-        newevals = multiply(self.evals2 * self.evals1.T, 1. / (self.evals2 * self.evals1.T + self.regparam))
-        Vsqr = multiply(self.V, self.V)
+        The predictions are computed in blocks of rows so that no grid sized
+        temporary matrices are allocated in addition to the output.
+        
+        Parameters
+        ----------
+        out: {array-like}, shape = [n_samples1, n_samples2], optional
+            buffer where the predictions are written, e.g. a numpy.memmap
+            for grids that do not fit in memory
+        blocksize: int, optional
+            number of rows processed at a time
+        
+        Returns
+        -------
+        loopred: {array-like}, shape = [n_samples1, n_samples2]
+            the leave-one-out predictions, stored in out if it was supplied
+            (lists of these, one for each label matrix, if the learner was
+            trained with several label matrices)
+        """
+        if hasattr(self, "Ys"):
+            if out is None:
+                out = [None] * len(self.targets)
+            return self.map_targets(lambda t: self.targets[t].imputationLOO(out[t], blocksize))
+        if out is None:
+            out = mat(zeros(self.Y.shape))
+        for start, end, loopred in self.imputationLOOBlocks(blocksize):
+            out[start:end] = loopred
+        return out
+    
+    
+    def imputationLOOBlocks(self, blocksize = 1000):
+        """Generates the leave-one-out predictions of the training grid one block of rows at a time.
+        
+        Parameters
+        ----------
+        blocksize: int, optional
+            number of rows in each block
+        
+        Returns
+        -------
+        blocks: generator
+            yields tuples (start, end, loopred), where loopred contains the
+            leave-one-out predictions for the rows start, ..., end-1
+        """
+        linear = not hasattr(self, "K1")
+        if linear:
+            X1, X2 = self.data_matrices()
+            if self.truncated:
+                X1 = X1 * self.model.R1
+                W = self.model.core
+                X2 = X2 * self.model.R2
+            else:
+                W = self.W
+        evalcount = self.evals1.shape[0]
         Usqr = multiply(self.U, self.U)
-        #loopred = mat(zeros((self.V.shape[0], self.U.shape[0])))
-        #print self.U.shape[0], self.V.shape[0], self.Y.shape, loopred.shape, P.shape
-        #for i in range(self.V.shape[0]):
-            #cache = Vsqr[i] * newevals.T
-            #for j in range(self.U.shape[0]):
-            #    ccc = (cache * Usqr[j].T)[0, 0]
-            #    loopred[i, j] = (1. / (1. - ccc)) * (P[i, j] - ccc * self.Y[i, j])
-            #    #loopred[i, j] = P[i, j]
-        ccc = Vsqr * newevals.T * Usqr.T
-        loopred = multiply(1. / (1. - ccc), P - multiply(ccc, self.Y))
-        return loopred
+        rowcount = self.Y.shape[0]
+        for start in range(0, rowcount, blocksize):
+            end = min(start + blocksize, rowcount)
+            if linear:
+                P = (X1[start:end] * W) * X2.T
+            else:
+                P = self.training_predictions(slice(start, end))
+            #The diagonal of the hat matrix, Vsqr * newevals.T * Usqr.T, restricted to the rows
+            #of the block, with the eigenvalue products also formed one block at a time
+            Vsqr = multiply(self.V[start:end], self.V[start:end])
+            cache = mat(zeros((end - start, self.evals2.shape[0])))
+            for estart in range(0, evalcount, blocksize):
+                eend = min(estart + blocksize, evalcount)
+                cache += Vsqr[:, estart:eend] * self.hat_evals(estart, eend)
+            ccc = cache * Usqr.T
+            loopred = multiply(1. / (1. - ccc), P - multiply(ccc, self.Y[start:end]))
+            yield start, end, loopred
+    
+    
+    def imputationLOOPerformance(self, measure, blocksize = 1000, rowwise = False, out = None):
+        """Evaluates the leave-one-out predictions of the training grid one block of rows at a time.
+        
+        Parameters
+        ----------
+        measure: function
+            performance measure, e.g. rlscore.measure.sqerror
+        blocksize: int, optional
+            number of rows processed at a time
+        rowwise: boolean, optional
+            if True, the measure is computed separately for each row of the grid
+            (e.g. ranking the second domain objects for each first domain object),
+            and the mean over the rows for which it is defined is returned. Otherwise
+            the measure is computed over the whole grid. Measures that are means over
+            the pairs (those with measure.ismean set, such as sqerror) are accumulated
+            block by block without storing the predictions. Other measures, such as auc,
+            need the predictions of the whole grid, that is, n_samples1 * n_samples2
+            floats, which are written into out.
+        out: {array-like}, shape = [n_samples1, n_samples2], optional
+            buffer for the predictions of the whole grid, e.g. a numpy.memmap for grids
+            that do not fit in memory, allocated if not given and needed
+        
+        Returns
+        -------
+        performance: float
+            the leave-one-out performance (a list of these, one for each label
+            matrix, if the learner was trained with several label matrices)
+        """
+        if hasattr(self, "Ys"):
+            if out is None:
+                out = [None] * len(self.targets)
+            return self.map_targets(lambda t: self.targets[t].imputationLOOPerformance(measure, blocksize, rowwise, out[t]))
+        if not rowwise and getattr(measure, "ismean", False):
+            perfsum = 0.
+            for start, end, loopred in self.imputationLOOBlocks(blocksize):
+                Y = asarray(self.Y[start:end]).ravel()
+                perfsum += measure(Y, asarray(loopred).ravel()) * len(Y)
+            return perfsum / (self.Y.shape[0] * self.Y.shape[1])
+        if not rowwise:
+            P = self.imputationLOO(out, blocksize)
+            return measure(asarray(self.Y).ravel(), asarray(P).ravel())
+        perfsum = 0.
+        count = 0
+        for start, end, loopred in self.imputationLOOBlocks(blocksize):
+            Y = self.Y[start:end]
+            for i in range(end - start):
+                try:
+                    perfsum += measure(array(Y[i]).ravel(), array(loopred[i]).ravel())
+                    count += 1
+                except UndefinedPerformance:
+                    pass
+        if count == 0:
+            raise UndefinedPerformance("Performance undefined for all rows")
+        return perfsum / count
     
     
     def compute_ho(self, row_inds, col_inds):
         if not hasattr(self, "K1"):
-            X1 = mat(self.resource_pool['xmatrix1'])
-            X2 = mat(self.resource_pool['xmatrix2'])
-            P_ho = X1[row_inds] * self.W * X2.T[:, col_inds]
+            X1, X2 = self.data_matrices()
+            P_ho = self.model.predictWithDataMatrices(X1[row_inds], X2[col_inds])
         else:
-            P_ho = self.K1[row_inds] * self.A * self.K2.T[:, col_inds]
+            P_ho = self.training_predictions(row_inds)[:, col_inds]
         
-        newevals = multiply(self.evals2 * self.evals1.T, 1. / (self.evals2 * self.evals1.T + self.regparam))
+        newevals = mat(self.hat_evals()).T
         
         rowcount = len(row_inds)
         colcount = len(col_inds)
@@ -207,15 +606,14 @@ class KronRLS(AbstractLearner):
     
     def nested_imputationLOO(self, outer_row_coord, outer_col_coord,):
         if not hasattr(self, "K1"):
-            X1 = mat(self.resource_pool['xmatrix1'])
-            X2 = mat(self.resource_pool['xmatrix2'])
-            P = X1 * self.W * X2.T
+            X1, X2 = self.data_matrices()
+            P = self.model.predictWithDataMatrices(X1, X2)
         else:
-            P = self.K1 * self.A * self.K2.T
+            P = self.training_predictions()
         P_out = P[outer_row_coord, outer_col_coord]
         Y_out = self.Y[outer_row_coord, outer_col_coord]
         
-        newevals = multiply(self.evals2 * self.evals1.T, 1. / (self.evals2 * self.evals1.T + self.regparam))
+        newevals = mat(self.hat_evals()).T
         Vsqr = multiply(self.V, self.V)
         Usqr = multiply(self.U, self.U)
         d = (Vsqr[outer_row_coord] * newevals.T * Usqr[outer_col_coord].T)[0, 0]
@@ -264,11 +662,11 @@ class KronRLS(AbstractLearner):
     
     
     def nested_imputationLOO_BU(self, outer_row_coord, outer_col_coord):
-        P = self.K1.T * self.A * self.K2
+        P = self.training_predictions()
         P_out = P[outer_row_coord, outer_col_coord]
         Y_out = self.Y[outer_row_coord, outer_col_coord]
         
-        newevals = multiply(self.evals2 * self.evals1.T, 1. / (self.evals2 * self.evals1.T + self.regparam))
+        newevals = mat(self.hat_evals()).T
         Vsqr = multiply(self.V, self.V)
         Usqr = multiply(self.U, self.U)
         d = (Vsqr[outer_row_coord] * newevals.T * Usqr[outer_col_coord].T)[0, 0]
@@ -317,8 +715,8 @@ class KronRLS(AbstractLearner):
         if not hasattr(self, "Vsqr"):
             self.Vsqr = multiply(self.V, self.V)
             self.Usqr = multiply(self.U, self.U)
-        self.newlooevals = multiply(self.evals2 * self.evals1.T, 1. / (self.evals2 * self.evals1.T + self.regparam))
-        self.P = self.K1.T * self.A * self.K2
+        self.newlooevals = mat(self.hat_evals()).T
+        self.P = self.training_predictions()
         self.newlooevalsUsqr = self.newlooevals.T * self.Usqr.T
         self.Vsqrnewlooevals = self.Vsqr * self.newlooevals.T
         self.Vcache = self.Vsqr * self.newlooevalsUsqr
@@ -458,15 +856,77 @@ class KernelPairwiseModel(object):
         """
         P = K1pred * self.A * K2pred.T
         return P
+    
+    
+    def createTopKIndex(self, K2pred):
+        """Builds an index for retrieving the top scoring pairs without computing all predictions.
+        
+        Parameters
+        ----------
+        K2pred: {array-like, sparse matrix}, shape = [n_samples2, n_basis_functions2]
+            the second part of the test data matrix
+        
+        Returns
+        ----------
+        index: TopKPairIndex
+            index to be queried with the first part of the test data matrix
+        """
+        return model.TopKPairIndex(self.A * K2pred.T)
+
+
+class CartesianPairwiseModel(object):
+    
+    def __init__(self, A):
+        """Initializes the dual model of the Cartesian pairwise kernel
+        @param A: dual coefficient matrix
+        @type A: numpy matrix"""
+        self.A = A
+    
+    
+    def predictWithKernelMatrices(self, K1pred, K2pred, I1pred = None, I2pred = None):
+        """Computes predictions for test examples.
+        
+        The Cartesian kernel compares pairs sharing an object, so the test
+        examples known from training are given with the indicator matrices.
+        
+        Parameters
+        ----------
+        K1pred: {array-like, sparse matrix}, shape = [n_samples1, n_train_samples1]
+            the first part of the test data matrix
+        K2pred: {array-like, sparse matrix}, shape = [n_samples2, n_train_samples2]
+            the second part of the test data matrix
+        I1pred: {array-like, sparse matrix}, shape = [n_samples1, n_train_samples1], optional
+            entry (i, j) is 1 if the i:th test example of the first domain is the j:th
+            training example and 0 otherwise, by default all test examples are new
+        I2pred: {array-like, sparse matrix}, shape = [n_samples2, n_train_samples2], optional
+            the same for the second domain
+        
+        Returns
+        ----------
+        P: array, shape = [n_samples1, n_samples2]
+            predictions
+        """
+        P = mat(zeros((K1pred.shape[0], K2pred.shape[0])))
+        if I2pred is not None:
+            P += K1pred * self.A * I2pred.T
+        if I1pred is not None:
+            P += I1pred * self.A * K2pred.T
+        return P
 
 
 class LinearPairwiseModel(object):
     
-    def __init__(self, W):
+    def __init__(self, W = None, R1 = None, core = None, R2 = None):
         """Initializes the linear model
         @param W: primal coefficient matrix
-        @type W: numpy matrix"""
+        @type W: numpy matrix
+        @param R1, core, R2: factors of the primal coefficient matrix W = R1 * core * R2.T,
+        given instead of W when W would be too large to be stored
+        @type R1, core, R2: numpy matrix"""
         self.W = W
+        self.R1 = R1
+        self.core = core
+        self.R2 = R2
     
     
     def predictWithDataMatrices(self, X1pred, X2pred):
@@ -484,7 +944,28 @@ class LinearPairwiseModel(object):
         P: array, shape = [n_samples1, n_samples2]
             predictions
         """
-        P = X1pred * self.W * X2pred.T
+        if self.W is None:
+            P = (X1pred * self.R1) * self.core * (X2pred * self.R2).T
+        else:
+            P = X1pred * self.W * X2pred.T
         return P
+    
+    
+    def createTopKIndex(self, X2pred):
+        """Builds an index for retrieving the top scoring pairs without computing all predictions.
+        
+        Parameters
+        ----------
+        X2pred: {array-like, sparse matrix}, shape = [n_samples2, n_features2]
+            the second part of the test data matrix
+        
+        Returns
+        ----------
+        index: TopKPairIndex
+            index to be queried with the first part of the test data matrix
+        """
+        if self.W is None:
+            return model.TopKPairIndex(self.core * (X2pred * self.R2).T, left_projection = self.R1)
+        return model.TopKPairIndex(self.W * X2pred.T)
 
 
@@ -1,14 +1,14 @@
 import math
 
-from numpy import arange, float64, identity, multiply, mat, ones, zeros
+from numpy import any, array, dot, empty, float64, identity, matmul, multiply, mat, newaxis, ones, sum
 import numpy.linalg as la
-import scipy.sparse
 
 from rlscore import data_sources
 from rlscore.utilities import decomposition
 from rlscore.learner.abstract_learner import AbstractSvdSupervisedLearner
 from rlscore.utilities import array_tools
 from rlscore.utilities import creators
+from rlscore.utilities.query_structure import QueryStructure
 
 class LabelRankRLS(AbstractSvdSupervisedLearner):
     """RankRLS algorithm for learning to rank
@@ -18,7 +18,8 @@ class LabelRankRLS(AbstractSvdSupervisedLearner):
     that is cubic either in the number of training examples, or dimensionality
     of feature space (linear kernel).
     
-    Computational shortcut for leave-query-out cross-validation: computeHO
+    Computational shortcut for leave-query-out cross-validation: computeHO, and
+    computeHO_all_queries for all the queries at once
     
     Computational shortcut for parameter selection: solve
     
@@ -98,26 +99,8 @@ class LabelRankRLS(AbstractSvdSupervisedLearner):
         @param qids: A list of qid parameters.
         @type qids: List of integers."""
         
-        self.qidlist = [-1 for i in range(self.size)]
-        for i in range(len(qids)):
-            for j in qids[i]:
-                if j >= self.size:
-                    raise Exception("Index %d in query out of training set index bounds" %j)
-                elif j < 0:
-                    raise Exception("Negative index %d in query, query indices must be non-negative" %j)
-                else:
-                    self.qidlist[j] = i
-        if -1 in self.qidlist:
-            raise Exception("Not all training examples were assigned a query")
-        
-        self.qidmap = {}
-        for i in range(len(self.qidlist)):
-            qid = self.qidlist[i]
-            if self.qidmap.has_key(qid):
-                sameqids = self.qidmap[qid]
-                sameqids.append(i)
-            else:
-                self.qidmap[qid] = [i]  
+        self.queries = QueryStructure.fromIndexLists(qids, self.size)
+        self.qidlist = self.queries.qidlist
     
     def solve(self, regparam=1.0):
         """Trains the learning algorithm, using the given regularization parameter.
@@ -128,30 +111,7 @@ class LabelRankRLS(AbstractSvdSupervisedLearner):
             regularization parameter
         """
         if not hasattr(self, "D"):
-            qidlist = self.qidlist
-            objcount = max(qidlist) + 1
-            
-            labelcounts = mat(zeros((1, objcount)))
-            Pvals = ones(self.size)
-            for i in range(self.size):
-                qid = qidlist[i]
-                labelcounts[0, qid] = labelcounts[0, qid] + 1
-            D = mat(ones((1, self.size), dtype=float64))
-            
-            #The centering matrix way (HO computations should be modified accordingly too)
-            #for i in range(self.size):
-            #    qid = qidlist[i]
-            #    Pvals[i] = 1. / math.sqrt(labelcounts[0, qid])
-            
-            #The old Laplacian matrix way
-            for i in range(self.size):
-                qid = qidlist[i]
-                D[0, i] = labelcounts[0, qid]
-            
-            P = scipy.sparse.coo_matrix((Pvals, (arange(0, self.size), qidlist)), shape=(self.size,objcount))
-            P_csc = P.tocsc()
-            P_csr = P.tocsr()
-            
+            D = mat(self.queries.D)
             
             #Eigenvalues of the kernel matrix
             evals = multiply(self.svals, self.svals)
@@ -160,10 +120,10 @@ class LabelRankRLS(AbstractSvdSupervisedLearner):
             ssvecs = multiply(self.svecs, self.svals)
             
             #These are cached for later use in solve and computeHO functions
-            ssvecsTLssvecs = (multiply(ssvecs.T, D) - (ssvecs.T * P_csc) * P_csr.T) * ssvecs
+            ssvecsTLssvecs = ssvecs.T * self.queries.laplacian_matvec(ssvecs)
             LRsvals, LRevecs = decomposition.decomposeKernelMatrix(ssvecsTLssvecs)
             LRevals = multiply(LRsvals, LRsvals)
-            LY = multiply(D.T, self.Y) - P_csr * (P_csc.T * self.Y)
+            LY = self.queries.laplacian_matvec(self.Y)
             self.multipleright = LRevecs.T * (ssvecs.T * LY)
             self.multipleleft = ssvecs * LRevecs
             self.LRevals = LRevals
@@ -209,11 +169,10 @@ class LabelRankRLS(AbstractSvdSupervisedLearner):
             raise Exception('Hold-out can have each index only once.')
         
         hoqid = self.qidlist[indices[0]]
-        for ind in indices:
-            if not hoqid == self.qidlist[ind]:
-                raise Exception('All examples in the hold-out set must have the same qid.')
+        if any(self.qidlist[indices] != hoqid):
+            raise Exception('All examples in the hold-out set must have the same qid.')
         
-        if not len(self.qidmap[hoqid]) == len(indices):
+        if not self.queries.sizes[hoqid] == len(indices):
             raise Exception('All examples in the whole training set having the same qid as the examples in the hold-out set must belong to the hold out set.')
         
         indlen = len(indices)
@@ -230,3 +189,42 @@ class LabelRankRLS(AbstractSvdSupervisedLearner):
         #return RQY - RQRTLho * la.inv(-I + RQRTLho) * RQY
     
     
+    
+    
+    def computeHO_all_queries(self):
+        """Computes leave-query-out predictions for all the queries of a trained RLS.
+        
+        The queries are grouped by their size, and the hold-out solves of the queries
+        of the same size are carried out together as stacked arrays. The grouping and
+        the parts of the computations that do not depend on the regularization
+        parameter are cached, so that they are shared over a parameter grid.
+        
+        Returns
+        -------
+        F : matrix, shape = [n_samples, n_labels]
+            leave-query-out predictions, in the order of the training examples
+        """
+        if not hasattr(self, "hogroups"):
+            Qleft = array(self.multipleleft, dtype=float64)
+            Y = array(self.Y, dtype=float64)
+            groups = {}
+            for inds in self.queries.indslist():
+                if len(inds) > 0:
+                    groups.setdefault(len(inds), []).append(inds)
+            self.hogroups = []
+            for qsize, queries in groups.items():
+                inds = array(queries)
+                Yho = Y[inds]
+                LhoYho = qsize * Yho - sum(Yho, axis=1)[:, newaxis, :]
+                self.hogroups.append((qsize, inds, Qleft[inds], LhoYho))
+        
+        ne = array(self.neweigvals, dtype=float64).ravel()
+        #Full training set predictions, from which the hold-out parts are removed
+        RQYall = dot(array(self.multipleleft), ne[:, newaxis] * array(self.multipleright))
+        F = empty(RQYall.shape)
+        for qsize, inds, Qleft, LhoYho in self.hogroups:
+            Qho = matmul(Qleft * ne, Qleft.transpose(0, 2, 1))
+            RQY = RQYall[inds] - matmul(Qho, LhoYho)
+            RQRTLho = qsize * Qho - sum(Qho, axis=2)[:, :, newaxis]
+            F[inds] = la.solve(identity(qsize) - RQRTLho, RQY)
+        return mat(F)
@@ -45,4 +45,5 @@ def accuracy(Y, P):
     Y = array_tools.as_labelmatrix(Y)
     P = array_tools.as_labelmatrix(P)    
     return np.mean(accuracy_multitask(Y, P))
-accuracy.iserror = False
\ No newline at end of file
+accuracy.iserror = False
+accuracy.ismean = True
\ No newline at end of file
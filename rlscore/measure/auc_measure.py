@@ -2,7 +2,6 @@ import operator
 import numpy as np
 
 from rlscore.measure.measure_utilities import UndefinedPerformance
-from measure_utilities import multitask
 from rlscore.utilities import array_tools
 
 def auc_singletask(Y, P):
@@ -49,7 +48,28 @@ def auc_singletask(Y, P):
     return AUC
 
 def auc_multitask(Y, P):
-    return multitask(Y, P, auc_singletask)
+    #All the columns at once, from the sums of the ranks of the positive
+    #examples, tied predictions sharing the average of their ranks
+    Y = np.asarray(Y)
+    P = np.asarray(P, dtype=np.float64)
+    size = P.shape[0]
+    I = np.argsort(P, axis=0, kind='mergesort')
+    P = np.take_along_axis(P, I, axis=0)
+    pos = np.take_along_axis(Y, I, axis=0) == 1
+    inds = np.arange(size)[:, np.newaxis]
+    starts = np.ones(P.shape, dtype=bool)
+    starts[1:] = P[1:] != P[:-1]
+    ends = np.ones(P.shape, dtype=bool)
+    ends[:-1] = starts[1:]
+    first = np.maximum.accumulate(np.where(starts, inds, 0), axis=0)
+    last = size - 1 - np.maximum.accumulate(np.where(ends, size - 1 - inds, 0)[::-1], axis=0)[::-1]
+    ranks = 0.5 * (first + last) + 1.
+    poscount = np.sum(pos, axis=0).astype(np.float64)
+    paircount = poscount * (size - poscount)
+    if np.any(paircount == 0):
+        raise UndefinedPerformance("AUC undefined if both classes not present")
+    AUC = (np.sum(ranks * pos, axis=0) - 0.5 * poscount * (poscount + 1.)) / paircount
+    return list(AUC)
 
 def auc(Y, P):
     """Area under the ROC curve (AUC).
@@ -1,3 +1,5 @@
+import sys
+
 import numpy as np
 
 def wrapper(measure, Y, Y_predicted, qids):
@@ -39,6 +41,33 @@ def multitask(Y, P, f):
     for i in range(Y.shape[1]):
         perfs.append(f(Y[:,i], P[:,i]))
     return perfs
+
+def column_performances(measure, Y, P):
+    """Computes the performance separately for each column of P with a single
+    call, using the multitask version of the measure if its module defines one.
+    
+    Multitask versions that raise UndefinedPerformance when the measure is undefined
+    for some column, such as auc_multitask, are then replaced by a call per column.
+    
+    @param measure: performance measure, such as auc or sqerror
+    @param Y: correct labels, one column for each column of P
+    @param P: predicted labels
+    @return: the performances, nan for the columns for which it is undefined
+    @rtype: numpy array, shape = [n_columns]"""
+    module = sys.modules[measure.__module__]
+    name = measure.__name__ + "_multitask"
+    if hasattr(module, name):
+        try:
+            return np.array(getattr(module, name)(np.mat(Y), np.mat(P)), dtype=np.float64)
+        except UndefinedPerformance:
+            pass
+    perfs = []
+    for i in range(P.shape[1]):
+        try:
+            perfs.append(measure(Y[:, i], P[:, i]))
+        except UndefinedPerformance:
+            perfs.append(np.nan)
+    return np.array(perfs, dtype=np.float64)
     
 class UndefinedPerformance(Exception):
     """Used to indicate that the performance is not defined for the
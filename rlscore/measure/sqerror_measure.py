@@ -44,4 +44,5 @@ def sqerror(Y, P):
     P = array_tools.as_labelmatrix(P)
     return np.mean(sqerror_multitask(Y,P))
 sqerror.iserror = True
+sqerror.ismean = True
 
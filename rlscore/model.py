@@ -119,3 +119,111 @@ class LinearModel(object):
         P = P + self.b
         return P
 
+
+
+class TopKPairIndex(object):
+    """Retrieves the top scoring pairs for each left-side example of a pairwise model.
+    
+    Pairwise predictions have the form L * R, where the rows of L correspond to the
+    left-side examples (data or kernel matrix rows) and R is the right-hand side
+    already projected through the model (e.g. W * X2.T). R is computed only once,
+    queries are then processed a block of rows (and optionally columns) at a time,
+    keeping only the k best scores for each row, so that the full prediction matrix
+    is never built.
+
+    Parameters
+    ----------
+    R: {array-like}, shape = [n_features1, n_samples2]
+        projected right-hand side
+    basis_inds: list of ints, shape = [n_features1], optional
+        columns of the left-side matrices corresponding to the rows of R, by
+        default all columns are used
+    left_projection: {array-like}, shape = [n_features1, n_components], optional
+        matrix the left-side matrices are multiplied with before scoring, in which
+        case R has shape [n_components, n_samples2] (e.g. for factored models)
+    """
+    
+    def __init__(self, R, basis_inds=None, left_projection=None):
+        self.R = array_tools.as_array(R)
+        self.basis_inds = basis_inds
+        if left_projection is not None:
+            left_projection = array_tools.as_array(left_projection)
+        self.left_projection = left_projection
+    
+    
+    def query(self, L, k, known_row_inds=None, known_col_inds=None, blocksize=1000, colblocksize=None):
+        """Computes the top k right-side examples for each left-side example.
+        
+        Parameters
+        ----------
+        L: {array-like, sparse matrix}, shape = [n_samples1, n_features1]
+            left-side data (or kernel) matrix
+        k: int
+            number of pairs retrieved for each left-side example
+        known_row_inds, known_col_inds: list of ints, optional
+            pairs (row of L, column of R) excluded from the retrieval
+        blocksize: int, optional
+            number of left-side examples scored at a time (default 1000)
+        colblocksize: int, optional
+            number of right-side examples scored at a time (default all)
+        
+        Returns
+        -------
+        inds: array of ints, shape = [n_samples1, k]
+            indices of the retrieved right-side examples, best first. If fewer than
+            k pairs remain after excluding the known ones, the rest are marked with -1.
+        scores: array, shape = [n_samples1, k]
+            predictions for the retrieved pairs (-inf for the ones marked with -1)
+        """
+        n1 = L.shape[0]
+        n2 = self.R.shape[1]
+        k = min(k, n2)
+        if colblocksize == None:
+            colblocksize = n2
+        if sp.issparse(L):
+            L = sp.csr_matrix(L)
+        else:
+            L = np.asarray(L)
+        if known_row_inds is not None and len(known_row_inds) > 0:
+            known = sp.csr_matrix((np.ones(len(known_row_inds)), (known_row_inds, known_col_inds)), shape=(n1, n2))
+        else:
+            known = None
+        inds = np.zeros((n1, k), dtype=np.int64)
+        scores = np.zeros((n1, k))
+        for start in range(0, n1, blocksize):
+            end = min(start + blocksize, n1)
+            L_block = L[start:end]
+            if self.basis_inds is not None:
+                L_block = L_block[:, self.basis_inds]
+            if self.left_projection is not None:
+                if sp.issparse(L_block):
+                    L_block = np.asarray(L_block * self.left_projection)
+                else:
+                    L_block = np.dot(L_block, self.left_projection)
+            rowsel = np.arange(end - start)[:, None]
+            best_scores = -np.inf * np.ones((end - start, k))
+            best_inds = -np.ones((end - start, k), dtype=np.int64)
+            for colstart in range(0, n2, colblocksize):
+                colend = min(colstart + colblocksize, n2)
+                R_block = self.R[:, colstart:colend]
+                if sp.issparse(L_block):
+                    S = L_block * R_block
+                else:
+                    S = np.dot(L_block, R_block)
+                S = np.asarray(S)
+                if known is not None:
+                    excluded = known[start:end, colstart:colend].tocoo()
+                    S[excluded.row, excluded.col] = -np.inf
+                #Merge the current best pairs with the new candidates, keeping k best of each row
+                candscores = np.hstack([best_scores, S])
+                candinds = np.hstack([best_inds, np.tile(np.arange(colstart, colend), (end - start, 1))])
+                topk = np.argpartition(-candscores, k - 1, axis=1)[:, :k]
+                best_scores = candscores[rowsel, topk]
+                best_inds = candinds[rowsel, topk]
+            order = np.argsort(-best_scores, axis=1)
+            best_scores = best_scores[rowsel, order]
+            best_inds = best_inds[rowsel, order]
+            best_inds[best_scores == -np.inf] = -1
+            inds[start:end] = best_inds
+            scores[start:end] = best_scores
+        return inds, scores
@@ -1,3 +1,5 @@
+import time
+
 import numpy as np
 
 from rlscore import data_sources
@@ -25,6 +27,7 @@ class AbstractSelection(object):
         self.performances = None
         self.verbose = True
         self.predictions = []
+        self.grid_index = None
     
     
     def loadResources(self):
@@ -47,6 +50,19 @@ class AbstractSelection(object):
         return 0.
     
     
+    def storePredictions(self, P):
+        """Stores the predictions from which the performance was estimated. During a grid
+        search they are stored in the position of the current regularization parameter
+        in the grid.
+        
+        @param P: predictions
+        @type P: matrix"""
+        if self.grid_index == None:
+            self.predictions.append(P)
+        else:
+            self.predictions[self.grid_index] = P
+    
+    
     def setParameters(self, parameters):
         if parameters.has_key("reggrid"):
             #The reggrid may be a list, or string
@@ -75,48 +91,87 @@ class AbstractSelection(object):
             reggrid = range(-5, 6)
             reggrid = [2. ** x for x in reggrid]
         self.reggrid = reggrid 
+        #Regularization path mode for the iterative learners supporting warm starts
+        if parameters.has_key("reg_path"):
+            self.reg_path = parameters["reg_path"]
+        else:
+            self.reg_path = False
     
     
     def reggridSearch(self):
         """Searches the regularization parameter grid to choose the value which, according to
-        the estimatePerformance function, seems to provide best performance"""
+        the estimatePerformance function, seems to provide best performance.
+        
+        If the parameter reg_path is set, the grid is swept from the strongest to the
+        weakest regularization, and learners having the warm_start attribute, such as
+        CGRLS, CGRankRLS and CGKronRLS, start each solve from the previous solution.
+        The number of iterations (for the learners reporting it) and the time taken at
+        each grid point are stored in self.iterations and self.times, in the order of
+        the grid like the performances and the predictions. As the grid is swept in
+        descending order, ties in performance then go to the larger regparam."""
         #Current assumption is that all of the algorithms included in the package will be based on regularized
         #risk minimization
-        self.performances = []
+        self.performances = [None for regparam in self.reggrid]
         self.best_performance = None
         self.best_model = None
         self.best_regparam = None
+        self.iterations = [None for regparam in self.reggrid]
+        self.times = [None for regparam in self.reggrid]
+        self.predictions = [None for regparam in self.reggrid]
         measure_name = str(self.measure).split()[1]
+        order = range(len(self.reggrid))
+        warm_start = getattr(self.learner, "warm_start", None)
+        if self.reg_path:
+            order.sort(key = lambda i: self.reggrid[i], reverse = True)
+            if warm_start is not None:
+                self.learner.warm_start = True
         if self.verbose:
             print "Regularization parameter grid initialized to", self.reggrid
-        for regparam in self.reggrid:
-            if self.verbose:
-                print "Solving %s for regularization parameter value %f" % ("learner", regparam)
-            self.learner.solve(regparam)
-            performance = self.estimatePerformance(self.learner)
-            self.performances.append(performance)
-            if self.best_performance==None:
-                self.best_performance = performance
-                self.best_model =  self.learner.getModel()
-                self.best_regparam = regparam
-            else:
-                #if compare_performances(self.measure, performance, self.best_performance) > 0:
-                #if self.measure.comparePerformances(performance, self.best_performance) > 0:
-                if (self.measure.iserror == (performance < self.best_performance)):
+        try:
+            for i in order:
+                regparam = self.reggrid[i]
+                self.grid_index = i
+                if self.verbose:
+                    print "Solving %s for regularization parameter value %f" % ("learner", regparam)
+                starttime = time.time()
+                self.learner.solve(regparam)
+                self.times[i] = time.time() - starttime
+                if hasattr(self.learner, "results"):
+                    self.iterations[i] = self.learner.results.get("cg_iterations")
+                performance = self.estimatePerformance(self.learner)
+                self.performances[i] = performance
+                if self.best_performance==None:
                     self.best_performance = performance
-                    self.best_model = self.learner.getModel()
+                    self.best_model =  self.learner.getModel()
                     self.best_regparam = regparam
-            if self.verbose:
-                if performance != None:
-                    print "%f %s (averaged), %f regularization parameter" % (performance, measure_name, regparam)
                 else:
-                    print "Performance undefined for %f regularization parameter" %regparam
+                    #if compare_performances(self.measure, performance, self.best_performance) > 0:
+                    #if self.measure.comparePerformances(performance, self.best_performance) > 0:
+                    if (self.measure.iserror == (performance < self.best_performance)):
+                        self.best_performance = performance
+                        self.best_model = self.learner.getModel()
+                        self.best_regparam = regparam
+                if self.verbose:
+                    if performance != None:
+                        print "%f %s (averaged), %f regularization parameter" % (performance, measure_name, regparam)
+                    else:
+                        print "Performance undefined for %f regularization parameter" %regparam
+        finally:
+            #The learner is left as it was also when a solve fails
+            self.grid_index = None
+            if warm_start is not None:
+                self.learner.warm_start = warm_start
+        #Only some of the model selection strategies store predictions
+        if all([P is None for P in self.predictions]):
+            self.predictions = []
         if self.verbose:
             if self.best_performance != None:
                 print "Best performance %f %s with regularization parameter %f" % (self.best_performance, measure_name, self.best_regparam)
             else:
                 print "Performance undefined for all tried values"
         self.resource_pool[data_sources.REGGRID_RESULTS] = np.array([self.reggrid, self.performances]).T
+        self.resource_pool[data_sources.REGGRID_ITERATIONS] = self.iterations
+        self.resource_pool[data_sources.REGGRID_TIMES] = self.times
         #some model selection strategies support this
         self.resource_pool['mselection_predictions'] = self.predictions
     
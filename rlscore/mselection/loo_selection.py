@@ -16,5 +16,5 @@ class LOOSelection(AbstractSelection):
         #performance = self.measure.getPerformance(self.Y, Y_pred)
         #performance = measure_utilities.aggregate(performance)
         performance = self.measure(self.Y, Y_pred)
-        self.predictions.append(Y_pred)
+        self.storePredictions(Y_pred)
         return performance
@@ -5,9 +5,31 @@ from rlscore.learner import AllPairsRankRLS
 from rlscore.measure import measure_utilities
 
 class LPOSelection(AbstractSelection):
-    """leave-pair-out cross-validation for model selection"""
-    
-    
+    """leave-pair-out cross-validation for model selection
+
+    The pairs are generated and scored as arrays a chunk at a time, so that the memory
+    use is bounded. The optional resources are lpo_pairs, the maximum number of pairs
+    per label after which a stratified sample of that many pairs is used instead of all
+    of them, lpo_chunksize, the number of pairs processed at a time (default 10^6), and
+    threads, the number of threads computing the predictions of a chunk."""
+
+
+    def loadResources(self):
+        AbstractSelection.loadResources(self)
+        if self.resource_pool.has_key("lpo_pairs"):
+            self.max_pairs = int(self.resource_pool["lpo_pairs"])
+        else:
+            self.max_pairs = None
+        if self.resource_pool.has_key("lpo_chunksize"):
+            self.chunksize = int(self.resource_pool["lpo_chunksize"])
+        else:
+            self.chunksize = 1000000
+        if self.resource_pool.has_key("threads"):
+            self.threads = int(self.resource_pool["threads"])
+        else:
+            self.threads = 1
+
+
     def estimatePerformance(self, learner):
         """Leave-pair-out estimate of performance
         
@@ -17,21 +39,120 @@ class LPOSelection(AbstractSelection):
         @rtype: float"""
         if not isinstance(self.learner, AllPairsRankRLS):
             raise Exception("LPO cross-validation implemented only for RankRLS")
-        predictions = []
+        Y = np.asarray(self.Y)
+        if Y.ndim == 1:
+            Y = Y.reshape(-1, 1)
         performances = []
-        for i in range(self.Y.shape[1]):
-            #pairs = self.measure.getPairs(self.Y, i)
-            pairs = getPairs(self.Y, i)
-            pred = learner.computePairwiseCV(pairs, i)
-            #perf = self.measure.pairwisePerformance(pairs, self.Y, i, pred)
-            perf = pairwisePerformance(pairs, self.Y, i, pred)
-            predictions.append(pred)
-            performances.append(perf)
+        for i in range(Y.shape[1]):
+            y = Y[:, i]
+            if self.max_pairs != None and pairCount(y) > self.max_pairs:
+                chunks = sampledPairChunks(y, self.max_pairs, self.chunksize)
+            else:
+                chunks = pairChunks(y, self.chunksize)
+            correct, count = 0., 0
+            for I, J in chunks:
+                F0, F1 = learner.computePairwiseCVArrays(np.vstack([I, J]).T, i, len(I) / self.threads + 1, self.threads)
+                correct += pairwiseCorrect(F0, F1)
+                count += len(I)
+            if count > 0:
+                performances.append(correct / count)
         #performance = measure_utilities.aggregate(performances)
         performance = np.mean(performances)
         return performance
 
 
+def pairCount(y):
+    """Returns the number of index pairs with different labels.
+
+    @param y: labels
+    @type y: numpy array, shape = [n_samples]
+    @rtype: int"""
+    counts = np.unique(y, return_counts=True)[1]
+    return int((len(y) ** 2 - np.sum(counts.astype(np.int64) ** 2)) / 2)
+
+
+def sortedLabelGroups(y):
+    """Returns the indices sorting y in ascending order, and for each position in the
+    sorted order the number of examples with a strictly smaller label."""
+    order = np.argsort(y, kind='mergesort').astype(np.int32)
+    ys = y[order]
+    starts = np.ones(len(ys), dtype=bool)
+    starts[1:] = ys[1:] != ys[:-1]
+    lowercounts = np.maximum.accumulate(np.where(starts, np.arange(len(ys)), 0))
+    return order, lowercounts
+
+
+def pairChunks(y, chunksize=1000000):
+    """Generates all the index pairs (i, j) with y[i] > y[j].
+
+    The pairs are formed from the label order without Python loops over the pairs, and
+    yielded in chunks of about chunksize pairs (the pairs of a single example are never
+    split, so a chunk may have up to n_samples pairs more).
+
+    @param y: labels
+    @type y: numpy array, shape = [n_samples]
+    @return: generator of pairs of int32 arrays (I, J)"""
+    y = np.asarray(y).ravel()
+    order, lowercounts = sortedLabelGroups(y)
+    cumcounts = np.cumsum(lowercounts)
+    start = 0
+    while start < len(y):
+        #The examples whose pairs make up the chunk
+        end = np.searchsorted(cumcounts, cumcounts[start] - lowercounts[start] + chunksize, side='right')
+        end = min(max(end, start + 1), len(y))
+        counts = lowercounts[start:end]
+        total = int(np.sum(counts))
+        if total > 0:
+            offsets = np.cumsum(counts) - counts
+            I = np.repeat(order[start:end], counts)
+            J = order[np.arange(total) - np.repeat(offsets, counts)]
+            yield I, J.astype(np.int32)
+        start = end
+
+
+def sampledPairChunks(y, sample_size, chunksize=1000000):
+    """Generates a stratified sample of the index pairs (i, j) with y[i] > y[j].
+
+    The strata are the higher ranked examples i, each of which gets a share of the
+    sample proportional to its number of pairs, and the pairs within a stratum are
+    sampled without replacement.
+
+    @param y: labels
+    @type y: numpy array, shape = [n_samples]
+    @param sample_size: number of pairs sampled
+    @type sample_size: int
+    @return: generator of pairs of int32 arrays (I, J)"""
+    y = np.asarray(y).ravel()
+    order, lowercounts = sortedLabelGroups(y)
+    total = np.sum(lowercounts, dtype=np.int64)
+    sample_size = min(sample_size, total)
+    #Largest remainder allocation of the sample to the strata
+    quotas = lowercounts * (float(sample_size) / total)
+    allocation = np.floor(quotas).astype(np.int64)
+    leftover = sample_size - np.sum(allocation)
+    if leftover > 0:
+        allocation[np.argsort(allocation - quotas, kind='mergesort')[:leftover]] += 1
+    #Strata with a quota of over half of their pairs are sampled with permutations,
+    #the rest by drawing with replacement and redrawing until the quotas are filled
+    n = len(y)
+    dense = 2 * allocation > lowercounts
+    sparsequotas = np.where(dense, 0, allocation)
+    rows = [np.repeat(np.flatnonzero(dense), allocation[dense])]
+    offsets = [np.random.permutation(lowercounts[p])[:allocation[p]] for p in np.flatnonzero(dense)]
+    keys = np.zeros(0, dtype=np.int64)
+    pending = np.repeat(np.arange(n), sparsequotas)
+    while len(pending) > 0:
+        draws = pending * n + (np.random.rand(len(pending)) * lowercounts[pending]).astype(np.int64)
+        keys = np.unique(np.concatenate([keys, draws]))
+        pending = np.repeat(np.arange(n), sparsequotas - np.bincount(keys // n, minlength=n))
+    rows.append(keys // n)
+    offsets.append(keys % n)
+    I = order[np.concatenate(rows)]
+    J = order[np.concatenate(offsets)]
+    for start in range(0, len(I), chunksize):
+        yield I[start:start + chunksize], J[start:start + chunksize]
+
+
 def getPairs(Y, index):
     """Returns all positive-negative pairs.
     
@@ -40,16 +161,22 @@ def getPairs(Y, index):
     @return: list of lists of index pairs
     @rtype list of lists of integer pairs"""
     pairs = []
-    tsetsize = Y.shape[0]
-    for i in range(tsetsize - 1):
-        for j in range(i + 1, tsetsize):
-            if Y[i, index] > Y[j, index]:
-                pairs.append((i, j))
-            elif Y[i, index] < Y[j, index]:
-                pairs.append((j, i))
+    for I, J in pairChunks(np.asarray(Y)[:, index]):
+        pairs.extend(zip(I.tolist(), J.tolist()))
     return pairs
 
 
+def pairwiseCorrect(F0, F1):
+    """Returns the number of correctly ordered pairs, ties counting as half.
+
+    @param F0: predictions for the higher ranked examples of the pairs
+    @type F0: numpy array, shape = [n_pairs]
+    @param F1: predictions for the lower ranked examples of the pairs
+    @type F1: numpy array, shape = [n_pairs]
+    @rtype: float"""
+    return np.sum(F0 > F1) + 0.5 * np.sum(F0 == F1)
+
+
 def pairwisePerformance(pairs, Y, index, predicted):
     """Used for LPO-cross-validation. Supplied pairs should consist of all positive-negative
     pairs.
@@ -67,12 +194,5 @@ def pairwisePerformance(pairs, Y, index, predicted):
     assert len(pairs) == len(predicted)
     if len(pairs) == 0:
         return None
-    auc = 0.
-    for pair in predicted:
-        if pair[0] > pair[1]:
-            auc += 1.
-        elif pair[0] == pair[1]:
-            auc += 0.5
-    auc /= len(predicted)
-    return auc
-
+    predicted = np.asarray(predicted, dtype=np.float64).reshape(-1, 2)
+    return pairwiseCorrect(predicted[:, 0], predicted[:, 1]) / len(predicted)
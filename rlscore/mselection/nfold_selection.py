@@ -12,6 +12,7 @@ class NfoldSelection(AbstractSelection):
     def __init__(self):
         AbstractSelection.__init__(self)
         self.folds = None
+        self.queryfolds = False
         
     def loadResources(self):
         """Loads in the resources in resource pool. If folds are present
@@ -25,6 +26,7 @@ class NfoldSelection(AbstractSelection):
             self.folds = self.resource_pool[data_sources.CVFOLDS]
         elif self.resource_pool.has_key(data_sources.TRAIN_QIDS):
             self.folds = self.resource_pool[data_sources.TRAIN_QIDS]
+            self.queryfolds = True
             #self.folds = qsource.readFolds()
 
     def setFolds(self, folds):
@@ -33,6 +35,7 @@ class NfoldSelection(AbstractSelection):
         @param folds: a list of lists, where each inner list contains the indices of examples belonging to one of the holdout sets
         @type folds: list of lists of integers"""
         self.folds = folds
+        self.queryfolds = False
 
     def setRandomFolds(self, foldcount):
         """Sets a randomized fold partition
@@ -40,6 +43,7 @@ class NfoldSelection(AbstractSelection):
         @param foldcount: the number of folds
         @type foldcount: integer"""
         self.folds = []
+        self.queryfolds = False
         indices = set(range(self.Y.shape[0]))
         foldsize = self.Y.shape[0] / foldcount
         leftover = self.Y.shape[0] % foldcount
@@ -57,7 +61,8 @@ class NfoldSelection(AbstractSelection):
         By default 10-fold cross-validation with randomized fold partition is used.
         Another schemes can be used by setting the desired number of randomized or
         user defined folds with setFolds or setRandomFolds prior to calling this
-        method.
+        method. If the folds are the training queries and the learner supports it,
+        the hold-out predictions for all the queries are computed at once.
  
         @param learner: trained learner object
         @type learner: RLS
@@ -69,9 +74,16 @@ class NfoldSelection(AbstractSelection):
         self.Y_folds = []
         for fold in self.folds:
             self.Y_folds.append(self.Y[fold,:])
+        if self.queryfolds and hasattr(learner, "computeHO_all_queries"):
+            Y_pred_all = learner.computeHO_all_queries()
+        else:
+            Y_pred_all = None
         performances = []
         for i in range(len(self.folds)):
-            Y_pred = learner.computeHO(self.folds[i])
+            if Y_pred_all is not None:
+                Y_pred = Y_pred_all[self.folds[i]]
+            else:
+                Y_pred = learner.computeHO(self.folds[i])
             #performance = self.measure.getPerformance(self.Y_folds[i], Y_pred)
             #performances.append(measure_utilities.aggregate(performance))
             try:
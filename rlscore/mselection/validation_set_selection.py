@@ -54,6 +54,6 @@ class ValidationSetSelection(AbstractSelection):
         else:
             performance = self.measure(self.validation_Y, P)
             #performance = self.measure.getPerformance(self.validation_Y, P)
-        self.predictions.append(P)
+        self.storePredictions(P)
         #performance = measure_utilities.aggregate(performance)
         return performance
\ No newline at end of file
@@ -0,0 +1,70 @@
+import unittest
+
+import numpy as np
+from rlscore.learner.all_pairs_rankrls import AllPairsRankRLS
+from rlscore.measure import auc
+from rlscore.mselection import LPOSelection
+from rlscore.mselection import lpo_selection
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(100)
+
+
+    def test_leave_pair_out(self):
+        X = np.random.randn(20, 4)
+        Y = np.random.randn(20, 2)
+        learner = AllPairsRankRLS.createLearner(train_features=X, train_labels=Y, regparam=3.)
+        learner.solve(3.)
+        pairs = [(0, 1), (5, 2), (19, 7), (3, 4), (11, 12)]
+        F0, F1 = learner.computePairwiseCVArrays(pairs, blocksize=2, threads=2)
+        for k, (i, j) in enumerate(pairs):
+            #Retraining without the pair
+            train = [ind for ind in range(20) if ind not in (i, j)]
+            holearner = AllPairsRankRLS.createLearner(train_features=X[train], train_labels=Y[train], regparam=3.)
+            holearner.solve(3.)
+            P = np.asarray(holearner.getModel().predict(X[[i, j]]))
+            np.testing.assert_allclose(F0[k], P[0])
+            np.testing.assert_allclose(F1[k], P[1])
+        results = learner.computePairwiseCV(pairs, 1)
+        np.testing.assert_allclose(np.array(results), np.vstack([F0[:, 1], F1[:, 1]]).T)
+    
+    
+    def test_leave_one_out(self):
+        X = np.random.randn(15, 4)
+        Y = np.random.randn(15, 2)
+        learner = AllPairsRankRLS.createLearner(train_features=X, train_labels=Y, regparam=2.)
+        learner.solve(2.)
+        F = learner.computeLOO()
+        self.assertEqual(F.shape, (15, 2))
+        for i in range(15):
+            train = [ind for ind in range(15) if ind != i]
+            holearner = AllPairsRankRLS.createLearner(train_features=X[train], train_labels=Y[train], regparam=2.)
+            holearner.solve(2.)
+            np.testing.assert_allclose(np.asarray(F[i]).ravel(), np.asarray(holearner.getModel().predict(X[[i]])).ravel())
+            np.testing.assert_allclose(F[i], learner.computeHO([i]))
+    
+    
+    def test_lpo_selection(self):
+        X = np.random.randn(25, 4)
+        Y = np.random.randint(0, 3, (25, 2)).astype(float)
+        learner = AllPairsRankRLS.createLearner(train_features=X, train_labels=Y, regparam=3.)
+        learner.solve(3.)
+        #Reference from the predictions for each pair with different labels
+        aucs = []
+        for ind in range(2):
+            pairs = [(i, j) for i in range(25) for j in range(25) if Y[i, ind] > Y[j, ind]]
+            results = np.array(learner.computePairwiseCV(pairs, ind))
+            aucs.append(np.mean((results[:, 0] > results[:, 1]) + 0.5 * (results[:, 0] == results[:, 1])))
+        for kwargs in [{}, {"lpo_chunksize": 10, "threads": 2}, {"lpo_pairs": 10000}]:
+            selector = LPOSelection.createMSelector(learner=learner, measure=auc, train_labels=Y, **kwargs)
+            self.assertAlmostEqual(selector.estimatePerformance(learner), np.mean(aucs))
+        #A sample of the pairs, stratified by the higher ranked example
+        selector = LPOSelection.createMSelector(learner=learner, measure=auc, train_labels=Y, lpo_pairs=50, lpo_chunksize=20)
+        perf = selector.estimatePerformance(learner)
+        self.assertTrue(0. <= perf <= 1.)
+        for I, J in lpo_selection.sampledPairChunks(Y[:, 0], 50, 20):
+            self.assertTrue(np.all(Y[I, 0] > Y[J, 0]))
+            self.assertEqual(len(set(zip(I, J))), len(I))
@@ -1,6 +1,7 @@
 import unittest
 
 import numpy as np
+from scipy import sparse as sp
 from rlscore.kernel import GaussianKernel
 from rlscore.kernel import LinearKernel
 from rlscore.learner.cg_kron_rls import CGKronRLS
@@ -141,5 +142,217 @@ class Test(unittest.TestCase):
         print linear_kron_testpred[0, 1], kernel_kron_testpred[0, 1], ordrls_testpred[0, 1]
         print linear_kron_testpred[1, 0], kernel_kron_testpred[1, 0], ordrls_testpred[1, 0]
         print np.mean(np.abs(linear_kron_testpred - ordrls_testpred)), np.mean(np.abs(kernel_kron_testpred - ordrls_testpred))
-
-
+    
+    
+    def test_preconditioners(self):
+        
+        regparam = 0.01
+        
+        K_train1, K_train2, Y_train, K_test1, K_test2, Y_test, X_train1, X_train2, X_test1, X_test2 = self.generate_xortask()
+        rows, columns = Y_train.shape
+        pairinds = np.random.permutation(rows * columns)[:60]
+        label_row_inds = pairinds % rows
+        label_col_inds = pairinds / rows
+        Y_train_nonzeros = Y_train[label_row_inds, label_col_inds]
+        
+        kernel_preds, linear_preds = [], []
+        for preconditioner in [None, 'jacobi', 'kronecker']:
+            params = {}
+            params["regparam"] = regparam
+            params["kmatrix1"] = K_train1
+            params["kmatrix2"] = K_train2
+            params["train_labels"] = Y_train_nonzeros
+            params["label_row_inds"] = label_row_inds
+            params["label_col_inds"] = label_col_inds
+            params["tol"] = 1e-10
+            params["preconditioner"] = preconditioner
+            kernel_kron_learner = CGKronRLS.createLearner(**params)
+            kernel_kron_learner.train()
+            residuals = kernel_kron_learner.results["cg_residuals"]
+            self.assertEqual(len(residuals), kernel_kron_learner.results["cg_iterations"] + 1)
+            self.assertTrue(residuals[-1] <= 1e-10 * np.linalg.norm(Y_train_nonzeros))
+            kernel_preds.append(kernel_kron_learner.getModel().predictWithKernelMatrices(K_test1, K_test2))
+            
+            params = {}
+            params["regparam"] = regparam
+            params["xmatrix1"] = X_train1
+            params["xmatrix2"] = X_train2
+            params["train_labels"] = Y_train_nonzeros
+            params["label_row_inds"] = label_row_inds
+            params["label_col_inds"] = label_col_inds
+            params["tol"] = 1e-10
+            params["preconditioner"] = preconditioner
+            linear_kron_learner = CGKronRLS.createLearner(**params)
+            linear_kron_learner.train()
+            linear_preds.append(linear_kron_learner.getModel().predictWithDataMatrices(X_test1, X_test2))
+        for P in kernel_preds[1:] + linear_preds:
+            np.testing.assert_allclose(P, kernel_preds[0], rtol=1e-5, atol=1e-5)
+    
+    
+    def test_top_k_retrieval(self):
+        
+        K_train1, K_train2, Y_train, K_test1, K_test2, Y_test, X_train1, X_train2, X_test1, X_test2 = self.generate_xortask()
+        rows, columns = Y_train.shape
+        pairinds = np.random.permutation(rows * columns)[:60]
+        label_row_inds = pairinds % rows
+        label_col_inds = pairinds / rows
+        
+        params = {}
+        params["regparam"] = 1.
+        params["kmatrix1"] = K_train1
+        params["kmatrix2"] = K_train2
+        params["train_labels"] = Y_train[label_row_inds, label_col_inds]
+        params["label_row_inds"] = label_row_inds
+        params["label_col_inds"] = label_col_inds
+        learner = CGKronRLS.createLearner(**params)
+        learner.train()
+        kernel_model = learner.getModel()
+        P = np.array(kernel_model.predictWithKernelMatrices(K_test1, K_test2))
+        index = kernel_model.createTopKIndex(K_test2)
+        k = 5
+        known_rows, known_cols = [0, 0, 3], [np.argmax(P[0]), 7, np.argmax(P[3])]
+        inds, scores = index.query(K_test1, k, known_rows, known_cols, blocksize = 7, colblocksize = 11)
+        P[known_rows, known_cols] = -np.inf
+        for i in range(P.shape[0]):
+            np.testing.assert_allclose(scores[i], np.sort(P[i])[::-1][:k])
+            np.testing.assert_allclose(P[i, inds[i]], scores[i])
+        
+        del params["kmatrix1"], params["kmatrix2"]
+        params["xmatrix1"] = X_train1
+        params["xmatrix2"] = X_train2
+        learner = CGKronRLS.createLearner(**params)
+        learner.train()
+        linear_model = learner.getModel()
+        P = np.array(linear_model.predictWithDataMatrices(X_test1, X_test2))
+        inds, scores = linear_model.createTopKIndex(X_test2).query(X_test1, k)
+        np.testing.assert_allclose(scores, -np.sort(-P, axis=1)[:, :k])
+    
+    
+    def test_predict_pairs(self):
+        
+        K_train1, K_train2, Y_train, K_test1, K_test2, Y_test, X_train1, X_train2, X_test1, X_test2 = self.generate_xortask()
+        rows, columns = Y_train.shape
+        pairinds = np.random.permutation(rows * columns)[:60]
+        label_row_inds = pairinds % rows
+        label_col_inds = pairinds / rows
+        test_row_inds = np.random.randint(0, K_test1.shape[0], 30)
+        test_col_inds = np.random.randint(0, K_test2.shape[0], 30)
+        for pairwise_kernel in ['kronecker', 'cartesian']:
+            params = {}
+            params["regparam"] = 1.
+            params["kmatrix1"] = K_train1
+            params["kmatrix2"] = K_train2
+            params["train_labels"] = Y_train[label_row_inds, label_col_inds]
+            params["label_row_inds"] = label_row_inds
+            params["label_col_inds"] = label_col_inds
+            params["pairwise_kernel"] = pairwise_kernel
+            learner = CGKronRLS.createLearner(**params)
+            learner.train()
+            kernel_model = learner.getModel()
+            if pairwise_kernel == 'cartesian':
+                #The first test examples of both domains are treated as copies of training examples
+                I1 = np.zeros((K_test1.shape[0], rows))
+                I1[:5, :5] = np.eye(5)
+                I2 = np.zeros((K_test2.shape[0], columns))
+                I2[:5, :5] = np.eye(5)
+                P = np.array(kernel_model.predictWithKernelMatrices(K_test1, K_test2, I1, I2))
+                P_pairs = kernel_model.predict_pairs(K_test1, K_test2, test_row_inds, test_col_inds, I1, I2)
+            else:
+                P = np.array(kernel_model.predictWithKernelMatrices(K_test1, K_test2))
+                P_pairs = kernel_model.predict_pairs(K_test1, K_test2, test_row_inds, test_col_inds)
+                #Sparse test kernel matrices
+                P_sparse = kernel_model.predict_pairs(sp.csr_matrix(K_test1), sp.csr_matrix(K_test2), test_row_inds, test_col_inds)
+                np.testing.assert_allclose(P_sparse, P_pairs)
+            np.testing.assert_allclose(P_pairs, P[test_row_inds, test_col_inds])
+    
+    
+    def test_pairwise_kernels(self):
+        regparam = 0.1
+        X = np.random.randn(10, 4)
+        K1 = np.dot(X, X.T)
+        K2 = np.exp(-np.random.rand(8, 8))
+        K2 = np.dot(K2, K2.T)
+        transpose = np.zeros((100, 100))
+        for i in range(10):
+            for j in range(10):
+                transpose[i + 10 * j, j + 10 * i] = 1.
+        #Explicit pairwise kernel matrices in the column-major order of the pairs
+        tasks = [('cartesian', K2, np.kron(np.eye(8), K1) + np.kron(K2, np.eye(10))),
+                 ('symmetric', K1, 0.5 * np.dot(np.kron(K1, K1), np.eye(100) + transpose)),
+                 ('anti_symmetric', K1, 0.5 * np.dot(np.kron(K1, K1), np.eye(100) - transpose))]
+        for pairwise_kernel, K2, K in tasks:
+            rows, columns = K1.shape[0], K2.shape[0]
+            pairinds = np.random.permutation(rows * columns)[:40]
+            label_row_inds = pairinds % rows
+            label_col_inds = pairinds / rows
+            Y = np.random.randn(40)
+            a = np.linalg.solve(K[np.ix_(pairinds, pairinds)] + regparam * np.eye(40), Y)
+            P_ref = np.dot(K[:, pairinds], a)
+            for preconditioner in [None, 'jacobi', 'kronecker']:
+                params = {}
+                params["regparam"] = regparam
+                params["kmatrix1"] = K1
+                params["kmatrix2"] = K2
+                params["train_labels"] = Y
+                params["label_row_inds"] = label_row_inds
+                params["label_col_inds"] = label_col_inds
+                params["tol"] = 1e-10
+                params["preconditioner"] = preconditioner
+                params["pairwise_kernel"] = pairwise_kernel
+                learner = CGKronRLS.createLearner(**params)
+                learner.train()
+                if pairwise_kernel == 'cartesian':
+                    P = learner.getModel().predictWithKernelMatrices(K1, K2, np.eye(rows), np.eye(columns))
+                else:
+                    P = learner.getModel().predictWithKernelMatrices(K1, K2)
+                np.testing.assert_allclose(np.asarray(P).ravel(order='F'), P_ref, rtol=1e-5, atol=1e-5)
+            if pairwise_kernel != 'cartesian':
+                params = {}
+                params["regparam"] = regparam
+                params["xmatrix1"] = X
+                params["xmatrix2"] = X
+                params["train_labels"] = Y
+                params["label_row_inds"] = label_row_inds
+                params["label_col_inds"] = label_col_inds
+                params["tol"] = 1e-10
+                params["pairwise_kernel"] = pairwise_kernel
+                learner = CGKronRLS.createLearner(**params)
+                learner.train()
+                P = learner.getModel().predictWithDataMatrices(X, X)
+                np.testing.assert_allclose(np.asarray(P).ravel(order='F'), P_ref, rtol=1e-5, atol=1e-5)
+    
+    
+    def test_warm_start(self):
+        K_train1, K_train2, Y_train, K_test1, K_test2, Y_test, X_train1, X_train2, X_test1, X_test2 = self.generate_xortask()
+        rows, columns = Y_train.shape
+        pairinds = np.random.permutation(rows * columns)[:60]
+        label_row_inds = pairinds % rows
+        label_col_inds = pairinds / rows
+        Y_train_nonzeros = Y_train[label_row_inds, label_col_inds]
+        for mode in [{"kmatrix1": K_train1, "kmatrix2": K_train2}, {"xmatrix1": X_train1, "xmatrix2": X_train2}]:
+            params = dict(mode)
+            params["regparam"] = 1.
+            params["train_labels"] = Y_train_nonzeros
+            params["label_row_inds"] = label_row_inds
+            params["label_col_inds"] = label_col_inds
+            params["tol"] = 1e-10
+            params["warm_start"] = True
+            learner = CGKronRLS.createLearner(**params)
+            warm_iterations, cold_iterations = 0, 0
+            #The regularization path from the strongest to the weakest regularization
+            for regparam in [100., 10., 1., 0.1]:
+                learner.solve(regparam)
+                warm_iterations += learner.results["cg_iterations"]
+                params["regparam"] = regparam
+                params["warm_start"] = False
+                cold_learner = CGKronRLS.createLearner(**params)
+                cold_learner.train()
+                cold_iterations += cold_learner.results["cg_iterations"]
+                if "kmatrix1" in mode:
+                    P = learner.getModel().predictWithKernelMatrices(K_test1, K_test2)
+                    P_cold = cold_learner.getModel().predictWithKernelMatrices(K_test1, K_test2)
+                else:
+                    P = learner.getModel().predictWithDataMatrices(X_test1, X_test2)
+                    P_cold = cold_learner.getModel().predictWithDataMatrices(X_test1, X_test2)
+                np.testing.assert_allclose(P, P_cold, rtol=1e-5, atol=1e-5)
+            self.assertTrue(warm_iterations < cold_iterations)
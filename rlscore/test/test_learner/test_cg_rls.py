@@ -0,0 +1,54 @@
+import unittest
+
+import numpy as np
+from scipy import sparse as sp
+from rlscore.learner.cg_rls import CGRLS
+from rlscore.learner.cg_rankrls import CGRankRLS
+from rlscore.measure import sqerror
+from rlscore.mselection import ValidationSetSelection
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(100)
+
+
+    def test_reg_path(self):
+        X = sp.rand(300, 500, density=0.05, format='csr', random_state=1)
+        w = np.random.randn(500)
+        Y = (X * w + 0.1 * np.random.randn(300)).reshape(-1, 1)
+        X_valid = sp.rand(100, 500, density=0.05, format='csr', random_state=2)
+        Y_valid = (X_valid * w).reshape(-1, 1)
+        reggrid = [2. ** k for k in range(-4, 5)]
+        for learnerclass in [CGRLS, CGRankRLS]:
+            results = []
+            for reg_path in [False, True]:
+                learner = learnerclass.createLearner(train_features=X, train_labels=Y, regparam=1.)
+                selector = ValidationSetSelection.createMSelector(learner=learner, measure=sqerror, train_labels=Y, validation_features=X_valid, validation_labels=Y_valid, reggrid=reggrid, reg_path=reg_path)
+                selector.verbose = False
+                selector.reggridSearch()
+                self.assertFalse(learner.warm_start)
+                self.assertEqual(len(selector.times), len(reggrid))
+                self.assertEqual(selector.resource_pool["mselection_iterations"], selector.iterations)
+                results.append(selector)
+            cold, warm = results
+            #The performances are in the order of the grid also when sweeping the path
+            np.testing.assert_allclose(warm.performances, cold.performances, rtol=1e-3)
+            self.assertEqual(warm.best_regparam, cold.best_regparam)
+            self.assertTrue(sum(warm.iterations) < sum(cold.iterations))
+            #So are the stored predictions
+            self.assertEqual(len(warm.resource_pool["mselection_predictions"]), len(reggrid))
+            for P_warm, P_cold, perf in zip(warm.resource_pool["mselection_predictions"], cold.resource_pool["mselection_predictions"], warm.performances):
+                np.testing.assert_allclose(P_warm, P_cold, rtol=1e-3, atol=1e-3)
+                self.assertAlmostEqual(sqerror(Y_valid, P_warm), perf)
+        #The warm starts are switched off again also when the sweep fails
+        def failing(Y, P):
+            raise ValueError("measure failed")
+        failing.iserror = True
+        learner = CGRLS.createLearner(train_features=X, train_labels=Y, regparam=1.)
+        selector = ValidationSetSelection.createMSelector(learner=learner, measure=failing, train_labels=Y, validation_features=X_valid, validation_labels=Y_valid, reggrid=reggrid, reg_path=True)
+        selector.verbose = False
+        self.assertRaises(ValueError, selector.reggridSearch)
+        self.assertFalse(learner.warm_start)
+        self.assertEqual(selector.grid_index, None)
@@ -0,0 +1,60 @@
+import unittest
+
+import numpy as np
+from scipy import sparse as sp
+from rlscore.learner.floating_rls import FloatingRLS
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(100)
+
+
+    def loo(self, X, Y, inds, regparam, bias):
+        K = np.dot(X[:, inds], X[:, inds].T) + bias
+        H = np.dot(K, np.linalg.inv(K + regparam * np.eye(X.shape[0])))
+        loores = (Y - np.dot(H, Y)) / (1. - np.diag(H))[:, None]
+        return np.mean(loores * loores)
+
+
+    def test_floating_rls(self):
+        #Noisy copies of the sum of the first three features tempt the forward selection
+        X = np.random.randn(30, 12)
+        Y = np.dot(X[:, :3], np.ones((3, 1))) + 0.1 * np.random.randn(30, 1)
+        X[:, 3:6] = Y + 1.5 * np.random.randn(30, 3)
+        #Brute force floating selection
+        selected, steps, performances, bestperfs = [], [], [], {}
+        while len(selected) < 4:
+            perfs = [(self.loo(X, Y, selected + [ci], 1., 1.), ci) for ci in range(12) if ci not in selected]
+            perf, added = min(perfs)
+            selected.append(added)
+            steps.append((added, True))
+            performances.append(perf)
+            bestperfs[len(selected)] = min(perf, bestperfs.get(len(selected), np.inf))
+            while len(selected) > 2:
+                perfs = [(self.loo(X, Y, [c for c in selected if c != ci], 1., 1.), ci) for ci in selected if ci != added]
+                perf, removed = min(perfs)
+                if not perf < bestperfs[len(selected) - 1]:
+                    break
+                selected.remove(removed)
+                steps.append((removed, False))
+                performances.append(perf)
+                bestperfs[len(selected)] = perf
+                added = None
+        self.assertTrue((False in [add for ci, add in steps]))
+        learner = FloatingRLS.createLearner(train_features=X, train_labels=Y, regparam=1., bias=1., subsetsize=4, blocksize=5)
+        learner.train()
+        self.assertEqual(learner.steps, steps)
+        self.assertEqual(learner.selected, selected)
+        np.testing.assert_allclose(learner.performances, performances)
+        K = np.dot(X[:, selected], X[:, selected].T) + 1.
+        A = np.linalg.solve(K + np.eye(30), Y)
+        np.testing.assert_allclose(learner.A[selected], np.dot(X[:, selected].T, A))
+        np.testing.assert_allclose(np.asarray(learner.b).ravel(), np.sum(A, axis=0))
+        #Sparse data is processed without densifying it, with the same selection
+        learner = FloatingRLS.createLearner(train_features=sp.csr_matrix(X), train_labels=Y, regparam=1., bias=1., subsetsize=4, blocksize=5)
+        learner.train()
+        self.assertEqual(learner.steps, steps)
+        np.testing.assert_allclose(learner.performances, performances)
+        np.testing.assert_allclose(learner.A[selected], np.dot(X[:, selected].T, A))
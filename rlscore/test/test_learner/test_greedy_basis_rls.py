@@ -0,0 +1,42 @@
+import unittest
+
+import numpy as np
+from rlscore.kernel import GaussianKernel
+from rlscore.learner.greedy_basis_rls import GreedyBasisRLS
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(100)
+
+
+    def test_greedy_basis_rls(self):
+        X = np.random.randn(30, 4)
+        Y = np.random.randn(30, 2)
+        Xtest = np.random.randn(10, 4)
+        K = GaussianKernel(X, gamma=0.3).getKM(X)
+        #Brute force selection for the reduced set RLS, min |Y - K[:, B] * A|^2 + regparam * tr(A.T * K[B, B] * A)
+        selected = []
+        while len(selected) < 5:
+            best = None
+            for ci in range(30):
+                if ci in selected: continue
+                B = selected + [ci]
+                H = np.dot(K[:, B], np.linalg.solve(np.dot(K[:, B].T, K[:, B]) + 0.5 * K[np.ix_(B, B)], K[:, B].T))
+                loores = (Y - np.dot(H, Y)) / (1. - np.diag(H))[:, None]
+                if best is None or np.mean(loores * loores) < best[1]:
+                    best = (ci, np.mean(loores * loores))
+            selected.append(best[0])
+        A = np.linalg.solve(np.dot(K[:, selected].T, K[:, selected]) + 0.5 * K[np.ix_(selected, selected)], np.dot(K[:, selected].T, Y))
+        learner = GreedyBasisRLS.createLearner(train_features=X, train_labels=Y, kernel="GaussianKernel", gamma=0.3, regparam=0.5, subsetsize=5, sample_size=30, blocksize=7)
+        learner.train()
+        self.assertEqual(learner.selected, selected)
+        self.assertAlmostEqual(learner.performances[-1], best[1])
+        model = learner.getModel()
+        self.assertEqual(model.A.shape, (5, 2))
+        np.testing.assert_allclose(model.predict(Xtest), np.dot(GaussianKernel(X, gamma=0.3).getKM(Xtest)[:, selected], A))
+        #Sampled candidates
+        learner = GreedyBasisRLS.createLearner(train_features=X, train_labels=Y, kernel="GaussianKernel", gamma=0.3, regparam=0.5, subsetsize=5, sample_size=8)
+        learner.train()
+        self.assertEqual(len(set(learner.selected)), 5)
@@ -0,0 +1,54 @@
+import unittest
+
+import numpy as np
+from rlscore.learner.greedy_label_rankrls import GreedyLabelRankRLS
+from rlscore.measure.cindex_measure import cindex
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(100)
+
+
+    def laplacian(self, qids, size):
+        L = np.zeros((size, size))
+        for q in qids:
+            L[np.ix_(q, q)] = len(q) * np.eye(len(q)) - 1.
+        return L
+
+
+    def lqo(self, X, Y, qids, regparam, measure = None):
+        #Leave-query-out predictions by retraining without each query
+        perfs = []
+        for q in qids:
+            L = self.laplacian([p for p in qids if p is not q], X.shape[0])
+            w = np.linalg.solve(np.dot(X.T, np.dot(L, X)) + regparam * np.eye(X.shape[1]), np.dot(X.T, np.dot(L, Y)))
+            P = np.dot(X[q], w)
+            if measure is None:
+                R = (Y[q] - P) - np.mean(Y[q] - P, axis=0)
+                perfs.append(np.mean(R * R))
+            else:
+                perfs.append(measure(Y[q], P))
+        return np.mean(perfs)
+
+
+    def test_greedy_labelrankrls(self):
+        X = np.random.randn(36, 10)
+        Y = np.random.randn(36, 1)
+        qids = [range(i, i + 6) for i in range(0, 36, 6)]
+        for measure in [None, cindex]:
+            selected, performances = [], []
+            while len(selected) < 3:
+                perfs = [(self.lqo(X[:, selected + [ci]], Y, qids, 2., measure), ci) for ci in range(10) if ci not in selected]
+                best = min(perfs) if measure is None else max(perfs)
+                selected.append(best[1])
+                performances.append(best[0])
+            learner = GreedyLabelRankRLS.createLearner(train_features=X, train_labels=Y, train_qids=qids, regparam=2., subsetsize=3, measure=measure)
+            learner.train()
+            self.assertEqual(learner.selected, selected)
+            np.testing.assert_allclose(learner.performances, performances)
+        L = self.laplacian(qids, 36)
+        Xs = X[:, selected]
+        w = np.linalg.solve(np.dot(Xs.T, np.dot(L, Xs)) + 2. * np.eye(3), np.dot(Xs.T, np.dot(L, Y)))
+        np.testing.assert_allclose(learner.getModel().predict(X), np.dot(Xs, w))
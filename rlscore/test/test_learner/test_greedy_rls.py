@@ -0,0 +1,201 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+from scipy import sparse as sp
+from rlscore.learner.greedy_rls import GreedyRLS
+from rlscore.measure import auc
+from rlscore.measure.cindex_measure import cindex
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(100)
+
+
+    def greedy_reference(self, X, Y, regparam, bias, subsetsize, measure = None):
+        #Greedy forward selection computing the leave-one-out predictions from the hat matrix
+        selected = []
+        self.reference_performances = []
+        size = X.shape[0]
+        while len(selected) < subsetsize:
+            bestcind, bestloo = None, None
+            for ci in range(X.shape[1]):
+                if ci in selected: continue
+                K = np.dot(X[:, selected + [ci]], X[:, selected + [ci]].T) + bias
+                H = np.dot(K, np.linalg.inv(K + regparam * np.eye(size)))
+                loores = (Y - np.dot(H, Y)) / (1. - np.diag(H))[:, None]
+                if measure is None:
+                    loo = np.mean(loores * loores)
+                else:
+                    loo = np.mean([measure(Y[:, j], Y[:, j] - loores[:, j]) for j in range(Y.shape[1])])
+                    if not measure.iserror:
+                        loo = -loo
+                if bestloo is None or loo < bestloo:
+                    bestcind, bestloo = ci, loo
+            selected.append(bestcind)
+            self.reference_performances.append(bestloo if measure is None or measure.iserror else -bestloo)
+        K = np.dot(X[:, selected], X[:, selected].T) + bias
+        dualvec = np.linalg.solve(K + regparam * np.eye(size), Y)
+        return selected, np.dot(X[:, selected].T, dualvec), np.sqrt(bias) * np.sum(dualvec, axis=0)
+
+
+    def test_greedy_rls(self):
+        X = np.random.randn(40, 30)
+        Y = np.random.randn(40, 2)
+        selected, W, b = self.greedy_reference(X, Y, 1., 2., 6)
+        for threads in [1, 3]:
+            learner = GreedyRLS.createLearner(train_features=X, train_labels=Y, regparam=1., bias=2., subsetsize=6, threads=threads)
+            learner.train()
+            self.assertEqual(learner.selected, selected)
+            np.testing.assert_allclose(learner.A[selected], W)
+            np.testing.assert_allclose(np.asarray(learner.b).ravel(), b)
+            np.testing.assert_allclose(learner.performances, self.reference_performances)
+    
+    
+    def test_measure(self):
+        X = np.random.randn(40, 30)
+        Y = np.sign(np.random.randn(40, 2))
+        selected, W, b = self.greedy_reference(X, Y, 1., 2., 5, auc)
+        for kwargs in [{}, {"memory_budget": 0, "blocksize": 7}]:
+            learner = GreedyRLS.createLearner(train_features=X, train_labels=Y, regparam=1., bias=2., subsetsize=5, measure=auc, **kwargs)
+            learner.train()
+            self.assertEqual(learner.selected, selected)
+            np.testing.assert_allclose(learner.A[selected], W)
+            np.testing.assert_allclose(learner.performances, self.reference_performances)
+        learner = GreedyRLS.createLearner(train_features=sp.csr_matrix(X), train_labels=Y, regparam=1., bias=2., subsetsize=5, measure=auc)
+        learner.train()
+        self.assertEqual(learner.selected, selected)
+        #A label with a single class is skipped, as auc is undefined for it
+        Y3 = np.hstack([Y, np.ones((40, 1))])
+        for kwargs in [{}, {"memory_budget": 0, "blocksize": 7}]:
+            learner = GreedyRLS.createLearner(train_features=X, train_labels=Y3, regparam=1., bias=2., subsetsize=5, measure=auc, **kwargs)
+            learner.train()
+            self.assertEqual(learner.selected, selected)
+            np.testing.assert_allclose(learner.performances, self.reference_performances)
+        Y = np.random.randn(40, 2)
+        selected, W, b = self.greedy_reference(X, Y, 1., 2., 4, cindex)
+        learner = GreedyRLS.createLearner(train_features=X, train_labels=Y, regparam=1., bias=2., subsetsize=4, measure=cindex)
+        learner.train()
+        self.assertEqual(learner.selected, selected)
+        np.testing.assert_allclose(learner.performances, self.reference_performances)
+    
+    
+    def test_nfold_criterion(self):
+        X = np.random.randn(40, 20)
+        Y = np.random.randn(40, 2)
+        folds = [range(i, 40, 7) for i in range(7)]
+        #Brute force selection retraining for each fold
+        selected, performances = [], []
+        while len(selected) < 4:
+            best = None
+            for ci in range(20):
+                if ci in selected: continue
+                inds = selected + [ci]
+                errors = []
+                for fold in folds:
+                    train = [i for i in range(40) if i not in fold]
+                    K = np.dot(X[train][:, inds], X[train][:, inds].T) + 2.
+                    A = np.linalg.solve(K + 1.5 * np.eye(len(train)), Y[train])
+                    P = np.dot(np.dot(X[fold][:, inds], X[train][:, inds].T) + 2., A)
+                    errors.append(np.mean((Y[fold] - P) ** 2))
+                if best is None or np.mean(errors) < best[1]:
+                    best = (ci, np.mean(errors))
+            selected.append(best[0])
+            performances.append(best[1])
+        for features in [X, sp.csc_matrix(X)]:
+            learner = GreedyRLS.createLearner(train_features=features, train_labels=Y, regparam=1.5, bias=2., subsetsize=4, blocksize=6, **{"cross-validation_folds": folds})
+            learner.train()
+            self.assertEqual(learner.selected, selected)
+            np.testing.assert_allclose(learner.performances, performances)
+            K = np.dot(X[:, selected], X[:, selected].T) + 2.
+            A = np.linalg.solve(K + 1.5 * np.eye(40), Y)
+            np.testing.assert_allclose(learner.A[selected], np.dot(X[:, selected].T, A))
+        #Queries are held out together
+        learner = GreedyRLS.createLearner(train_features=X, train_labels=Y, regparam=1.5, bias=2., subsetsize=4, train_qids=folds)
+        learner.train()
+        self.assertEqual(learner.selected, selected)
+    
+    
+    def test_checkpoint(self):
+        X = np.random.randn(40, 30)
+        Y = np.random.randn(40, 2)
+        learner = GreedyRLS.createLearner(train_features=X, train_labels=Y, regparam=1., bias=2., subsetsize=6)
+        learner.train()
+        directory = tempfile.mkdtemp()
+        try:
+            checkpoint = os.path.join(directory, "run")
+            interrupted = GreedyRLS.createLearner(train_features=X, train_labels=Y, regparam=1., bias=2., subsetsize=3, checkpoint=checkpoint, checkpoint_interval=2)
+            interrupted.train()
+            self.assertEqual(interrupted.selected, learner.selected[:3])
+            #G * X.T updated beyond the saved round is recovered
+            GXT = np.load(os.path.join(checkpoint, "GXT.npy"), mmap_mode="r+")
+            GXT[:, :10] += 1.
+            GXT.flush()
+            del GXT
+            for resume_checkpoint in [checkpoint, os.path.join(directory, "copy")]:
+                resumed = GreedyRLS.createLearner(train_features=X, train_labels=Y, regparam=1., bias=2., subsetsize=6, resume_from=checkpoint, checkpoint=resume_checkpoint)
+                resumed.train()
+                self.assertEqual(resumed.selected, learner.selected)
+                np.testing.assert_allclose(resumed.performances, learner.performances)
+                np.testing.assert_allclose(resumed.A, learner.A)
+                trace = np.loadtxt(os.path.join(resume_checkpoint, "performances.txt"))
+                self.assertEqual(list(trace[:, 0].astype(int)), learner.selected)
+                np.testing.assert_allclose(trace[:, 1], learner.performances)
+            self.assertRaises(Exception, GreedyRLS.createLearner(train_features=X, train_labels=Y, regparam=2., bias=2., subsetsize=6, resume_from=checkpoint).train)
+        finally:
+            shutil.rmtree(directory)
+    
+    
+    def test_sparse_greedy_rls(self):
+        X = sp.rand(40, 30, density=0.3, format="csr", random_state=2)
+        Y = np.random.randn(40, 2)
+        for bias in [0., 2.]:
+            selected, W, b = self.greedy_reference(X.toarray(), Y, 1., bias, 6)
+            learner = GreedyRLS.createLearner(train_features=X, train_labels=Y, regparam=1., bias=bias, subsetsize=6, blocksize=7)
+            learner.train()
+            self.assertEqual(learner.selected, selected)
+            np.testing.assert_allclose(learner.A[selected], W)
+            np.testing.assert_allclose(np.asarray(learner.b).ravel(), b)
+    
+    
+    def test_low_memory_greedy_rls(self):
+        X = np.random.randn(40, 30)
+        Y = np.random.randn(40, 2)
+        selected, W, b = self.greedy_reference(X, Y, 1., 2., 6)
+        learner = GreedyRLS.createLearner(train_features=X, train_labels=Y, regparam=1., bias=2., subsetsize=6, memory_budget=0, blocksize=4)
+        learner.train()
+        self.assertTrue(hasattr(learner, "Xfactored"))
+        self.assertEqual(learner.selected, selected)
+        np.testing.assert_allclose(learner.A[selected], W)
+        np.testing.assert_allclose(np.asarray(learner.b).ravel(), b)
+    
+    
+    def test_approximate_selection(self):
+        X = np.random.randn(40, 30)
+        Y = np.random.randn(40, 2)
+        selected, W, b = self.greedy_reference(X, Y, 1., 2., 6)
+        #Stochastic selection scoring all the features is exact
+        learner = GreedyRLS.createLearner(train_features=X, train_labels=Y, regparam=1., bias=2., subsetsize=6, selection='stochastic', sample_size=30)
+        learner.train()
+        self.assertEqual(learner.selected, selected)
+        for selection, batchsize in [('lazy', 1), ('lazy', 2), ('stochastic', 3), ('exact', 2)]:
+            learner = GreedyRLS.createLearner(train_features=X, train_labels=Y, regparam=1., bias=2., subsetsize=6, selection=selection, batchsize=batchsize, sample_size=10)
+            learner.train()
+            sel = learner.selected
+            self.assertEqual(len(set(sel)), 6)
+            self.assertEqual(learner.resource_pool["GreedyRLS_selection_rounds"], [i / batchsize for i in range(6)])
+            self.assertEqual(len(learner.resource_pool["GreedyRLS_evaluations"]), 6 / batchsize)
+            K = np.dot(X[:, sel], X[:, sel].T) + 2.
+            dualvec = np.linalg.solve(K + np.eye(40), Y)
+            np.testing.assert_allclose(learner.A[sel], np.dot(X[:, sel].T, dualvec))
+            if batchsize == 1:
+                #The recorded errors are the leave-one-out errors of the selected sets
+                for i in range(6):
+                    K = np.dot(X[:, sel[:i + 1]], X[:, sel[:i + 1]].T) + 2.
+                    H = np.dot(K, np.linalg.inv(K + np.eye(40)))
+                    loores = (Y - np.dot(H, Y)) / (1. - np.diag(H))[:, None]
+                    self.assertAlmostEqual(learner.performances[i], np.mean(loores * loores))
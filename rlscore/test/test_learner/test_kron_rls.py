@@ -0,0 +1,210 @@
+import unittest
+
+import numpy as np
+from scipy import sparse as sp
+from rlscore.learner.kron_rls import KronRLS
+from rlscore.measure import accuracy
+from rlscore.measure import auc
+from rlscore.measure import sqerror
+
+
+class Test(unittest.TestCase):
+    
+    def setUp(self):
+        np.random.seed(55)
+    
+    
+    def generate_data(self, rows, columns, dim1, dim2):
+        X1 = np.random.randn(rows, dim1)
+        X2 = np.random.randn(columns, dim2)
+        K1 = np.dot(X1, X1.T) + 0.1 * np.eye(rows)
+        #Gaussian kernel for the second domain
+        sqdist = np.sum(X2 * X2, axis=1)[:, None] + np.sum(X2 * X2, axis=1)[None, :] - 2 * np.dot(X2, X2.T)
+        K2 = np.exp(-0.1 * sqdist)
+        Y = np.random.randn(rows, columns)
+        return K1, K2, Y
+    
+    
+    def train(self, K1, K2, Y, regparam):
+        params = {}
+        params["regparam"] = regparam
+        params["kmatrix1"] = K1
+        params["kmatrix2"] = K2
+        params["train_labels"] = Y
+        learner = KronRLS.createLearner(**params)
+        learner.train()
+        return learner
+    
+    
+    def test_add_rows_and_cols(self):
+        regparam = 0.1
+        K1, K2, Y = self.generate_data(30, 20, 5, 4)
+        full_learner = self.train(K1, K2, Y, regparam)
+        
+        #Leave the last three rows and the last two columns out, then add them incrementally
+        learner = self.train(K1[:27, :27], K2[:18, :18], Y[:27, :18], regparam)
+        learner.add_rows(K1[27:, :], Y[27:, :18])
+        learner.add_cols(K2[18:, :], Y[:, 18:])
+        
+        np.testing.assert_allclose(learner.A, full_learner.A, rtol=1e-6, atol=1e-8)
+        np.testing.assert_allclose(np.sort(learner.evals1.A.ravel()), np.sort(full_learner.evals1.A.ravel()), atol=1e-8)
+        np.testing.assert_allclose(learner.imputationLOO(), full_learner.imputationLOO(), rtol=1e-6, atol=1e-8)
+        
+        #Retraining with another regularization parameter reuses the updated decompositions
+        learner.solve_kernel(10.)
+        full_learner.solve_kernel(10.)
+        np.testing.assert_allclose(learner.A, full_learner.A, rtol=1e-6, atol=1e-8)
+        
+        #A block too large for row by row updates, and a low-rank linear kernel
+        X1 = np.random.randn(30, 4)
+        for K, start in [(K1, 10), (np.dot(X1, X1.T), 26), (np.dot(X1, X1.T), 10)]:
+            full_learner = self.train(K, K2, Y, regparam)
+            learner = self.train(K[:start, :start], K2, Y[:start], regparam)
+            learner.add_rows(K[start:, :], Y[start:])
+            np.testing.assert_allclose(learner.A, full_learner.A, rtol=1e-6, atol=1e-8)
+            np.testing.assert_allclose(learner.evals1.A.ravel(), np.linalg.eigvalsh(K), atol=1e-8)
+        
+        learner = KronRLS.createLearner(regparam=regparam, kmatrix1=K1[:27, :27], kmatrix2=K2, train_labels=[Y[:27], Y[:27]])
+        learner.train()
+        self.assertRaises(Exception, learner.add_rows, K1[27:, :], Y[27:])
+        learner = KronRLS.createLearner(regparam=regparam, kmatrix1=K2[:18, :18], kmatrix2=K2[:18, :18], train_labels=Y[:18, :18], pairwise_kernel='symmetric')
+        learner.train()
+        self.assertRaises(Exception, learner.add_cols, K2[18:, :], Y[:18, 18:])
+    
+    
+    def test_blockwise_imputation_loo(self):
+        regparam = 0.1
+        K1, K2, Y = self.generate_data(30, 20, 5, 4)
+        X1 = np.random.randn(30, 6)
+        X2 = np.random.randn(20, 3)
+        kernel_learner = self.train(K1, K2, Y, regparam)
+        linear_learner = KronRLS.createLearner(regparam=regparam, xmatrix1=X1, xmatrix2=X2, train_labels=Y)
+        linear_learner.train()
+        for learner, P in [(kernel_learner, np.dot(np.dot(K1, kernel_learner.A), K2.T)),
+                           (linear_learner, np.dot(np.dot(X1, linear_learner.W), X2.T))]:
+            #Reference values computed with full grid sized matrices
+            newevals = np.multiply(learner.evals2 * learner.evals1.T, 1. / (learner.evals2 * learner.evals1.T + regparam))
+            ccc = np.multiply(learner.V, learner.V) * newevals.T * np.multiply(learner.U, learner.U).T
+            loopred = np.multiply(1. / (1. - ccc), P - np.multiply(ccc, Y))
+            for blocksize in [1, 7, 1000]:
+                self.assertTrue(np.allclose(learner.imputationLOO(blocksize=blocksize), loopred))
+            out = np.zeros(Y.shape)
+            learner.imputationLOO(out=out, blocksize=4)
+            self.assertTrue(np.allclose(out, loopred))
+            perf = learner.imputationLOOPerformance(sqerror, blocksize=7)
+            self.assertAlmostEqual(perf, np.mean(np.square(Y - loopred)))
+        #A measure that is not a mean over the pairs is computed over the whole grid, also when
+        #it is undefined for some of the blocks
+        Ybin = np.where(Y > np.median(Y), 1., -1.)
+        Ybin[0] = -1.
+        learner = self.train(K1, K2, Ybin, regparam)
+        loopred = learner.imputationLOO()
+        for blocksize in [1, 7, 1000]:
+            self.assertAlmostEqual(learner.imputationLOOPerformance(auc, blocksize=blocksize), auc(Ybin.ravel(), np.asarray(loopred).ravel()))
+            self.assertAlmostEqual(learner.imputationLOOPerformance(accuracy, blocksize=blocksize), accuracy(Ybin.ravel(), np.asarray(loopred).ravel()))
+        out = np.zeros(Y.shape)
+        self.assertAlmostEqual(learner.imputationLOOPerformance(auc, blocksize=7, out=out), auc(Ybin.ravel(), np.asarray(loopred).ravel()))
+        self.assertTrue(np.allclose(out, loopred))
+    
+    
+    def test_multiple_label_matrices(self):
+        regparam = 0.1
+        K1, K2, Y = self.generate_data(30, 20, 5, 4)
+        X1 = np.random.randn(30, 6)
+        X2 = np.random.randn(20, 3)
+        Ys = np.random.randn(3, 30, 20)
+        for threads in [1, 2]:
+            kernel_learner = KronRLS.createLearner(regparam=regparam, kmatrix1=K1, kmatrix2=K2, train_labels=Ys, threads=threads)
+            kernel_learner.train()
+            linear_learner = KronRLS.createLearner(regparam=regparam, xmatrix1=X1, xmatrix2=X2, train_labels=list(Ys), threads=threads)
+            linear_learner.train()
+            kernel_loos = kernel_learner.imputationLOO()
+            linear_loos = linear_learner.imputationLOO()
+            for t in range(3):
+                single = self.train(K1, K2, Ys[t], regparam)
+                self.assertTrue(np.allclose(kernel_learner.getModel()[t].A, single.A))
+                self.assertTrue(np.allclose(kernel_loos[t], single.imputationLOO()))
+                single = KronRLS.createLearner(regparam=regparam, xmatrix1=X1, xmatrix2=X2, train_labels=Ys[t])
+                single.train()
+                self.assertTrue(np.allclose(linear_learner.getModel()[t].W, single.W))
+                self.assertTrue(np.allclose(linear_loos[t], single.imputationLOO()))
+            kernel_learner.solve(10.)
+            single = self.train(K1, K2, Ys[2], 10.)
+            self.assertTrue(np.allclose(kernel_learner.getModel()[2].A, single.A))
+    
+    
+    def test_truncated_svd(self):
+        regparam = 0.1
+        Y = np.random.randn(30, 20)
+        X1 = sp.rand(30, 200, density=0.1, format="csr", random_state=1)
+        X2 = sp.rand(20, 100, density=0.1, format="csr", random_state=2)
+        X1test = sp.rand(8, 200, density=0.1, format="csr", random_state=3)
+        X2test = sp.rand(6, 100, density=0.1, format="csr", random_state=4)
+        dense_learner = KronRLS.createLearner(regparam=regparam, xmatrix1=X1.toarray(), xmatrix2=X2.toarray(), train_labels=Y)
+        dense_learner.train()
+        #With the full rank the truncated decompositions are exact
+        for X1train, X2train in [(X1, X2), (X1.toarray(), X2.toarray())]:
+            learner = KronRLS.createLearner(regparam=regparam, xmatrix1=X1train, xmatrix2=X2train, train_labels=Y, svd_rank=30)
+            learner.train()
+            self.assertTrue(learner.getModel().W is None)
+            P = learner.getModel().predictWithDataMatrices(X1test, X2test)
+            self.assertTrue(np.allclose(P, dense_learner.getModel().predictWithDataMatrices(X1test.toarray(), X2test.toarray())))
+            self.assertTrue(np.allclose(learner.imputationLOO(), dense_learner.imputationLOO()))
+        learner = KronRLS.createLearner(regparam=regparam, xmatrix1=X1, xmatrix2=X2, train_labels=Y, svd_rank=5)
+        learner.train()
+        model = learner.getModel()
+        W = model.R1 * model.core * model.R2.T
+        P = model.predictWithDataMatrices(X1test, X2test)
+        self.assertTrue(np.allclose(P, X1test * W * X2test.T))
+        inds, scores = model.createTopKIndex(X2test).query(X1test, 3)
+        self.assertTrue(np.allclose(scores, -np.sort(-np.asarray(P), axis=1)[:, :3]))
+        #The random directions are drawn from the given seed, not from the global generator
+        preds = []
+        for seed in [3, 3]:
+            np.random.seed(seed + len(preds))
+            learner = KronRLS.createLearner(regparam=regparam, xmatrix1=X1, xmatrix2=X2, train_labels=Y, svd_rank=5, random_state=seed)
+            learner.train()
+            preds.append(learner.getModel().predictWithDataMatrices(X1test, X2test))
+        np.testing.assert_array_equal(preds[0], preds[1])
+    
+    
+    def test_pairwise_kernels(self):
+        regparam = 0.1
+        K1, K2, Y = self.generate_data(12, 8, 5, 4)
+        m, q = Y.shape
+        #Explicit pairwise kernel matrices in the column-major order of the pairs
+        K = np.kron(np.eye(q), K1) + np.kron(K2, np.eye(m))
+        learner = KronRLS.createLearner(regparam=regparam, kmatrix1=K1, kmatrix2=K2, train_labels=Y, pairwise_kernel='cartesian')
+        learner.train()
+        a = np.linalg.solve(K + regparam * np.eye(m * q), Y.ravel(order='F'))
+        self.assertTrue(np.allclose(np.asarray(learner.A).ravel(order='F'), a))
+        P = learner.getModel().predictWithKernelMatrices(K1, K2, np.eye(m), np.eye(q))
+        self.assertTrue(np.allclose(np.asarray(P).ravel(order='F'), np.dot(K, a)))
+        H = np.dot(K, np.linalg.inv(K + regparam * np.eye(m * q)))
+        y = Y.ravel(order='F')
+        loopred = (np.dot(H, y) - np.diag(H) * y) / (1. - np.diag(H))
+        self.assertTrue(np.allclose(np.asarray(learner.imputationLOO()).ravel(order='F'), loopred))
+        
+        K1, K1, Y = self.generate_data(10, 10, 5, 4)
+        transpose = np.zeros((100, 100))
+        for i in range(10):
+            for j in range(10):
+                transpose[i + 10 * j, j + 10 * i] = 1.
+        for pairwise_kernel, sign in [('symmetric', 1.), ('anti_symmetric', -1.)]:
+            K = 0.5 * np.dot(np.kron(K1, K1), np.eye(100) + sign * transpose)
+            learner = KronRLS.createLearner(regparam=regparam, kmatrix1=K1, kmatrix2=K1, train_labels=Y, pairwise_kernel=pairwise_kernel)
+            learner.train()
+            a = np.linalg.solve(K + regparam * np.eye(100), Y.ravel(order='F'))
+            P = learner.getModel().predictWithKernelMatrices(K1, K1)
+            self.assertTrue(np.allclose(np.asarray(P).ravel(order='F'), np.dot(K, a)))
+            self.assertTrue(np.allclose(P, sign * P.T))
+        
+        #In the truncated linear mode, a copy of the first data matrix is accepted as the second one
+        X = np.random.randn(10, 6)
+        for pairwise_kernel in ['symmetric', 'anti_symmetric']:
+            preds = []
+            for X2 in [X, X.copy()]:
+                learner = KronRLS.createLearner(regparam=regparam, xmatrix1=X, xmatrix2=X2, train_labels=Y, svd_rank=6, random_state=10, pairwise_kernel=pairwise_kernel)
+                learner.train()
+                preds.append(np.asarray(learner.getModel().predictWithDataMatrices(X, X)))
+            np.testing.assert_allclose(preds[0], preds[1])
@@ -0,0 +1,62 @@
+import unittest
+
+import numpy as np
+from rlscore.learner.label_rankrls import LabelRankRLS
+from rlscore.measure import sqmprank
+from rlscore.mselection import NfoldSelection
+from rlscore.utilities.query_structure import QueryStructure
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(100)
+
+
+    def test_leave_query_out(self):
+        X = np.random.randn(40, 5)
+        Y = np.random.randn(40, 2)
+        qidlist = np.random.randint(0, 9, 40)
+        qids = [list(np.flatnonzero(qidlist == q)) for q in np.unique(qidlist)]
+        learner = LabelRankRLS.createLearner(train_features=X, train_labels=Y, train_qids=qids, regparam=1.)
+        for regparam in [1., 10.]:
+            learner.solve(regparam)
+            F = learner.computeHO_all_queries()
+            self.assertEqual(F.shape, (40, 2))
+            for inds in qids:
+                #Retraining without the query
+                train = [ind for ind in range(40) if ind not in inds]
+                trainqids = [[train.index(ind) for ind in q] for q in qids if q is not inds]
+                holearner = LabelRankRLS.createLearner(train_features=X[train], train_labels=Y[train], train_qids=trainqids, regparam=regparam)
+                holearner.solve(regparam)
+                P = np.asarray(holearner.getModel().predict(X[inds]))
+                #Predictions within a query are determined only up to a constant
+                np.testing.assert_allclose(F[inds] - np.mean(F[inds], axis=0), P - np.mean(P, axis=0), atol=1e-10)
+                np.testing.assert_allclose(F[inds], learner.computeHO(inds))
+        selector = NfoldSelection.createMSelector(learner=learner, measure=sqmprank, train_labels=Y, train_qids=qids)
+        perf = selector.estimatePerformance(learner)
+        selector.setFolds(qids)
+        self.assertAlmostEqual(perf, selector.estimatePerformance(learner))
+    
+    
+    def test_query_structure(self):
+        qidlist = np.array([3, 1, 3, 7, 1, 3])
+        queries = QueryStructure(qidlist)
+        self.assertEqual(list(queries.sizes), [2, 3, 1])
+        self.assertEqual([list(inds) for inds in queries.indslist()], [[1, 4], [0, 2, 5], [3]])
+        L = np.diag(queries.D) - (qidlist[:, None] == qidlist[None, :])
+        V = np.random.randn(6, 2)
+        np.testing.assert_allclose(queries.laplacian_matvec(V), np.dot(L, V))
+        np.testing.assert_allclose(queries.laplacian_matvec(V, normalized=True), np.dot(L / queries.D[:, None], V))
+        np.testing.assert_allclose(queries.laplacian_matvec(np.mat(V)), np.dot(L, V))
+        other = QueryStructure.fromIndexLists([[1, 4], [0, 2, 5], [3]], 6)
+        self.assertEqual(list(other.qidlist), list(queries.qidlist))
+        self.assertRaises(Exception, QueryStructure.fromIndexLists, [[1, 4], [0, 2, 5]], 6)
+        self.assertRaises(Exception, QueryStructure.fromIndexLists, [[1, 4, 6], [0, 2, 5], [3]], 6)
+        #The query indices are the positions of the lists, also with empty queries
+        other = QueryStructure.fromIndexLists([[], [1, 4], [], [0, 2, 5], [3]], 6)
+        self.assertEqual(list(other.qidlist), [3, 1, 3, 4, 1, 3])
+        self.assertEqual(list(other.sizes), [0, 2, 0, 3, 1])
+        self.assertEqual(other.P.shape, (6, 5))
+        np.testing.assert_allclose(other.laplacian_matvec(V), np.dot(L, V))
+        self.assertEqual([list(inds) for inds in other.indslist()], [[], [1, 4], [], [0, 2, 5], [3]])
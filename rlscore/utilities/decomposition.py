@@ -1,5 +1,6 @@
 import numpy as np
 import numpy.linalg as la
+import scipy.sparse as sp
 from numpy.linalg import cholesky
 from numpy.linalg import inv
 from numpy.linalg.linalg import LinAlgError
@@ -29,6 +30,46 @@ def decomposeDataMatrix(X):
     return svals, evecs, U
 
 
+def decomposeDataMatrixRandomized(X, rank, oversampling = 10, power_iterations = 2, random_state = None):
+    """Returns a truncated singular value decomposition of the data matrix X computed with randomized subspace iteration.
+    
+    X is accessed only through matrix products, so it may also be a scipy sparse matrix.
+    
+    @param X: data matrix whose rows and columns correspond to the features and datumns, respectively.
+    @type X: numpy matrix of floats or scipy sparse matrix
+    @param rank: number of singular values and vectors returned (at most)
+    @type rank: int
+    @param oversampling: number of additional random directions used to capture the dominant subspace
+    @type oversampling: int
+    @param power_iterations: number of subspace iterations improving the accuracy when the singular values decay slowly
+    @type power_iterations: int
+    @param random_state: seed or generator for the random directions, a new unseeded generator is used if None
+    @type random_state: int or numpy.random.RandomState
+    @return: the largest nonzero singular values and the corresponding left and right singular vectors of X, as in decomposeDataMatrix.
+    @rtype: a tuple of three numpy matrices"""
+    if sp.issparse(X):
+        A = sp.csr_matrix(X.T)
+    else:
+        A = np.asarray(X).T
+    if not isinstance(random_state, np.random.RandomState):
+        random_state = np.random.RandomState(random_state)
+    samplesize = min(rank + oversampling, A.shape[0], A.shape[1])
+    Q = la.qr(A.dot(random_state.randn(A.shape[1], samplesize)))[0]
+    for i in range(power_iterations):
+        Q = la.qr(A.T.dot(Q))[0]
+        Q = la.qr(A.dot(Q))[0]
+    #A is approximated by Q * Q.T * A, whose singular value decomposition is obtained from the small factor Q.T * A
+    BT = np.asarray(A.T.dot(Q))
+    rsvecsT, svals, svecsT = la.svd(BT, full_matrices=0)
+    nz = 0
+    for l in range(min(rank, len(svals))):
+        if svals[l] * svals[l] > SMALLEST_EVAL:
+            nz += 1
+    evecs = np.mat(np.dot(Q, svecsT.T[:, :nz]))
+    U = np.mat(rsvecsT[:, :nz].T)
+    return np.mat(svals[:nz]), evecs, U
+
+
 def decomposeKernelMatrix(K, trunc = None):
     """"Returns the reduced eigen decomposition of the kernel matrix K so that only the eigenvectors corresponding to the nonzero eigenvalues are returned.
     
@@ -92,3 +133,220 @@ def __shiftKmatrix(K_r, bvectors, shift=0.000000001):
     for i, j in enumerate(bvectors):
         K_r[i, j] += shift    
 
+
+
+def updateBorderedEigenDecomposition(evals, evecs, b, c):
+    """Updates the eigen decomposition of a symmetric matrix K into the eigen decomposition
+    of the bordered matrix [[K, b], [b.T, c]].
+    
+    In the eigenbasis of K the bordered matrix is an arrowhead matrix, whose eigenvalues
+    are the roots of a secular equation. Components with negligible coupling and clusters
+    of (nearly) equal eigenvalues are deflated first, the roots are then found with a
+    safeguarded Newton iteration, and the eigenvectors are built from the recomputed
+    coupling vector (Loewner formula) to keep them numerically orthogonal. Apart from the
+    final change of basis, which is a single matrix product, the update takes O(m^2) time.
+    
+    @param evals: eigenvalues of K
+    @type evals: array-like of floats, length m
+    @param evecs: eigenvectors of K, one per column
+    @type evecs: numpy matrix of floats, shape m*m
+    @param b: new column of the bordered matrix
+    @type b: array-like of floats, length m
+    @param c: new diagonal entry of the bordered matrix
+    @type c: float
+    @return: the eigenvalues in ascending order and the corresponding eigenvectors of the bordered matrix
+    @rtype: a tuple of an array of length m+1 and a numpy matrix of shape (m+1)*(m+1)"""
+    d = np.asarray(evals, dtype=np.float64).ravel()
+    order = np.argsort(d)
+    d = d[order]
+    V = np.array(evecs, dtype=np.float64)[:, order]
+    b = np.asarray(b, dtype=np.float64).ravel()
+    c = float(c)
+    m = len(d)
+    z = np.dot(V.T, b)
+    
+    scale = max(np.max(np.abs(d)) if m > 0 else 0., abs(c), la.norm(z))
+    tol = 8. * np.finfo(np.float64).eps * scale
+    deflated = np.abs(z) <= tol
+    #A Givens rotation within a cluster of equal eigenvalues moves the whole coupling to its last member
+    prev = -1
+    for i in range(m):
+        if deflated[i]:
+            continue
+        if prev >= 0 and d[i] - d[prev] <= tol:
+            r = np.hypot(z[prev], z[i])
+            cs, sn = z[i] / r, z[prev] / r
+            v_prev = V[:, prev].copy()
+            V[:, prev] = cs * v_prev - sn * V[:, i]
+            V[:, i] = sn * v_prev + cs * V[:, i]
+            z[prev], z[i] = 0., r
+            deflated[prev] = True
+        prev = i
+    
+    nd = np.where(np.logical_not(deflated))[0]
+    dd, zz = d[nd], z[nd]
+    n = len(nd)
+    zsqr = zz * zz
+    
+    #The k:th root lies between dd[k-1] and dd[k], and is stored as an offset tau from the closer one of them
+    if n == 0:
+        origin = np.zeros(1, dtype=int)
+        tau = np.zeros(1)
+        lambdas = np.array([c])
+    else:
+        abssum = np.sum(np.abs(zz))
+        lower = min(dd[0] - np.max(np.abs(zz)), c - abssum)
+        upper = max(dd[-1] + np.max(np.abs(zz)), c + abssum)
+        origin = np.concatenate([[0], np.arange(n)])
+        lo = np.zeros(n + 1)
+        hi = np.zeros(n + 1)
+        lo[0], hi[0] = lower - dd[0], 0.
+        if n > 1:
+            halfgap = 0.5 * (dd[1:] - dd[:-1])
+            gmid = __secularFunction(dd, zsqr, c, np.arange(n - 1), halfgap)
+            right = gmid > 0.
+            origin[1:n] = np.where(right, np.arange(1, n), np.arange(n - 1))
+            lo[1:n] = np.where(right, -halfgap, 0.)
+            hi[1:n] = np.where(right, 0., halfgap)
+        origin[n] = n - 1
+        lo[n], hi[n] = 0., upper - dd[-1]
+        tau = __solveSecularEquation(dd, zsqr, c, origin, lo, hi)
+        lambdas = dd[origin] + tau
+    
+    #Recompute the coupling vector from the computed eigenvalues (Loewner formula)
+    W = np.zeros((n + 1, n + 1))
+    if n > 0:
+        chunk = max(1, 2 ** 20 // (n + 1))
+        zhat = np.zeros(n)
+        for start in range(0, n, chunk):
+            end = min(start + chunk, n)
+            rows = np.arange(start, end)
+            dminuslambda = (dd[rows][:, None] - dd[origin][None, :]) - tau[None, :]
+            dminusd = dd[rows][:, None] - dd[None, :]
+            dminusd[np.arange(end - start), rows] = 1.
+            logzsqr = np.sum(np.log(np.abs(dminuslambda)), axis=1) - np.sum(np.log(np.abs(dminusd)), axis=1)
+            zhat[start:end] = np.sqrt(np.exp(logzsqr))
+        zhat = np.where(zz < 0., -zhat, zhat)
+        for start in range(0, n + 1, chunk):
+            end = min(start + chunk, n + 1)
+            lambdaminusd = (dd[origin[start:end]][None, :] - dd[:, None]) + tau[None, start:end]
+            W[:n, start:end] = zhat[:, None] / lambdaminusd
+    W[n] = 1.
+    W /= np.sqrt(np.sum(W * W, axis=0))
+    
+    newevals = np.concatenate([d[deflated], lambdas])
+    newevecs = np.zeros((m + 1, m + 1))
+    definds = np.where(deflated)[0]
+    newevecs[:m, :len(definds)] = V[:, definds]
+    newevecs[:m, len(definds):] = np.dot(V[:, nd], W[:n])
+    newevecs[m, len(definds):] = W[n]
+    order = np.argsort(newevals)
+    return newevals[order], np.mat(newevecs[:, order])
+
+
+def updateBorderedEigenDecompositionBlock(evals, evecs, B, C):
+    """Updates the eigen decomposition of a symmetric matrix K into the eigen decomposition
+    of the matrix [[K, B.T], [B, C]], bordered with k new rows and columns at once.
+    
+    The new rows are projected onto the eigenvectors of K, and the eigenvectors they are not
+    coupled with remain eigenvectors of the bordered matrix. The n coupled eigenvectors and the
+    k new coordinates span a space of dimension n+k, in which the bordered matrix is decomposed
+    with a dense eigen solver, followed by a single change of basis. This takes
+    O(m^2 k + (n+k)^3 + m n (n+k)) time, far less than a new decomposition when the new rows lie
+    in a low-dimensional eigenspace of K, as with linear kernels of few features. When most of
+    the eigenvectors are coupled, a single row or a few rows are added with
+    updateBorderedEigenDecomposition one at a time, and a larger block with a new decomposition
+    of the bordered matrix.
+    
+    @param evals: eigenvalues of K
+    @type evals: array-like of floats, length m
+    @param evecs: eigenvectors of K, one per column
+    @type evecs: numpy matrix of floats, shape m*m
+    @param B: the new rows of the bordered matrix, restricted to the columns of K
+    @type B: array-like of floats, shape k*m
+    @param C: the symmetric block of the bordered matrix on the new rows and columns
+    @type C: array-like of floats, shape k*k
+    @return: the eigenvalues in ascending order and the corresponding eigenvectors of the bordered matrix
+    @rtype: a tuple of an array of length m+k and a numpy matrix of shape (m+k)*(m+k)"""
+    d = np.asarray(evals, dtype=np.float64).ravel()
+    V = np.array(evecs, dtype=np.float64)
+    m = len(d)
+    B = np.asarray(B, dtype=np.float64).reshape((-1, m))
+    k = B.shape[0]
+    C = np.asarray(C, dtype=np.float64).reshape((k, k))
+    if k == 1:
+        return updateBorderedEigenDecomposition(d, V, B[0], C[0, 0])
+    Z = np.dot(V.T, B.T)
+    scale = max(np.max(np.abs(d)) if m > 0 else 0., np.max(np.abs(C)), la.norm(Z))
+    tol = 8. * np.finfo(np.float64).eps * scale
+    coupled = np.max(np.abs(Z), axis=1) > tol if m > 0 else np.zeros(0, dtype=bool)
+    nd = np.where(coupled)[0]
+    n = len(nd)
+    if 2 * n > m:
+        #The projected problem is nearly as large as the bordered one, so there is nothing to gain
+        #from it. A bordered update per row costs a change of basis, of the order of a twentieth
+        #of a new decomposition.
+        if k < 16:
+            for r in range(k):
+                b = np.concatenate([B[r], C[r, :r]])
+                d, V = updateBorderedEigenDecomposition(d, V, b, C[r, r])
+            return d, V
+        K = np.dot(V * d, V.T)
+        bordered = np.empty((m + k, m + k))
+        bordered[:m, :m] = K
+        bordered[m:, :m] = B
+        bordered[:m, m:] = B.T
+        bordered[m:, m:] = C
+        newevals, newevecs = la.eigh(bordered)
+        return newevals, np.mat(newevecs)
+    core = np.zeros((n + k, n + k))
+    core[np.arange(n), np.arange(n)] = d[nd]
+    core[:n, n:] = Z[nd]
+    core[n:, :n] = Z[nd].T
+    core[n:, n:] = C
+    lambdas, W = la.eigh(core)
+    
+    definds = np.where(np.logical_not(coupled))[0]
+    newevals = np.concatenate([d[definds], lambdas])
+    newevecs = np.zeros((m + k, m + k))
+    newevecs[:m, :len(definds)] = V[:, definds]
+    newevecs[:m, len(definds):] = np.dot(V[:, nd], W[:n])
+    newevecs[m:, len(definds):] = W[n:]
+    order = np.argsort(newevals)
+    return newevals[order], np.mat(newevecs[:, order])
+
+
+def __secularFunction(dd, zsqr, c, origin, tau):
+    #Evaluates c - lambda + sum_i zsqr_i / (lambda - dd_i), with lambda = dd[origin] + tau
+    lambdaminusd = (dd[origin][:, None] - dd[None, :]) + tau[:, None]
+    return c - dd[origin] - tau + np.sum(zsqr[None, :] / lambdaminusd, axis=1)
+
+
+def __solveSecularEquation(dd, zsqr, c, origin, lo, hi, maxiter=100):
+    #Safeguarded Newton iteration for the roots of the (decreasing) secular function,
+    #each bracketed by lo < tau < hi
+    eps = np.finfo(np.float64).eps
+    tau = 0.5 * (lo + hi)
+    chunk = max(1, 2 ** 20 // len(dd))
+    for start in range(0, len(tau), chunk):
+        end = min(start + chunk, len(tau))
+        o, t, l, h = origin[start:end], tau[start:end], lo[start:end], hi[start:end]
+        active = np.arange(end - start)
+        for iteration in range(maxiter):
+            lambdaminusd = (dd[o[active]][:, None] - dd[None, :]) + t[active][:, None]
+            terms = zsqr[None, :] / lambdaminusd
+            g = c - dd[o[active]] - t[active] + np.sum(terms, axis=1)
+            dg = -1. - np.sum(terms / lambdaminusd, axis=1)
+            l[active] = np.where(g > 0., t[active], l[active])
+            h[active] = np.where(g > 0., h[active], t[active])
+            newt = t[active] - g / dg
+            outside = np.logical_or(newt <= l[active], newt >= h[active])
+            newt = np.where(outside, 0.5 * (l[active] + h[active]), newt)
+            converged = np.logical_or(np.abs(newt - t[active]) <= 4. * eps * np.abs(newt), g == 0.)
+            converged = np.logical_or(converged, h[active] - l[active] <= 2. * eps * np.maximum(np.abs(l[active]), np.abs(h[active])))
+            t[active] = np.where(g == 0., t[active], newt)
+            active = active[np.logical_not(converged)]
+            if len(active) == 0:
+                break
+        tau[start:end] = t
+    return tau
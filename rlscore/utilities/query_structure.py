@@ -0,0 +1,103 @@
+import numpy as np
+from scipy import sparse as sp
+
+
+class QueryStructure(object):
+    """Query structure of a training set, built from the query ids of the examples.
+
+    Provides the query indicator matrix P, the query sizes, the normalized indicator
+    matrix whose entries are 1 / sqrt(n_q), and products with the query Laplacian
+    L = D - P * P.T, where D contains the query sizes of the examples. All of these
+    are built with vectorized operations, and the object can be kept and reused for
+    any number of trainings on the same data.
+
+    Parameters
+    ----------
+    qidlist: {array-like}, shape = [n_samples]
+        query id of each training example, any hashable and sortable values
+    qcount: int, optional
+        if given, qidlist must contain integers 0, ..., qcount - 1, which are used as
+        the query indices as such, queries without examples included
+    """
+
+    def __init__(self, qidlist, qcount=None):
+        qidlist = np.asarray(qidlist).ravel()
+        if qcount is None:
+            self.ids, self.qidlist = np.unique(qidlist, return_inverse=True)
+        else:
+            self.ids, self.qidlist = np.arange(qcount), qidlist.astype(np.int64)
+        self.size = len(self.qidlist)
+        self.qcount = len(self.ids)
+        #Number of examples in each query, and for each example in its query
+        self.sizes = np.bincount(self.qidlist, minlength=self.qcount)
+        self.D = self.sizes[self.qidlist].astype(np.float64)
+        rows = np.arange(self.size)
+        self.P = sp.csr_matrix((np.ones(self.size), (rows, self.qidlist)), shape=(self.size, self.qcount))
+        self.PT = self.P.T.tocsr()
+        self.Pnorm = sp.csr_matrix((1. / np.sqrt(self.D), (rows, self.qidlist)), shape=(self.size, self.qcount))
+        self.PnormT = self.Pnorm.T.tocsr()
+        self._indslist = None
+
+
+    def fromIndexLists(cls, qids, size):
+        """Builds the query structure from lists of example indices. The query indices
+        are the positions of the lists in qids, an empty list giving a query of size 0.
+
+        @param qids: the indices of the training examples belonging to each query
+        @type qids: list of lists of ints
+        @param size: number of training examples
+        @type size: int
+        @rtype: QueryStructure"""
+        return cls(indexListsToQidlist(qids, size), len(qids))
+    fromIndexLists = classmethod(fromIndexLists)
+
+
+    def indslist(self):
+        """Returns the indices of the examples in each query, in ascending order.
+
+        @rtype: list of int arrays"""
+        if self._indslist is None:
+            order = np.argsort(self.qidlist, kind='mergesort')
+            self._indslist = np.split(order, np.cumsum(self.sizes)[:-1])
+        return self._indslist
+
+
+    def laplacian_matvec(self, V, normalized=False):
+        """Multiplies V from the left with the query Laplacian L = D - P * P.T, or, if
+        normalized, with I - Pnorm * Pnorm.T, that is, the query-wise centering matrix.
+
+        @param V: matrix whose rows correspond to the training examples
+        @type V: {array-like, matrix}, shape = [n_samples] or [n_samples, n_columns]
+        @return: L * V, of the same type and shape as V"""
+        if normalized:
+            return V - self.Pnorm * (self.PnormT * V)
+        if isinstance(V, np.matrix):
+            return np.multiply(np.mat(self.D).T, V) - self.P * (self.PT * V)
+        D = self.D.reshape((-1,) + (1,) * (np.ndim(V) - 1))
+        return D * V - self.P * (self.PT * V)
+
+
+def indexListsToQidlist(qids, size):
+    """Converts lists of example indices into the query index of each example.
+
+    @param qids: the indices of the training examples belonging to each query
+    @type qids: list of lists of ints
+    @param size: number of training examples
+    @type size: int
+    @return: query index of each example
+    @rtype: int64 array, shape = [size]"""
+    lengths = np.array([len(q) for q in qids], dtype=np.int64)
+    if np.sum(lengths) > 0:
+        inds = np.concatenate([np.asarray(q, dtype=np.int64).ravel() for q in qids])
+    else:
+        inds = np.zeros(0, dtype=np.int64)
+    if np.any(inds >= size):
+        raise Exception("Index %d in query out of training set index bounds" %inds[inds >= size][0])
+    if np.any(inds < 0):
+        raise Exception("Negative index %d in query, query indices must be non-negative" %inds[inds < 0][0])
+    qidlist = -np.ones(size, dtype=np.int64)
+    #As before, an example listed in several queries belongs to the last of them
+    qidlist[inds] = np.repeat(np.arange(len(qids)), lengths)
+    if np.any(qidlist < 0):
+        raise Exception("Not all training examples were assigned a query")
+    return qidlist